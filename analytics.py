@@ -0,0 +1,568 @@
+import math
+from datetime import datetime
+
+import numpy as np
+
+from database import _date_filter, read_transaction
+from instrumentation import timed
+
+
+class Aggregates:
+    """Food/symptom counts and their co-occurrence matrix.
+
+    ``cooccurrence[f, s]`` counts how often food ``f`` was eaten on a day where
+    symptom ``s`` was reported (each occurrence counts).
+    """
+
+    def __init__(self, foods, food_counts, symptoms, symptom_counts, cooccurrence):
+        self.foods = foods
+        self.food_counts = food_counts
+        self.symptoms = symptoms
+        self.symptom_counts = symptom_counts
+        self.cooccurrence = cooccurrence
+
+    def is_empty(self):
+        return not len(self.foods) and not len(self.symptoms)
+
+    def correlation_matrix(self):
+        """Symptom x food matrix, each symptom row normalized to sum to 1.
+
+        Symptoms never reported alongside a food are left out.
+        """
+        matrix = self.cooccurrence.T.astype(float)
+        totals = matrix.sum(axis=1)
+        keep = totals > 0
+        return matrix[keep] / totals[keep, None], [s for s, k in zip(self.symptoms, keep) if k]
+
+
+class EntryColumns:
+    """A user's entries in columnar form, built once per fetch.
+
+    Food, meal and symptom names are interned to integer codes in order of
+    first appearance. Foods and symptoms are stored CSR-style: the rows of
+    entry ``i`` are ``[offsets[i], offsets[i + 1])`` of the code arrays, in
+    the order they were entered. Entries are sorted by date; an entry's
+    intensity is NaN when unknown.
+    """
+
+    def __init__(self, entry_dates, entry_intensity, meals, foods, food_offsets, food_codes, food_meals,
+                 symptoms, symptom_offsets, symptom_codes, symptom_intensity):
+        self.entry_dates = entry_dates
+        self.entry_intensity = entry_intensity
+        self.meals = meals
+        self.foods = foods
+        self.food_offsets = food_offsets
+        self.food_codes = food_codes
+        self.food_meals = food_meals
+        self.symptoms = symptoms
+        self.symptom_offsets = symptom_offsets
+        self.symptom_codes = symptom_codes
+        self.symptom_intensity = symptom_intensity
+
+    def __len__(self):
+        return len(self.entry_dates)
+
+    @property
+    def nbytes(self):
+        return sum(array.nbytes for array in (
+            self.entry_dates, self.entry_intensity, self.food_offsets, self.food_codes, self.food_meals,
+            self.symptom_offsets, self.symptom_codes, self.symptom_intensity,
+        ))
+
+    @property
+    def food_entry(self):
+        """Entry index of every food row."""
+        return _rows_entry(self.food_offsets)
+
+    @property
+    def symptom_entry(self):
+        return _rows_entry(self.symptom_offsets)
+
+    def day_index(self):
+        """``{date: entry index}`` for looking days up while rendering."""
+        return {day: index for index, day in enumerate(self.entry_dates.tolist())}
+
+    def meals_of(self, index):
+        """``{meal: [foods]}`` of one entry, meals in the order they were entered."""
+        start, end = self.food_offsets[index], self.food_offsets[index + 1]
+        repas = {}
+        for meal, code in zip(self.food_meals[start:end].tolist(), self.food_codes[start:end].tolist()):
+            repas.setdefault(self.meals[meal], []).append(self.foods[code])
+        return repas
+
+    def symptoms_of(self, index):
+        start, end = self.symptom_offsets[index], self.symptom_offsets[index + 1]
+        return [self.symptoms[code] for code in self.symptom_codes[start:end].tolist()]
+
+    def foods_by_entry(self):
+        names = np.asarray(self.foods, dtype=object)
+        return [
+            list(names[self.food_codes[start:end]])
+            for start, end in zip(self.food_offsets[:-1], self.food_offsets[1:])
+        ]
+
+
+class AnalysisResult(EntryColumns, Aggregates):
+    """Entry columns plus the counts and co-occurrence the analyses need."""
+
+    def __init__(self, *columns):
+        EntryColumns.__init__(self, *columns)
+        Aggregates.__init__(
+            self,
+            self.foods, np.bincount(self.food_codes, minlength=len(self.foods)),
+            self.symptoms, np.bincount(self.symptom_codes, minlength=len(self.symptoms)),
+            None
+        )
+        self.cooccurrence = self._cooccurrence()
+
+    @classmethod
+    def from_columns(cls, columns):
+        return cls(*(getattr(columns, name) for name in COLUMNS))
+
+    def _cooccurrence(self):
+        n_foods, n_symptoms = len(self.foods), len(self.symptoms)
+        if not n_foods or not n_symptoms:
+            return np.zeros((n_foods, n_symptoms), dtype=np.int64)
+        # Sparse product of the entry x food and entry x symptom incidence
+        # matrices: pair every food row with every symptom row of its entry.
+        food_entry = self.food_entry
+        repeats = np.diff(self.symptom_offsets)[food_entry]
+        total = int(repeats.sum())
+        pair_food = np.repeat(self.food_codes.astype(np.int64), repeats)
+        pair_start = np.repeat(self.symptom_offsets[food_entry], repeats)
+        pair_rank = np.arange(total) - np.repeat(np.cumsum(repeats) - repeats, repeats)
+        pair_symptom = self.symptom_codes[pair_start + pair_rank]
+        flat = np.bincount(pair_food * n_symptoms + pair_symptom, minlength=n_foods * n_symptoms)
+        return flat.reshape(n_foods, n_symptoms)
+
+
+# Constructor arguments of EntryColumns, in order
+COLUMNS = (
+    'entry_dates', 'entry_intensity', 'meals', 'foods', 'food_offsets', 'food_codes', 'food_meals',
+    'symptoms', 'symptom_offsets', 'symptom_codes', 'symptom_intensity',
+)
+CODE_DTYPE = np.int32
+MEAL_DTYPE = np.int16
+INTENSITY_DTYPE = np.float32
+
+
+def _offsets(entry_index, n_entries):
+    offsets = np.zeros(n_entries + 1, dtype=np.int64)
+    np.cumsum(np.bincount(entry_index, minlength=n_entries), out=offsets[1:])
+    return offsets
+
+
+def _rows_entry(offsets):
+    return np.repeat(np.arange(len(offsets) - 1), np.diff(offsets))
+
+
+def _intern(keys):
+    """Codes for ``keys`` numbered by first appearance, plus the unique keys."""
+    keys = np.asarray(keys)
+    if not len(keys):
+        return np.zeros(0, dtype=CODE_DTYPE), keys
+    unique, first, inverse = np.unique(keys, return_index=True, return_inverse=True)
+    order = np.argsort(first, kind='stable')
+    rank = np.empty_like(order)
+    rank[order] = np.arange(len(order))
+    return rank[inverse.ravel()].astype(CODE_DTYPE), unique[order]
+
+
+def _as_array(values, dtype):
+    return np.fromiter(values, dtype=dtype, count=len(values))
+
+
+def _intern_names(names, dtype=CODE_DTYPE):
+    table = {}
+    codes = np.fromiter((table.setdefault(name, len(table)) for name in names),
+                        dtype=dtype, count=len(names))
+    return codes, list(table)
+
+
+def _entry_intensity(n_entries, symptom_offsets, symptom_intensity):
+    # The day's intensity is stored on each of its symptom rows
+    intensity = np.full(n_entries, np.nan, dtype=INTENSITY_DTYPE)
+    has_symptoms = np.diff(symptom_offsets) > 0
+    intensity[has_symptoms] = symptom_intensity[symptom_offsets[:-1][has_symptoms]]
+    return intensity
+
+
+def columns_from_entries(entries):
+    """Build EntryColumns from ``get_entries``-shaped ``(date, repas, symptomes)`` tuples."""
+    entries = sorted(entries, key=lambda entry: entry[0])
+    dates, intensity = [], []
+    food_counts, meal_names, food_names = [], [], []
+    symptom_counts, symptom_names, symptom_intensity = [], [], []
+    for date, aliments, symptomes in entries:
+        dates.append(date)
+        n_foods = 0
+        if isinstance(aliments, dict):
+            for repas, noms in aliments.items():
+                if isinstance(noms, list):
+                    meal_names.extend([repas] * len(noms))
+                    food_names.extend(noms)
+                    n_foods += len(noms)
+        food_counts.append(n_foods)
+        specifiques, level = [], None
+        if isinstance(symptomes, dict):
+            specifiques = symptomes.get('symptomes_specifiques') or []
+            level = symptomes.get('intensite_douleur')
+        level = np.nan if level is None else level
+        intensity.append(level)
+        symptom_counts.append(len(specifiques))
+        symptom_names.extend(specifiques)
+        symptom_intensity.extend([level] * len(specifiques))
+
+    food_codes, foods = _intern_names(food_names)
+    meal_codes, meals = _intern_names(meal_names, MEAL_DTYPE)
+    symptom_codes, symptoms = _intern_names(symptom_names)
+    return EntryColumns(
+        np.array(dates, dtype='datetime64[D]'), _as_array(intensity, INTENSITY_DTYPE),
+        meals, foods, _counts_to_offsets(food_counts), food_codes, meal_codes,
+        symptoms, _counts_to_offsets(symptom_counts), symptom_codes,
+        _as_array(symptom_intensity, INTENSITY_DTYPE),
+    )
+
+
+def _counts_to_offsets(counts):
+    offsets = np.zeros(len(counts) + 1, dtype=np.int64)
+    np.cumsum(_as_array(counts, np.int64), out=offsets[1:])
+    return offsets
+
+
+def analysis_from_entries(entries):
+    """Build an AnalysisResult from ``get_entries``-shaped tuples."""
+    return AnalysisResult.from_columns(columns_from_entries(entries))
+
+
+@timed(kind='query')
+def load_columns(user_email, start_date=None, end_date=None, symptomatic_only=False, after_id=None, until_id=None):
+    """Load a user's entries from the normalized tables as EntryColumns.
+
+    With ``symptomatic_only`` only days that have at least one symptom are
+    loaded, which is all the timeline needs. ``after_id``/``until_id``
+    restrict the entries to ``after_id < id <= until_id``.
+    """
+    clause, params = _date_filter(start_date, end_date)
+    if symptomatic_only:
+        clause += " AND EXISTS (SELECT 1 FROM entry_symptomes x WHERE x.entry_id = e.id)"
+    if after_id is not None:
+        clause += " AND e.id > ?"
+        params.append(after_id)
+    if until_id is not None:
+        clause += " AND e.id <= ?"
+        params.append(until_id)
+    params = (user_email, *params)
+    with read_transaction() as conn:
+        entries = conn.execute(
+            "SELECT e.id, e.date FROM entries e WHERE e.user_email = ?" + clause + " ORDER BY e.date",
+            params
+        ).fetchall()
+        foods = conn.execute(
+            "SELECT ea.entry_id, ea.aliment_id, ea.repas FROM entries e "
+            "JOIN entry_aliments ea ON ea.entry_id = e.id "
+            "WHERE e.user_email = ?" + clause + " ORDER BY e.date, ea.position",
+            params
+        ).fetchall()
+        symptoms = conn.execute(
+            "SELECT es.entry_id, es.symptome_id, es.intensite FROM entries e "
+            "JOIN entry_symptomes es ON es.entry_id = e.id "
+            "WHERE e.user_email = ?" + clause + " ORDER BY e.date, es.position",
+            params
+        ).fetchall()
+        food_names = dict(conn.execute(
+            "SELECT DISTINCT a.id, a.nom FROM entries e "
+            "JOIN entry_aliments ea ON ea.entry_id = e.id "
+            "JOIN aliments a ON a.id = ea.aliment_id "
+            "WHERE e.user_email = ?" + clause,
+            params
+        ).fetchall())
+        symptom_names = dict(conn.execute(
+            "SELECT DISTINCT s.id, s.nom FROM entries e "
+            "JOIN entry_symptomes es ON es.entry_id = e.id "
+            "JOIN symptomes s ON s.id = es.symptome_id "
+            "WHERE e.user_email = ?" + clause,
+            params
+        ).fetchall())
+
+    n_entries = len(entries)
+    position = {row[0]: index for index, row in enumerate(entries)}
+    dates = np.array([datetime.strptime(row[1], '%Y-%m-%d').date() for row in entries],
+                     dtype='datetime64[D]')
+
+    food_codes, food_ids = _intern(_as_array([row[1] for row in foods], np.int64))
+    meal_codes, meals = _intern_names([row[2] for row in foods], MEAL_DTYPE)
+    symptom_codes, symptom_ids = _intern(_as_array([row[1] for row in symptoms], np.int64))
+    symptom_offsets = _offsets(_as_array([position[row[0]] for row in symptoms], np.int64), n_entries)
+    symptom_intensity = _as_array([np.nan if row[2] is None else row[2] for row in symptoms], INTENSITY_DTYPE)
+    return EntryColumns(
+        dates,
+        _entry_intensity(n_entries, symptom_offsets, symptom_intensity),
+        meals,
+        [food_names[i] for i in food_ids.tolist()],
+        _offsets(_as_array([position[row[0]] for row in foods], np.int64), n_entries),
+        food_codes,
+        meal_codes,
+        [symptom_names[i] for i in symptom_ids.tolist()],
+        symptom_offsets,
+        symptom_codes,
+        symptom_intensity,
+    )
+
+
+@timed(kind='query')
+def compute_analysis(user_email, start_date=None, end_date=None, symptomatic_only=False):
+    """``load_columns`` plus the aggregates computed from them."""
+    return AnalysisResult.from_columns(load_columns(user_email, start_date, end_date, symptomatic_only))
+
+
+class Associations:
+    """Food -> symptom associations for lags 0..max_lag days.
+
+    Units are recorded days. For lag ``l`` a food "exposes" day ``t`` and the
+    outcome is the symptom being reported on day ``t + l``; only pairs of days
+    that both have an entry are counted. Arrays are indexed ``[lag, food]``,
+    ``[lag, symptom]`` or ``[lag, food, symptom]``.
+
+    ``p_value`` is one-sided (the symptom is more frequent after the food):
+    Fisher's exact test where an expected cell count is below 5, otherwise
+    the Yates-corrected chi-square. ``q_value`` applies the Benjamini-Hochberg
+    correction over every pair tested. Pairs whose food was eaten on fewer
+    than ``min_support`` days are not tested and have NaN p- and q-values.
+    """
+
+    def __init__(self, foods, symptoms, days, exposed, symptom_days, both, min_support):
+        self.foods = foods
+        self.symptoms = symptoms
+        self.lags = np.arange(len(days))
+        self.days = days
+        self.exposed = exposed
+        self.symptom_days = symptom_days
+        self.both = both
+        self.min_support = min_support
+
+        n = days[:, None, None].astype(float)
+        a = both.astype(float)
+        n_food = exposed[:, :, None].astype(float)
+        n_symptom = symptom_days[:, None, :].astype(float)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            self.conditional = a / n_food
+            self.baseline = n_symptom / n
+            self.lift = self.conditional / self.baseline
+        tested = np.broadcast_to(exposed[:, :, None] >= max(min_support, 1), both.shape)
+        self.p_value = np.where(tested, _one_sided_p_values(a, n_food, n_symptom, n), np.nan)
+        self.q_value = _benjamini_hochberg(self.p_value)
+
+    def is_empty(self):
+        return not np.isfinite(self.p_value).any()
+
+    def top(self, limit=20, alpha=0.05, min_lift=1.0):
+        """Significant pairs (``q_value <= alpha``, ``lift > min_lift``), strongest first.
+
+        Each food/symptom pair appears once, at its most significant lag.
+        """
+        with np.errstate(invalid='ignore'):
+            keep = (self.q_value <= alpha) & (self.lift > min_lift)
+        lags, foods, symptoms = np.nonzero(keep)
+        order = np.lexsort((-self.lift[lags, foods, symptoms], self.q_value[lags, foods, symptoms]))
+        rows, seen = [], set()
+        for i in order.tolist():
+            lag, food, symptom = int(lags[i]), int(foods[i]), int(symptoms[i])
+            if (food, symptom) in seen:
+                continue
+            seen.add((food, symptom))
+            rows.append({
+                'food': self.foods[food],
+                'symptom': self.symptoms[symptom],
+                'lag': lag,
+                'support': int(self.both[lag, food, symptom]),
+                'exposed': int(self.exposed[lag, food]),
+                'conditional': float(self.conditional[lag, food, symptom]),
+                'baseline': float(self.baseline[lag, 0, symptom]),
+                'lift': float(self.lift[lag, food, symptom]),
+                'p_value': float(self.p_value[lag, food, symptom]),
+                'q_value': float(self.q_value[lag, food, symptom]),
+            })
+            if limit is not None and len(rows) >= limit:
+                break
+        return rows
+
+
+_erfc = np.vectorize(math.erfc, otypes=[float])
+EXPECTED_MIN = 5
+
+
+def _one_sided_p_values(a, n_food, n_symptom, n):
+    """P(at least ``a`` co-occurrences) for 2x2 tables given by their margins."""
+    a, n_food, n_symptom, n = np.broadcast_arrays(a, n_food, n_symptom, n)
+    b, c = n_food - a, n_symptom - a
+    d = n - n_food - n_symptom + a
+    with np.errstate(divide='ignore', invalid='ignore'):
+        corrected = np.maximum(np.abs(a * d - b * c) - n / 2, 0)
+        chi2 = n * corrected ** 2 / (n_food * (n - n_food) * n_symptom * (n - n_symptom))
+        expected = np.minimum(n_food, n - n_food) * np.minimum(n_symptom, n - n_symptom) / n
+    chi2 = np.where(np.isfinite(chi2), chi2, 0.0)
+    tail = 0.5 * _erfc(np.sqrt(chi2 / 2))
+    p_values = np.where(a * d > b * c, tail, 1.0 - tail)
+
+    small = np.flatnonzero((expected < EXPECTED_MIN).ravel())
+    if len(small):
+        p_values = p_values.copy()
+        p_values.ravel()[small] = _fisher_greater(
+            *(x.ravel()[small].astype(np.int64) for x in (a, n_food, n_symptom, n))
+        )
+    return p_values
+
+
+def _fisher_greater(a, n_food, n_symptom, n):
+    """Fisher's exact upper tail, summing hypergeometric terms in log space."""
+    log_fact = np.zeros(int(n.max(initial=0)) + 1)
+    np.cumsum(np.log(np.arange(1, len(log_fact))), out=log_fact[1:])
+    k_max = np.minimum(n_food, n_symptom)
+    log_total = log_fact[n] - log_fact[n_symptom] - log_fact[n - n_symptom]
+    p_values = np.zeros(len(a))
+    for step in range(int((k_max - a).max(initial=-1)) + 1):
+        k = a + step
+        live = k <= k_max
+        k, nf, ns, nn = k[live], n_food[live], n_symptom[live], n[live]
+        p_values[live] += np.exp(
+            log_fact[nf] - log_fact[k] - log_fact[nf - k]
+            + log_fact[nn - nf] - log_fact[ns - k] - log_fact[nn - nf - ns + k]
+            - log_total[live]
+        )
+    return np.minimum(p_values, 1.0)
+
+
+def _benjamini_hochberg(p_values):
+    q_values = np.full(p_values.shape, np.nan)
+    flat = p_values.ravel()
+    tested = np.flatnonzero(np.isfinite(flat))
+    if not len(tested):
+        return q_values
+    order = tested[np.argsort(flat[tested], kind='stable')]
+    ranked = flat[order] * len(order) / np.arange(1, len(order) + 1)
+    # Enforce monotonicity from the largest p-value down
+    ranked = np.minimum.accumulate(ranked[::-1])[::-1]
+    q_values.ravel()[order] = np.minimum(ranked, 1.0)
+    return q_values
+
+
+def _day_presence(days, entry, codes, n_codes):
+    """Unique (day, code) pairs sorted by day, as two arrays."""
+    if not len(codes):
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+    keys = np.unique(days[entry] * n_codes + codes)
+    return keys // n_codes, keys % n_codes
+
+
+def lagged_counts(day, food_entry, food_codes, n_foods, symptom_entry, symptom_codes, n_symptoms, max_lag):
+    """Day counts behind ``Associations`` for lags 0..max_lag.
+
+    ``day`` numbers each entry's day (any integer origin); entries ``n`` days
+    apart are ``n`` apart in it. Returns ``(days, exposed, symptom_days, both)``.
+    """
+    n_lags = max_lag + 1
+    days = np.zeros(n_lags, dtype=np.int64)
+    exposed = np.zeros((n_lags, n_foods), dtype=np.int64)
+    symptom_days = np.zeros((n_lags, n_symptoms), dtype=np.int64)
+    both = np.zeros((n_lags, n_foods, n_symptoms), dtype=np.int64)
+    if not len(day):
+        return days, exposed, symptom_days, both
+    day = day - day.min()
+    n_days = int(day.max()) + 1
+    observed = np.zeros(n_days + n_lags, dtype=bool)
+    observed[day] = True
+    food_day, food = _day_presence(day, food_entry, food_codes.astype(np.int64), n_foods)
+    symptom_day, symptom = _day_presence(day, symptom_entry, symptom_codes.astype(np.int64), n_symptoms)
+    symptom_offsets = np.zeros(n_days + n_lags + 1, dtype=np.int64)
+    np.cumsum(np.bincount(symptom_day, minlength=n_days + n_lags), out=symptom_offsets[1:])
+
+    for lag in range(n_lags):
+        days[lag] = np.count_nonzero(observed[:n_days] & observed[lag:n_days + lag])
+        keep = observed[food_day + lag]
+        exposed[lag] = np.bincount(food[keep], minlength=n_foods)
+        keep_symptoms = symptom_day >= lag
+        keep_symptoms[keep_symptoms] = observed[symptom_day[keep_symptoms] - lag]
+        symptom_days[lag] = np.bincount(symptom[keep_symptoms], minlength=n_symptoms)
+
+        # Pair each exposed (day, food) with the symptoms of day + lag
+        target = food_day[keep] + lag
+        repeats = np.diff(symptom_offsets)[target]
+        if not repeats.sum():
+            continue
+        pair_food = np.repeat(food[keep], repeats)
+        pair_start = np.repeat(symptom_offsets[target], repeats)
+        pair_rank = np.arange(int(repeats.sum())) - np.repeat(np.cumsum(repeats) - repeats, repeats)
+        pair_symptom = symptom[pair_start + pair_rank]
+        both[lag] = np.bincount(
+            pair_food * n_symptoms + pair_symptom, minlength=n_foods * n_symptoms
+        ).reshape(n_foods, n_symptoms)
+    return days, exposed, symptom_days, both
+
+
+def lagged_associations(columns, max_lag=3, min_support=5):
+    """Score every food against every symptom reported 0..max_lag days later.
+
+    Works on sparse (day, food) and (day, symptom) presence pairs rather than
+    a dense day x food matrix, so the cost grows with what was recorded, not
+    with catalog size times history length.
+    """
+    counts = lagged_counts(
+        columns.entry_dates.astype(np.int64), columns.food_entry, columns.food_codes, len(columns.foods),
+        columns.symptom_entry, columns.symptom_codes, len(columns.symptoms), max_lag
+    )
+    return Associations(columns.foods, columns.symptoms, *counts, min_support)
+
+
+@timed(kind='query')
+def food_symptom_associations(user_email, start_date=None, end_date=None, max_lag=3, min_support=5):
+    """``lagged_associations`` over a user's entries between two dates."""
+    return lagged_associations(load_columns(user_email, start_date, end_date), max_lag, min_support)
+
+
+def _month(value):
+    return None if value is None else str(value)[:7]
+
+
+@timed(kind='query')
+def load_stats_summary(user_email, start_month=None, end_month=None):
+    """Aggregates for whole months, read from the materialized stats tables.
+
+    ``start_month``/``end_month`` accept 'YYYY-MM' strings or dates.
+    """
+    clause, params = "", [user_email]
+    if start_month is not None:
+        clause += " AND month >= ?"
+        params.append(_month(start_month))
+    if end_month is not None:
+        clause += " AND month <= ?"
+        params.append(_month(end_month))
+    with read_transaction() as conn:
+        foods = conn.execute(
+            "SELECT a.id, a.nom, SUM(st.n) FROM stats_aliments st JOIN aliments a ON a.id = st.aliment_id "
+            "WHERE st.user_email = ?" + clause + " GROUP BY a.id ORDER BY MIN(st.month), a.id",
+            params
+        ).fetchall()
+        symptoms = conn.execute(
+            "SELECT s.id, s.nom, SUM(st.n) FROM stats_symptomes st JOIN symptomes s ON s.id = st.symptome_id "
+            "WHERE st.user_email = ?" + clause + " GROUP BY s.id ORDER BY MIN(st.month), s.id",
+            params
+        ).fetchall()
+        pairs = conn.execute(
+            "SELECT aliment_id, symptome_id, SUM(n) FROM stats_aliment_symptomes "
+            "WHERE user_email = ?" + clause + " GROUP BY aliment_id, symptome_id",
+            params
+        ).fetchall()
+
+    food_index = {row[0]: i for i, row in enumerate(foods)}
+    symptom_index = {row[0]: i for i, row in enumerate(symptoms)}
+    cooccurrence = np.zeros((len(foods), len(symptoms)), dtype=np.int64)
+    if pairs:
+        rows = _as_array([food_index[p[0]] for p in pairs], np.int64)
+        cols = _as_array([symptom_index[p[1]] for p in pairs], np.int64)
+        cooccurrence[rows, cols] = _as_array([p[2] for p in pairs], np.int64)
+    return Aggregates(
+        [row[1] for row in foods], _as_array([row[2] for row in foods], np.int64),
+        [row[1] for row in symptoms], _as_array([row[2] for row in symptoms], np.int64),
+        cooccurrence,
+    )
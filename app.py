@@ -1,7 +1,9 @@
 import streamlit as st
-from database import register_user, login_user, get_aliments, add_aliment, add_entry, get_entries
-from ui_components import saisie_quotidienne, afficher_historique_calendrier
-from data_analysis import analyse_mensuelle
+import instrumentation
+from auth import AuthBusyError
+from storage import get_repository
+from ui_components import saisie_quotidienne, afficher_historique_calendrier, afficher_debug_panel
+from data_analysis import analyse_mensuelle, liberer_rapports
 
 def auth_form():
     st.header("Login / Sign Up")
@@ -12,7 +14,11 @@ def auth_form():
     
     with col1:
         if st.button("Login"):
-            success = login_user(email, password)
+            try:
+                success = repository.login_user(email, password)
+            except AuthBusyError:
+                st.error("Trop de connexions en cours, veuillez réessayer dans un instant.")
+                return
             if success:
                 st.session_state['logged_in'] = True
                 st.session_state['user_email'] = email
@@ -38,7 +44,11 @@ def auth_form():
                 elif not all([first_name, last_name, email, password]):
                     st.error("All fields are required!")
                 else:
-                    success = register_user(email, password, first_name, last_name)
+                    try:
+                        success = repository.register_user(email, password, first_name, last_name)
+                    except AuthBusyError:
+                        st.error("Trop d'inscriptions en cours, veuillez réessayer dans un instant.")
+                        return
                     if success:
                         st.success("You have successfully signed up!")
                         st.session_state['logged_in'] = True
@@ -48,6 +58,9 @@ def auth_form():
                         st.error("This email is already registered.")
 
 def logout():
+    # Les rapports (et leur table jobs) n'existent qu'avec le stockage SQLite
+    if repository.supports_analytics:
+        liberer_rapports()
     st.session_state['logged_in'] = False
     st.session_state['user_email'] = None
     st.session_state['show_signup'] = False
@@ -55,23 +68,34 @@ def logout():
     st.rerun()
 
 def main():
-    st.title("Health Tracking App")
+    with instrumentation.rerun() as stats:
+        st.title("Health Tracking App")
 
-    if st.session_state.get('logged_in'):
-        st.sidebar.button("Logout", on_click=logout)
-        
-        tab1, tab2, tab3 = st.tabs(["Saisie Quotidienne", "Analyse Mensuelle", "Historique Calendrier"])
-        
-        with tab1:
-            saisie_quotidienne(st.session_state['user_email'])
-        
-        with tab2:
-            analyse_mensuelle(st.session_state['user_email'])
-        
-        with tab3:
-            afficher_historique_calendrier(st.session_state['user_email'])
-    else:
-        auth_form()
+        if st.session_state.get('logged_in'):
+            st.sidebar.button("Logout", on_click=logout)
+            
+            tab1, tab2, tab3 = st.tabs(["Saisie Quotidienne", "Analyse Mensuelle", "Historique Calendrier"])
+            
+            with tab1:
+                saisie_quotidienne(st.session_state['user_email'])
+            
+            with tab2:
+                if repository.supports_analytics:
+                    analyse_mensuelle(st.session_state['user_email'])
+                else:
+                    st.info("L'analyse n'est pas encore disponible avec ce stockage.")
+            
+            with tab3:
+                afficher_historique_calendrier(st.session_state['user_email'])
+        else:
+            auth_form()
+
+        if instrumentation.ENABLED:
+            afficher_debug_panel(stats)
+
+# Create/migrate the schema once per process (no-op on later reruns)
+repository = get_repository()
+repository.init_schema()
 
 # Initialize the session state if it doesn't exist
 if 'logged_in' not in st.session_state:
@@ -0,0 +1,76 @@
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+
+from werkzeug.security import check_password_hash, generate_password_hash
+
+# werkzeug method string, e.g. "scrypt:32768:8:1" or "pbkdf2:sha256:600000".
+# Existing hashes keep verifying with the parameters stored in them.
+PASSWORD_METHOD = os.environ.get('FOODDIARY_PASSWORD_METHOD', 'scrypt')
+AUTH_WORKERS = int(os.environ.get('FOODDIARY_AUTH_WORKERS', 4))
+AUTH_QUEUE_LIMIT = int(os.environ.get('FOODDIARY_AUTH_QUEUE', 16))
+AUTH_USE_PROCESSES = os.environ.get('FOODDIARY_AUTH_PROCESSES', '').lower() in ('1', 'true', 'yes')
+AUTH_TIMEOUT = 30.0
+
+
+class AuthBusyError(RuntimeError):
+    """Raised when more hashing requests are waiting than the queue allows,
+    or when a queued request does not finish within AUTH_TIMEOUT."""
+
+
+class AuthExecutor:
+    """Bounded pool that runs the password KDF away from the script threads.
+
+    At most ``workers`` hashes run at once and at most ``queue_limit`` more
+    wait; anything beyond that is rejected immediately with AuthBusyError
+    instead of piling up behind a burst of logins.
+    """
+
+    def __init__(self, workers=AUTH_WORKERS, queue_limit=AUTH_QUEUE_LIMIT, use_processes=AUTH_USE_PROCESSES):
+        pool_class = ProcessPoolExecutor if use_processes else ThreadPoolExecutor
+        options = {} if use_processes else {'thread_name_prefix': 'auth'}
+        self._pool = pool_class(max_workers=workers, **options)
+        self._slots = threading.BoundedSemaphore(workers + queue_limit)
+
+    def submit(self, fn, *args):
+        if not self._slots.acquire(blocking=False):
+            raise AuthBusyError("too many authentication requests in progress")
+        try:
+            future = self._pool.submit(fn, *args)
+        except BaseException:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda _: self._slots.release())
+        return future
+
+    def run(self, fn, *args, timeout=AUTH_TIMEOUT):
+        future = self.submit(fn, *args)
+        try:
+            return future.result(timeout=timeout)
+        except FutureTimeoutError:
+            future.cancel()
+            raise AuthBusyError(f"authentication did not finish within {timeout}s") from None
+
+    def shutdown(self):
+        self._pool.shutdown(wait=False, cancel_futures=True)
+
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_executor():
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = AuthExecutor()
+    return _executor
+
+
+def hash_password(password, method=None):
+    return get_executor().run(generate_password_hash, password, method or PASSWORD_METHOD)
+
+
+def verify_password(password_hash, password):
+    return get_executor().run(check_password_hash, password_hash, password)
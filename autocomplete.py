@@ -0,0 +1,142 @@
+import bisect
+import itertools
+import threading
+import time
+import unicodedata
+from datetime import date
+
+import database
+
+DEFAULT_LIMIT = 50
+# A food eaten this many months ago weighs half as much as one eaten this month
+RECENCY_HALF_LIFE_MONTHS = 3.0
+# Pick up names added by other processes at most this often
+REFRESH_INTERVAL = 60.0
+
+
+def fold(text):
+    """Case- and accent-insensitive form used for matching ("Crème" -> "creme")."""
+    decomposed = unicodedata.normalize('NFKD', text)
+    return ''.join(c for c in decomposed if not unicodedata.combining(c)).casefold()
+
+
+class PrefixIndex:
+    """Food names kept as a sorted array of (folded, name) searched with bisect."""
+
+    def __init__(self, names=()):
+        self._keys = sorted({(fold(name), name) for name in names})
+        self._names = {name for _, name in self._keys}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._keys)
+
+    def __contains__(self, name):
+        return name in self._names
+
+    def add(self, name):
+        self.update((name,))
+
+    def update(self, names):
+        """Add several names in one pass over the array."""
+        with self._lock:
+            new = sorted({(fold(name), name) for name in names if name not in self._names})
+            if not new:
+                return
+            # Copy-on-write so readers iterating the old array are unaffected;
+            # sorting two sorted runs is a linear merge
+            self._keys = sorted(self._keys + new)
+            self._names.update(name for _, name in new)
+
+    def iter_prefix(self, prefix):
+        """Names whose folded form starts with ``fold(prefix)``, alphabetically."""
+        key = fold(prefix)
+        keys = self._keys
+        position = bisect.bisect_left(keys, (key,))
+        while position < len(keys) and keys[position][0].startswith(key):
+            yield keys[position][1]
+            position += 1
+
+    def search(self, prefix, limit=None):
+        return list(itertools.islice(self.iter_prefix(prefix), limit))
+
+
+class FoodCatalog:
+    """Prefix index over the shared ``aliments`` table, loaded once per process."""
+
+    def __init__(self):
+        self.index = PrefixIndex()
+        self._last_id = 0
+        self._refreshed_at = 0.0
+        self._lock = threading.Lock()
+
+    def refresh(self):
+        # aliments.id only grows, so only rows past the last one seen are new
+        with self._lock:
+            rows = database.execute_query(
+                "SELECT id, nom FROM aliments WHERE id > ? ORDER BY id", (self._last_id,), fetch=True
+            )
+            self.index.update(row['nom'] for row in rows)
+            if rows:
+                self._last_id = rows[-1]['id']
+            self._refreshed_at = time.monotonic()
+
+    def ensure_fresh(self):
+        if time.monotonic() - self._refreshed_at > REFRESH_INTERVAL:
+            self.refresh()
+
+    def suggest(self, user_email, prefix='', limit=DEFAULT_LIMIT):
+        """Top ``limit`` catalog names matching ``prefix``.
+
+        Foods from the user's own history come first, ranked by how often
+        and how recently they were eaten; the rest follow alphabetically.
+        """
+        self.ensure_fresh()
+        history = database.get_aliment_history(user_email)
+        scores = _history_scores(history)
+        if prefix:
+            candidates = self.index.search(prefix)
+            ranked = sorted((name for name in candidates if name in scores),
+                            key=lambda name: (-scores[name], fold(name)))
+            others = (name for name in candidates if name not in scores)
+        else:
+            ranked = sorted((name for name in scores if name in self.index),
+                            key=lambda name: (-scores[name], fold(name)))
+            others = (name for name in self.index.iter_prefix('') if name not in scores)
+        suggestions = ranked[:limit]
+        for name in others:
+            if len(suggestions) >= limit:
+                break
+            suggestions.append(name)
+        return suggestions
+
+
+def _history_scores(history):
+    today = date.today()
+    current = today.year * 12 + today.month
+    scores = {}
+    for name, (count, last_month) in history.items():
+        year, month = map(int, last_month.split('-'))
+        age = max(current - (year * 12 + month), 0)
+        scores[name] = count * 0.5 ** (age / RECENCY_HALF_LIFE_MONTHS)
+    return scores
+
+
+_catalog = None
+_catalog_lock = threading.Lock()
+
+
+def get_catalog():
+    global _catalog
+    if _catalog is None:
+        with _catalog_lock:
+            if _catalog is None:
+                catalog = FoodCatalog()
+                catalog.refresh()
+                database.add_catalog_listener(catalog.refresh)
+                _catalog = catalog
+    return _catalog
+
+
+def suggest_foods(user_email, prefix='', limit=DEFAULT_LIMIT):
+    return get_catalog().suggest(user_email, prefix, limit)
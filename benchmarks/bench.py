@@ -0,0 +1,185 @@
+import argparse
+import json
+import math
+import os
+import platform
+import sqlite3
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import date, datetime, timedelta
+
+import database
+from db_pool import DEFAULT_STORAGE_PROFILE, STORAGE_PROFILES
+from benchmarks import synthetic_data
+
+
+def percentile(values, q):
+    ordered = sorted(values)
+    rank = max(math.ceil(q / 100 * len(ordered)) - 1, 0)
+    return ordered[rank]
+
+
+def run_case(fn, repeat, warmup=1):
+    for _ in range(warmup):
+        fn()
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        timings.append((time.perf_counter() - start) * 1000)
+    # Peak memory is measured in a separate call: tracemalloc slows the code down
+    tracemalloc.start()
+    try:
+        fn()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return {
+        'repeat': repeat,
+        'p50_ms': round(percentile(timings, 50), 3),
+        'p95_ms': round(percentile(timings, 95), 3),
+        'mean_ms': round(sum(timings) / len(timings), 3),
+        'min_ms': round(min(timings), 3),
+        'peak_kib': round(peak / 1024, 1),
+    }
+
+
+def build_cases(user_email, today):
+    import analytics
+    import data_analysis
+
+    week_start = today - timedelta(days=today.weekday() + 7)
+    write_day = date(2100, 1, 1)
+    sample = database.get_entry(user_email, week_start) or (
+        week_start, {"Déjeuner": ["pain"]}, {"symptomes_specifiques": [], "intensite_douleur": 0, "autres_symptomes": ""}
+    )
+    summary = analytics.load_stats_summary(user_email)
+    timeline = analytics.compute_analysis(user_email, symptomatic_only=True)
+    full = analytics.compute_analysis(user_email)
+
+    cases = {
+        'db.get_entries': lambda: database.get_entries(user_email),
+        'db.get_entries_between.week': lambda: database.get_entries_between(
+            user_email, week_start, week_start + timedelta(days=6)),
+        'db.get_entry': lambda: database.get_entry(user_email, week_start),
+        'db.get_aliments': database.get_aliments,
+        'db.save_day': lambda: database.save_day(user_email, write_day, sample[1], sample[2]),
+        'db.save_days.100': lambda: database.save_days(
+            (user_email, write_day + timedelta(days=i), sample[1], sample[2]) for i in range(100)),
+        'analysis.compute_analysis': lambda: analytics.compute_analysis(user_email),
+        'analysis.load_stats_summary': lambda: analytics.load_stats_summary(user_email),
+        'analysis.prepare_data': lambda: data_analysis.prepare_data(timeline),
+        'analysis.calculate_correlation': lambda: data_analysis.calculate_correlation(summary),
+        'analysis.calculate_correlation.full': lambda: data_analysis.calculate_correlation(full),
+    }
+    try:
+        import ui_components
+    except ImportError:
+        pass
+    else:
+        cases['ui.afficher_historique_calendrier'] = lambda: ui_components.afficher_historique_calendrier(user_email)
+    return cases
+
+
+def compare(results, baseline, threshold):
+    """Print p50 ratios against a previous run; return the regressed case names."""
+    regressions = []
+    for name, result in results.items():
+        previous = baseline.get('results', {}).get(name)
+        if previous is None:
+            continue
+        ratio = result['p50_ms'] / previous['p50_ms'] if previous['p50_ms'] else float('inf')
+        flag = ''
+        if ratio > 1 + threshold:
+            flag = '  REGRESSION'
+            regressions.append(name)
+        print(f"{name:45} {previous['p50_ms']:10.3f} -> {result['p50_ms']:10.3f} ms  x{ratio:5.2f}{flag}")
+    return regressions
+
+
+def copy_database(source, target):
+    """Consistent copy of ``source``, WAL content included."""
+    src = sqlite3.connect(f"file:{source}?mode=ro", uri=True)
+    dst = sqlite3.connect(target)
+    try:
+        src.backup(dst)
+    finally:
+        dst.close()
+        src.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark database and analysis hot paths")
+    parser.add_argument('--db', help="existing database to benchmark, on a temporary copy (default: generate one)")
+    parser.add_argument('--users', type=int, default=5)
+    parser.add_argument('--days', type=int, default=730)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--user', help="user to benchmark (default: first synthetic user)")
+    parser.add_argument('--repeat', type=int, default=20)
+    parser.add_argument('--only', help="run only cases whose name contains this text")
+    parser.add_argument('--profile', default=DEFAULT_STORAGE_PROFILE, choices=sorted(STORAGE_PROFILES),
+                        help="storage profile used while measuring")
+    parser.add_argument('--with-cache', action='store_true', help="keep the query cache enabled")
+    parser.add_argument('--output', help="write results as JSON to this file")
+    parser.add_argument('--compare', help="JSON file from a previous run to compare against")
+    parser.add_argument('--threshold', type=float, default=0.2,
+                        help="relative p50 slowdown reported as a regression (default: 0.2)")
+    args = parser.parse_args(argv)
+
+    today = date.today()
+    with tempfile.TemporaryDirectory() as workdir:
+        db_path = os.path.join(workdir, 'bench.db')
+        if args.db is None:
+            synthetic_data.generate(db_path, args.users, args.days, args.seed,
+                                    start=today - timedelta(days=args.days))
+        else:
+            # The write cases add days: measure a copy, never the given file
+            copy_database(args.db, db_path)
+        # The generator writes with the "fast" profile; measure with the requested one
+        database.configure_pool(db_path, storage_profile=args.profile)
+        database.init_db()
+        if not args.with_cache:
+            database.query_cache.max_bytes = 0
+
+        user_email = args.user or synthetic_data.user_email(0)
+        cases = build_cases(user_email, today)
+        results = {}
+        for name, fn in cases.items():
+            if args.only and args.only not in name:
+                continue
+            results[name] = run_case(fn, args.repeat)
+            print(f"{name:45} p50 {results[name]['p50_ms']:10.3f} ms  p95 {results[name]['p95_ms']:10.3f} ms  "
+                  f"peak {results[name]['peak_kib']:10.1f} KiB")
+        database.close_pool()
+
+    report = {
+        'meta': {
+            'timestamp': datetime.now().isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'sqlite': sqlite3.sqlite_version,
+            'platform': platform.platform(),
+            'db': args.db,
+            'users': args.users,
+            'days': args.days,
+            'seed': args.seed,
+            'repeat': args.repeat,
+            'cache': args.with_cache,
+            'profile': args.profile,
+        },
+        'results': results,
+    }
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        if compare(results, baseline, args.threshold):
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
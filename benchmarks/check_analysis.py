@@ -0,0 +1,119 @@
+"""Check the vectorized analysis against the original Counter-based code.
+
+    python -m benchmarks.check_analysis [--entries 300] [--seed 0]
+
+Random diary days go through both the reference implementation below (the
+pre-columnar ``data_analysis`` code) and ``analytics``, once from
+``get_entries``-shaped tuples and once through a scratch database and
+``compute_analysis``. Food and symptom counts, correlation values and
+timeline rows must agree; only label order may differ.
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+from collections import Counter
+from datetime import date
+
+import numpy as np
+import pandas as pd
+
+import analytics
+import database
+from benchmarks import synthetic_data
+from data_analysis import calculate_correlation, prepare_data
+
+
+def reference_counts(entries):
+    foods = Counter(aliment for entry in entries for repas in entry[1].values() for aliment in repas)
+    symptoms = Counter(symptom for entry in entries for symptom in entry[2]['symptomes_specifiques'])
+    return dict(foods), dict(symptoms)
+
+
+def reference_correlation(entries):
+    aliments_symptoms = {}
+    for entry in entries:
+        aliments = [item for sublist in entry[1].values() for item in sublist]
+        symptoms = entry[2]['symptomes_specifiques']
+        for aliment in aliments:
+            aliments_symptoms.setdefault(aliment, Counter()).update(symptoms)
+    all_symptoms = list({symptom for counters in aliments_symptoms.values() for symptom in counters})
+    correlation = pd.DataFrame({aliment: [counter.get(symptom, 0) for symptom in all_symptoms]
+                                for aliment, counter in aliments_symptoms.items()}, index=all_symptoms)
+    return correlation.div(correlation.sum(axis=1), axis=0)
+
+
+def reference_timeline(entries):
+    return [
+        (date_, symptome, symptomes['intensite_douleur'], [item for sublist in aliments.values() for item in sublist])
+        for date_, aliments, symptomes in entries
+        for symptome in symptomes['symptomes_specifiques']
+    ]
+
+
+def compare(entries, analysis, label):
+    """Differences between the reference results and ``analysis``, as messages."""
+    problems = []
+    foods, symptoms = reference_counts(entries)
+    if dict(zip(analysis.foods, analysis.food_counts.tolist())) != foods:
+        problems.append(f"{label}: food counts differ")
+    if dict(zip(analysis.symptoms, analysis.symptom_counts.tolist())) != symptoms:
+        problems.append(f"{label}: symptom counts differ")
+
+    expected = reference_correlation(entries)
+    actual = calculate_correlation(analysis)
+    expected = expected.reindex(index=sorted(expected.index), columns=sorted(expected.columns))
+    actual = actual.reindex(index=sorted(actual.index), columns=sorted(actual.columns))
+    if list(expected.index) != list(actual.index) or list(expected.columns) != list(actual.columns):
+        problems.append(f"{label}: correlation labels differ")
+    elif not np.allclose(expected.to_numpy(), actual.to_numpy(), equal_nan=True):
+        problems.append(f"{label}: correlation values differ")
+
+    df = prepare_data(analysis)
+    timeline = [
+        (pd.Timestamp(row.date).date(), row.symptome, row.intensite, list(row.aliments))
+        for row in df.itertuples(index=False)
+    ]
+    if timeline != reference_timeline(entries):
+        problems.append(f"{label}: timeline rows differ")
+    return problems
+
+
+def random_entries(count, seed):
+    rng = random.Random(seed)
+    catalog = synthetic_data.build_catalog(30, rng)
+    rows = synthetic_data.generate_days('check@example.com', count, date(2024, 1, 1), catalog, rng, skip_rate=0)
+    return [(day, repas, symptomes) for _, day, repas, symptomes in rows]
+
+
+def check(count=300, seed=0):
+    entries = random_entries(count, seed)
+    problems = compare(entries, analytics.analysis_from_entries(entries), "from entries")
+
+    with tempfile.TemporaryDirectory() as scratch:
+        previous = database.DB_NAME
+        database.configure_pool(os.path.join(scratch, 'check.db'))
+        try:
+            database.init_db()
+            database.save_days(('check@example.com', *entry) for entry in entries)
+            problems += compare(entries, analytics.compute_analysis('check@example.com'), "from the database")
+        finally:
+            database.configure_pool(previous)
+    return problems
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Check the vectorized analysis against the Counter-based code")
+    parser.add_argument('--entries', type=int, default=300)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args(argv)
+    problems = check(args.entries, args.seed)
+    for problem in problems:
+        print(problem)
+    print("Analysis matches the reference." if not problems else f"{len(problems)} mismatches.")
+    return 1 if problems else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,62 @@
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+
+from benchmarks.bench import percentile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Imports app.py the way `streamlit run` does and renders the login form;
+# reports elapsed times and which heavy libraries ended up loaded.
+PROBE = r'''
+import json, sys, time
+start = time.perf_counter()
+import app
+imported = time.perf_counter()
+app.main()
+rendered = time.perf_counter()
+print(json.dumps({
+    'import_ms': (imported - start) * 1000,
+    'login_ms': (rendered - start) * 1000,
+    'loaded': sorted(m for m in ('pandas', 'plotly', 'numpy') if m in sys.modules),
+}))
+'''
+
+
+def measure(repeat, db_path):
+    env = dict(os.environ, PYTHONDONTWRITEBYTECODE='0')
+    samples = []
+    for _ in range(repeat):
+        out = subprocess.run(
+            [sys.executable, '-c', PROBE], cwd=db_path, env=dict(env, PYTHONPATH=ROOT),
+            capture_output=True, text=True, check=True
+        ).stdout
+        samples.append(json.loads(out.strip().splitlines()[-1]))
+    return {
+        'repeat': repeat,
+        'import_p50_ms': round(percentile([s['import_ms'] for s in samples], 50), 1),
+        'login_p50_ms': round(percentile([s['login_ms'] for s in samples], 50), 1),
+        'login_p95_ms': round(percentile([s['login_ms'] for s in samples], 95), 1),
+        'heavy_modules_loaded': samples[-1]['loaded'],
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Measure cold start and login page latency")
+    parser.add_argument('--repeat', type=int, default=10)
+    parser.add_argument('--output', help="write results as JSON to this file")
+    args = parser.parse_args(argv)
+    # Run in an empty directory so the probe creates its own database file
+    with tempfile.TemporaryDirectory() as workdir:
+        result = measure(args.repeat, workdir)
+    print(json.dumps(result, indent=2))
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(result, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
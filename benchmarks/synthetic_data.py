@@ -0,0 +1,136 @@
+import argparse
+import itertools
+import random
+from datetime import date, timedelta
+
+from werkzeug.security import generate_password_hash
+
+import database
+
+REPAS = ["Petit Déjeuner", "Déjeuner", "Goûter", "Dîner"]
+
+# Same labels as the checkboxes in ui_components.saisie_symptomes
+SYMPTOMES = [
+    "Nausées 🤢", "Diarrhée 💩", "Constipation 🚽", "Ballonnements 🎈",
+    "Douleurs abdominales 🔥", "Brûlures d'estomac 🔥", "Reflux acide 🌋",
+    "Perte d'appétit 🍽️", "Fatigue 😴", "Vomissement 🤮",
+]
+
+ALIMENTS_PAR_REPAS = {
+    "Petit Déjeuner": ["pain", "beurre", "confiture", "café", "thé", "lait", "céréales",
+                       "yaourt", "jus d'orange", "croissant", "oeufs", "banane"],
+    "Déjeuner": ["poulet", "riz", "pâtes", "salade", "tomates", "fromage", "steak",
+                 "poisson", "frites", "lentilles", "tabboulé", "pain", "pomme de terre"],
+    "Goûter": ["pomme", "chocolat", "biscuits", "yaourt", "compote", "amandes",
+               "pain au chocolat", "thé", "café"],
+    "Dîner": ["soupe", "jambon", "quiche", "pizza", "haricots verts", "riz", "oeufs",
+              "fromage", "salade", "poisson", "crème fraîche", "chou-fleur"],
+}
+VARIANTES = ["bio", "maison", "complet", "allégé", "épicé", "au four", "grillé", "vapeur"]
+
+
+def build_catalog(size, rng):
+    """Base foods plus "<food> <variant> N" long-tail names up to ``size`` per meal."""
+    catalog = {}
+    for repas, base in ALIMENTS_PAR_REPAS.items():
+        names = list(base)
+        while len(names) < size:
+            names.append(f"{rng.choice(base)} {rng.choice(VARIANTES)} {len(names)}")
+        catalog[repas] = names
+    return catalog
+
+
+def generate_days(user_email, days, start, catalog, rng, skip_rate=0.1):
+    """Yield (user_email, date, repas, symptomes) rows for one synthetic user.
+
+    Each user prefers a few foods per meal (Zipf-like weights) and reacts to
+    one to three trigger foods with symptoms zero to two days later.
+    """
+    weights = {
+        repas: [1.0 / rank for rank in range(1, len(names) + 1)]
+        for repas, names in catalog.items()
+    }
+    # Everyday foods first, then the long tail, each shuffled per user
+    preferred = {
+        repas: rng.sample(names[:len(ALIMENTS_PAR_REPAS[repas])], len(ALIMENTS_PAR_REPAS[repas]))
+        + rng.sample(names[len(ALIMENTS_PAR_REPAS[repas]):], len(names) - len(ALIMENTS_PAR_REPAS[repas]))
+        for repas, names in catalog.items()
+    }
+    triggers = {
+        rng.choice(preferred[rng.choice(REPAS)][:10]): (rng.choice(SYMPTOMES), rng.randint(0, 2))
+        for _ in range(rng.randint(1, 3))
+    }
+    pending = {}
+
+    for offset in range(days):
+        day = start + timedelta(days=offset)
+        if rng.random() < skip_rate:
+            pending.pop(day, None)
+            continue
+        repas = {
+            nom: rng.choices(preferred[nom], weights[nom], k=rng.randint(0 if nom == "Goûter" else 1, 4))
+            for nom in REPAS
+        }
+        eaten = {aliment for aliments in repas.values() for aliment in aliments}
+        for aliment in eaten & triggers.keys():
+            symptome, lag = triggers[aliment]
+            if rng.random() < 0.7:
+                pending.setdefault(day + timedelta(days=lag), set()).add(symptome)
+        symptomes = pending.pop(day, set())
+        if rng.random() < 0.05:
+            symptomes.add(rng.choice(SYMPTOMES))
+        yield (
+            user_email,
+            day,
+            {nom: list(dict.fromkeys(aliments)) for nom, aliments in repas.items()},
+            {
+                "symptomes_specifiques": sorted(symptomes),
+                "intensite_douleur": rng.randint(2, 9) if symptomes else 0,
+                "autres_symptomes": "",
+            },
+        )
+
+
+def user_email(index):
+    return f"user{index}@example.com"
+
+
+def generate(db_path, users=10, days=365, seed=0, start=None, catalog_size=50, chunk_size=1000):
+    """Fill ``db_path`` with ``users`` x ``days`` diary entries; returns write counts."""
+    rng = random.Random(seed)
+    start = start or date.today() - timedelta(days=days)
+    database.configure_pool(db_path, storage_profile='fast')
+    database.init_db()
+
+    # One hash for everyone: the KDF would otherwise dominate generation time
+    password = generate_password_hash('password')
+    with database.get_db_connection() as conn:
+        conn.executemany(
+            "INSERT OR IGNORE INTO users (email, password, first_name, last_name) VALUES (?, ?, ?, ?)",
+            [(user_email(i), password, "Test", f"User {i}") for i in range(users)]
+        )
+        conn.commit()
+
+    catalog = build_catalog(catalog_size, rng)
+    rows = itertools.chain.from_iterable(
+        generate_days(user_email(i), days, start, catalog, random.Random(rng.random()))
+        for i in range(users)
+    )
+    return database.save_days(rows, chunk_size=chunk_size)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Generate a synthetic food diary database")
+    parser.add_argument('db', help="SQLite file to create or extend")
+    parser.add_argument('--users', type=int, default=10)
+    parser.add_argument('--days', type=int, default=365)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--start', type=date.fromisoformat, help="first day (YYYY-MM-DD)")
+    parser.add_argument('--catalog-size', type=int, default=50, help="foods per meal")
+    args = parser.parse_args(argv)
+    counts = generate(args.db, args.users, args.days, args.seed, args.start, args.catalog_size)
+    print(f"{args.db}: {counts['inserted']} days inserted, {counts['updated']} updated")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,223 @@
+import json
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import datetime
+
+import numpy as np
+
+import database
+from analytics import Associations, lagged_counts
+from database import get_db_connection
+
+COHORT_WORKERS = int(os.environ.get('FOODDIARY_COHORT_WORKERS', 0)) or os.cpu_count() or 1
+# Shards are sized in entries; several per worker keep the pool balanced
+SHARD_ENTRIES = 50000
+SHARDS_PER_WORKER = 4
+MIN_USERS = 3
+
+
+class CohortCounts:
+    """Lagged food/symptom day counts summed over a set of users.
+
+    Arrays are indexed by catalog id (``aliments.id``, ``symptomes.id``) so
+    partial counts from different shards add up element-wise. Lags never
+    cross users: each user's days only pair with their own later days.
+    ``food_users[f]`` counts the users who ate food ``f`` at least once.
+    """
+
+    def __init__(self, n_foods, n_symptoms, max_lag):
+        n_lags = max_lag + 1
+        self.users = 0
+        self.entries = 0
+        self.days = np.zeros(n_lags, dtype=np.int64)
+        self.exposed = np.zeros((n_lags, n_foods), dtype=np.int64)
+        self.symptom_days = np.zeros((n_lags, n_symptoms), dtype=np.int64)
+        self.both = np.zeros((n_lags, n_foods, n_symptoms), dtype=np.int64)
+        self.food_users = np.zeros(n_foods, dtype=np.int64)
+
+    def merge(self, other):
+        """Add another shard's counts into this one (the reduce step)."""
+        self.users += other.users
+        self.entries += other.entries
+        for name in ('days', 'exposed', 'symptom_days', 'both', 'food_users'):
+            getattr(self, name).__iadd__(getattr(other, name))
+        return self
+
+    def associations(self, food_names, symptom_names, min_support=20, min_users=MIN_USERS):
+        """``Associations`` over the foods eaten by at least ``min_users`` users.
+
+        ``food_names``/``symptom_names`` map catalog ids to names.
+        """
+        foods = np.flatnonzero((self.food_users >= min_users) & (self.exposed[0] > 0))
+        symptoms = np.flatnonzero(self.symptom_days.sum(axis=0) > 0)
+        return Associations(
+            [food_names[i] for i in foods.tolist()],
+            [symptom_names[i] for i in symptoms.tolist()],
+            self.days,
+            self.exposed[:, foods],
+            self.symptom_days[:, symptoms],
+            self.both[:, foods][:, :, symptoms],
+            min_support,
+        )
+
+
+def shard_users(user_counts, n_shards):
+    """Split ``{user: entries}`` into ``n_shards`` lists of similar entry totals.
+
+    Largest users first, each into the currently lightest shard.
+    """
+    shards = [[] for _ in range(max(n_shards, 1))]
+    totals = [0] * len(shards)
+    for user_email, count in sorted(user_counts.items(), key=lambda item: (-item[1], item[0])):
+        lightest = totals.index(min(totals))
+        shards[lightest].append(user_email)
+        totals[lightest] += count
+    return [shard for shard in shards if shard]
+
+
+def _init_worker(db_name):
+    database.configure_pool(db_name, max_size=1)
+
+
+def shard_counts(user_emails, n_foods, n_symptoms, max_lag):
+    """CohortCounts of a few users, read from the normalized tables in three queries."""
+    with get_db_connection() as conn:
+        conn.execute("CREATE TEMP TABLE IF NOT EXISTS cohort_users (user_email TEXT PRIMARY KEY)")
+        conn.execute("DELETE FROM temp.cohort_users")
+        conn.executemany("INSERT INTO temp.cohort_users (user_email) VALUES (?)", [(u,) for u in user_emails])
+        # CROSS JOIN pins the loop order to users -> entries -> links; left to
+        # the planner it scans every link row of the database for each shard
+        shard = "FROM temp.cohort_users u CROSS JOIN entries e ON e.user_email = u.user_email "
+        entries = conn.execute("SELECT e.id, e.user_email, CAST(julianday(e.date) AS INTEGER) " + shard).fetchall()
+        foods = conn.execute(
+            "SELECT ea.entry_id, ea.aliment_id " + shard + "CROSS JOIN entry_aliments ea ON ea.entry_id = e.id"
+        ).fetchall()
+        symptoms = conn.execute(
+            "SELECT es.entry_id, es.symptome_id " + shard + "CROSS JOIN entry_symptomes es ON es.entry_id = e.id"
+        ).fetchall()
+        conn.execute("DELETE FROM temp.cohort_users")
+        conn.commit()
+
+    counts = CohortCounts(n_foods, n_symptoms, max_lag)
+    if not entries:
+        return counts
+    entry_ids = np.array([row[0] for row in entries], dtype=np.int64)
+    _, user = np.unique([row[1] for row in entries], return_inverse=True)
+    julian = np.array([row[2] for row in entries], dtype=np.int64)
+    n_users = int(user.max()) + 1
+
+    # Lay the users' timelines end to end with max_lag + 1 empty days between
+    # them, so one pass over the shard never pairs days of different users
+    first = np.full(n_users, np.iinfo(np.int64).max)
+    last = np.full(n_users, np.iinfo(np.int64).min)
+    np.minimum.at(first, user, julian)
+    np.maximum.at(last, user, julian)
+    span = last - first + 1 + max_lag + 1
+    base = np.concatenate(([0], np.cumsum(span)[:-1]))
+    day = julian - first[user] + base[user]
+
+    order = np.argsort(entry_ids)
+    sorted_ids = entry_ids[order]
+
+    def entry_of(rows):
+        ids = np.array([row[0] for row in rows], dtype=np.int64)
+        codes = np.array([row[1] for row in rows], dtype=np.int64)
+        return order[np.searchsorted(sorted_ids, ids)], codes
+
+    food_entry, food_codes = entry_of(foods)
+    symptom_entry, symptom_codes = entry_of(symptoms)
+    counts.users = n_users
+    counts.entries = len(entries)
+    counts.days, counts.exposed, counts.symptom_days, counts.both = lagged_counts(
+        day, food_entry, food_codes, n_foods, symptom_entry, symptom_codes, n_symptoms, max_lag
+    )
+    eaters = np.unique(user[food_entry] * n_foods + food_codes) % n_foods
+    counts.food_users = np.bincount(eaters, minlength=n_foods)
+    return counts
+
+
+def _catalog(conn, table):
+    names = dict(conn.execute(f"SELECT id, nom FROM {table}").fetchall())
+    return names, max(names, default=0) + 1
+
+
+def compute_cohort(max_lag=3, workers=None, shard_entries=SHARD_ENTRIES, progress=None):
+    """Merged CohortCounts of every user, plus the catalogs and run details.
+
+    Users are sharded by entry count and each shard is counted in a worker
+    process (``workers=0`` counts inline); partial counts are merged as
+    shards finish. ``progress`` is called with (shards done, shard count).
+    """
+    workers = COHORT_WORKERS if workers is None else workers
+    started = time.perf_counter()
+    with get_db_connection() as conn:
+        user_counts = dict(conn.execute("SELECT user_email, COUNT(*) FROM entries GROUP BY user_email").fetchall())
+        food_names, n_foods = _catalog(conn, 'aliments')
+        symptom_names, n_symptoms = _catalog(conn, 'symptomes')
+    n_shards = max(workers * SHARDS_PER_WORKER, -(-sum(user_counts.values()) // shard_entries))
+    shards = shard_users(user_counts, n_shards)
+
+    total = CohortCounts(n_foods, n_symptoms, max_lag)
+    if workers > 0:
+        # Spawned workers open their own connections instead of inheriting
+        # the parent's pool and threads through fork
+        pool = ProcessPoolExecutor(
+            max_workers=workers, mp_context=multiprocessing.get_context('spawn'),
+            initializer=_init_worker, initargs=(database.DB_NAME,)
+        )
+        try:
+            futures = [pool.submit(shard_counts, shard, n_foods, n_symptoms, max_lag) for shard in shards]
+            for done, future in enumerate(as_completed(futures), 1):
+                total.merge(future.result())
+                if progress is not None:
+                    progress(done, len(shards))
+        finally:
+            pool.shutdown(cancel_futures=True)
+    else:
+        for done, shard in enumerate(shards, 1):
+            total.merge(shard_counts(shard, n_foods, n_symptoms, max_lag))
+            if progress is not None:
+                progress(done, len(shards))
+    run = {'workers': workers, 'shards': len(shards), 'seconds': time.perf_counter() - started}
+    return total, food_names, symptom_names, run
+
+
+def cohort_report(path, max_lag=3, min_support=20, min_users=MIN_USERS, alpha=0.05, workers=None,
+                  progress=None):
+    """Compute the cohort associations and write them to ``path`` as JSON."""
+    counts, food_names, symptom_names, run = compute_cohort(max_lag, workers, progress=progress)
+    associations = counts.associations(food_names, symptom_names, min_support, min_users)
+    food_ids = {nom: food_id for food_id, nom in food_names.items()}
+    report = {
+        'generated_at': datetime.now().isoformat(timespec='seconds'),
+        'database': database.DB_NAME,
+        'users': counts.users,
+        'entries': counts.entries,
+        'max_lag': max_lag,
+        'min_support': min_support,
+        'min_users': min_users,
+        'alpha': alpha,
+        'run': run,
+        'associations': [
+            dict(row, users=int(counts.food_users[food_ids[row['food']]]))
+            for row in associations.top(limit=None, alpha=alpha)
+        ],
+    }
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=1)
+    return report
+
+
+def benchmark(worker_counts, max_lag=3, repeat=3):
+    """Best-of-``repeat`` wall time of ``compute_cohort`` per worker count.
+
+    Returns rows of (workers, seconds, speedup relative to the first count).
+    Pool start-up is included: it is part of what a run costs.
+    """
+    rows = []
+    for workers in worker_counts:
+        best = min(compute_cohort(max_lag, workers)[3]['seconds'] for _ in range(repeat))
+        rows.append((workers, best, rows[0][1] / best if rows else 1.0))
+    return rows
@@ -0,0 +1,204 @@
+"""Behaviour every storage.Repository must share, runnable against any backend.
+
+    python manage.py conformance [--backend postgres --dsn ...]
+
+Each check works on accounts of its own under a per-run email prefix, so it
+can run against a live database without touching real users, but it does
+leave its rows behind: point it at a scratch database.
+"""
+import os
+import threading
+import uuid
+from datetime import date, timedelta
+
+import database
+import storage
+from storage import DuplicateEntryError
+
+CHECKS = []
+
+DAY = date(2024, 3, 10)
+REPAS = {'Petit-déjeuner': ['Pain', 'Beurre'], 'Déjeuner': ['Riz'], 'Dîner': []}
+APP_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'app.py')
+SYMPTOMES = {'symptomes_specifiques': ['Ballonnements'], 'intensite_douleur': 3, 'autres_symptomes': ''}
+
+
+class ConformanceError(AssertionError):
+    pass
+
+
+def check(fn):
+    CHECKS.append(fn)
+    return fn
+
+
+def expect(condition, message):
+    if not condition:
+        raise ConformanceError(message)
+
+
+def expect_equal(actual, expected, what):
+    expect(actual == expected, f"{what}: expected {expected!r}, got {actual!r}")
+
+
+@check
+def users(repository, email):
+    expect(repository.register_user(email, 'secret-1', 'Ada', 'Test'), "registering a new email failed")
+    expect(not repository.register_user(email, 'other', 'Ada', 'Test'), "a taken email was registered again")
+    expect(repository.login_user(email, 'secret-1'), "login with the right password failed")
+    expect(not repository.login_user(email, 'wrong'), "login with a wrong password succeeded")
+    expect(not repository.login_user('unknown-' + email, 'secret-1'), "login of an unknown email succeeded")
+
+
+@check
+def entry_lifecycle(repository, email):
+    expect_equal(repository.get_entry(email, DAY), None, "missing entry")
+    repository.add_entry(email, DAY, REPAS, SYMPTOMES)
+    expect_equal(repository.get_entry(email, DAY), (DAY, REPAS, SYMPTOMES), "added entry")
+    expect_equal(repository.get_entry(email, DAY.isoformat()), (DAY, REPAS, SYMPTOMES), "entry by ISO date")
+    try:
+        repository.add_entry(email, DAY, {}, {})
+    except DuplicateEntryError:
+        pass
+    else:
+        raise ConformanceError("adding the same day twice did not raise DuplicateEntryError")
+
+    changed = {'Dîner': ['Soupe']}
+    repository.update_entry(email, DAY, changed, {})
+    expect_equal(repository.get_entry(email, DAY), (DAY, changed, {}), "updated entry")
+    repository.update_entry(email, DAY + timedelta(days=1), changed, {})
+    expect_equal(repository.get_entry(email, DAY + timedelta(days=1)), None, "update of a missing day")
+
+    repository.delete_entry(email, DAY)
+    expect_equal(repository.get_entry(email, DAY), None, "deleted entry")
+    repository.delete_entry(email, DAY)
+    expect_equal(repository.get_entries(email), [], "entries after deleting everything")
+
+
+@check
+def save_day(repository, email):
+    expect(repository.save_day(email, DAY, REPAS, SYMPTOMES) is True, "save_day of a new day must return True")
+    expect(repository.save_day(email, DAY, {'Dîner': ['Soupe']}, {}) is False,
+           "save_day of an existing day must return False")
+    expect_equal(repository.get_entries(email), [(DAY, {'Dîner': ['Soupe']}, {})], "entries after save_day")
+
+
+@check
+def ranges(repository, email):
+    days = [DAY + timedelta(days=offset) for offset in (3, 0, 2, 1, 5)]
+    for day in days:
+        repository.save_day(email, day, {'Déjeuner': [day.isoformat()]}, {})
+    expect_equal([entry[0] for entry in repository.get_entries(email)], sorted(days), "entry order")
+    between = repository.get_entries_between(email, DAY + timedelta(days=1), DAY + timedelta(days=3))
+    expect_equal([entry[0] for entry in between], [DAY + timedelta(days=offset) for offset in (1, 2, 3)],
+                 "inclusive date range")
+    repository.prefetch_entries_between(email, [(DAY, DAY + timedelta(days=5))])
+    expect_equal(repository.get_entries_between(email, DAY + timedelta(days=6), DAY + timedelta(days=9)), [],
+                 "empty date range")
+
+
+@check
+def catalog(repository, email):
+    nom = f"Aliment {email}"
+    repository.add_aliment(nom)
+    repository.add_aliment(nom)
+    expect_equal(repository.get_aliments().count(nom), 1, "catalog occurrences of an added name")
+    eaten = f"Repas {email}"
+    repository.save_day(email, DAY, {'Dîner': [eaten]}, {})
+    expect(eaten in repository.get_aliments(), "save_day did not register its food names")
+    expect_equal(repository.add_aliments([f"{nom} 1", nom, f"{nom} 2", f"{nom} 1"], chunk_size=2), 2,
+                 "new names counted by add_aliments")
+
+
+@check
+def bulk_save(repository, email):
+    days = [(email, DAY + timedelta(days=offset), {'Dîner': [str(offset)]}, {}) for offset in range(7)]
+    counts = repository.save_days(days, chunk_size=3)
+    expect_equal(counts, {'inserted': 7, 'updated': 0, 'skipped': 0}, "first bulk save")
+
+    again = days[:2] + [(email, DAY, {'Dîner': ['doublon']}, {})] + [(email, DAY + timedelta(days=9), {}, {})]
+    counts = repository.save_days(again, chunk_size=10, replace=False)
+    expect_equal(counts, {'inserted': 1, 'updated': 0, 'skipped': 3}, "bulk save without replace")
+    expect_equal(repository.get_entry(email, DAY)[1], {'Dîner': ['0']}, "day kept without replace")
+
+    counts = repository.save_days([(email, DAY.isoformat(), {'Dîner': ['remplacé']}, {})], replace=True)
+    expect_equal(counts, {'inserted': 0, 'updated': 1, 'skipped': 0}, "bulk save with replace")
+    expect_equal(repository.get_entry(email, DAY)[1], {'Dîner': ['remplacé']}, "day replaced")
+
+
+@check
+def streaming(repository, email):
+    other = 'other-' + email
+    written = [(user, DAY + timedelta(days=offset), {'Dîner': [str(offset)]},
+                {'symptomes_specifiques': ['Nausées'], 'intensite_douleur': offset, 'autres_symptomes': ''})
+               for offset in range(5) for user in (email, other)]
+    repository.save_days(written)
+    streamed = list(repository.iter_all_entries([email], page_size=2))
+    expect_equal(streamed, [(user, day.isoformat(), repas, symptomes)
+                            for user, day, repas, symptomes in written if user == email],
+                 "iter_all_entries of one user")
+    users = {row[0] for row in repository.iter_all_entries([email, other])}
+    expect_equal(users, {email, other}, "users streamed by iter_all_entries")
+
+
+@check
+def concurrent_writes(repository, email, threads=8, days_per_thread=5):
+    errors = []
+
+    def write(offset):
+        try:
+            for index in range(days_per_thread):
+                day = DAY + timedelta(days=offset * days_per_thread + index)
+                repository.save_day(email, day, {'Dîner': [str(offset)]}, {})
+                repository.get_entries_between(email, DAY, day)
+        except Exception as e:
+            errors.append(e)
+
+    workers = [threading.Thread(target=write, args=(offset,)) for offset in range(threads)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    expect(not errors, f"concurrent writes failed: {errors[:1]!r}")
+    expect_equal(len(repository.get_entries(email)), threads * days_per_thread, "entries written concurrently")
+
+
+@check
+def app_logout(repository, email):
+    """Log in and out through app.py, with ``repository`` as the process-wide one."""
+    from streamlit.testing.v1 import AppTest
+
+    repository.register_user(email, 'secret-1', 'Ada', 'Test')
+    sqlite_existed = os.path.exists(database.DB_NAME)
+    previous, storage._repository = storage._repository, repository
+    try:
+        app = AppTest.from_file(APP_PATH, default_timeout=60)
+        app.session_state['logged_in'] = True
+        app.session_state['user_email'] = email
+        app.run()
+        expect(not app.exception, f"app failed for a logged-in user: {list(app.exception)[:1]!r}")
+        app.sidebar.button[0].click().run()
+        expect(not app.exception, f"logout failed: {list(app.exception)[:1]!r}")
+        expect(not app.session_state['logged_in'], "still logged in after logout")
+    finally:
+        storage._repository = previous
+    if not repository.supports_analytics:
+        expect(sqlite_existed or not os.path.exists(database.DB_NAME),
+               "the app created the SQLite database although another backend is in use")
+
+
+def run_conformance(repository, report=None):
+    """Run every check; returns ``[(check name, error)]`` for those that failed."""
+    run_id = uuid.uuid4().hex[:8]
+    failures = []
+    for fn in CHECKS:
+        email = f"{fn.__name__}-{run_id}@conformance.invalid"
+        try:
+            fn(repository, email)
+            error = None
+        except Exception as e:
+            error = e
+            failures.append((fn.__name__, e))
+        if report is not None:
+            report(fn.__name__, error)
+    return failures
@@ -1,44 +1,111 @@
+import json
+import os
+import uuid
 import streamlit as st
-import pandas as pd
-import plotly.graph_objs as go
-import plotly.express as px
-from plotly.subplots import make_subplots
-from datetime import datetime, timedelta
-from collections import Counter
-from database import get_entries
-
-def prepare_data(entries):
-    symptom_data = []
-    for entry in entries:
-        date, aliments, symptomes = entry
-        symptomes_list = symptomes['symptomes_specifiques']
-        intensite = symptomes['intensite_douleur']
-        aliments_list = [item for sublist in aliments.values() for item in sublist]
-        for symptome in symptomes_list:
-            symptom_data.append({
-                'date': date,
-                'symptome': symptome,
-                'intensite': intensite,
-                'aliments': aliments_list
-            })
-    
-    return pd.DataFrame(symptom_data)
+import jobs
+from datetime import date, datetime, timedelta
+from database import get_data_version
+from instrumentation import timed
+from query_cache import QueryCache
+
+PERIODES = ("Mois", "Trimestre", "Période personnalisée")
+# Beyond this many points the timeline is aggregated per week, then per month
+MAX_TIMELINE_POINTS = 400
+# Bars and heatmap columns shown for the most frequent foods only
+MAX_FOODS_SHOWN = 40
+
+# Serialized figures keyed on (user, period, data version): a version bump
+# makes the old entries unreachable and LRU eviction reclaims them
+figure_cache = QueryCache(
+    max_bytes=int(os.environ.get('FOODDIARY_FIGURE_CACHE_BYTES', 16 * 1024 * 1024)),
+    ttl=float(os.environ.get('FOODDIARY_FIGURE_CACHE_TTL', 3600)),
+)
+
+# pandas, NumPy, Plotly and the analytics engine are imported inside the
+# functions that use them so the login page does not pay for them.
+
+@timed(kind='analysis')
+def prepare_data(analysis):
+    import numpy as np
+    import pandas as pd
+
+    # One row per reported symptom, with the foods eaten that day for hover
+    foods_by_entry = analysis.foods_by_entry()
+    intensite = analysis.symptom_intensity
+    if not np.isnan(intensite).any():
+        intensite = intensite.astype(int)
+    return pd.DataFrame({
+        'date': analysis.entry_dates[analysis.symptom_entry],
+        'symptome': np.asarray(analysis.symptoms, dtype=object)[analysis.symptom_codes],
+        'intensite': intensite,
+        'aliments': [foods_by_entry[i] for i in analysis.symptom_entry],
+    }, columns=['date', 'symptome', 'intensite', 'aliments'])
+
+
+
+def month_bounds(day):
+    start = day.replace(day=1)
+    end = (start + timedelta(days=32)).replace(day=1) - timedelta(days=1)
+    return start, end
+
+
+def quarter_bounds(year, quarter):
+    return date(year, 3 * quarter - 2, 1), month_bounds(date(year, 3 * quarter, 1))[1]
+
+
+def is_whole_months(start, end):
+    return start.day == 1 and (end + timedelta(days=1)).day == 1
+
+
+@timed(kind='analysis')
+def resample_timeline(df, max_points=MAX_TIMELINE_POINTS):
+    """Aggregate the timeline per week, then per month, until it fits ``max_points``.
+
+    Returns the frame and its frequency ('D', 'W' or 'M'). Aggregated rows
+    carry the mean intensity and the number of days the symptom occurred,
+    without the per-day food lists.
+    """
+    import pandas as pd
+
+    if len(df) <= max_points:
+        return df, 'D'
+    for freq, rule in (('W', 'W-MON'), ('M', 'MS')):
+        grouper = pd.Grouper(key='date', freq=rule, label='left', closed='left')
+        resampled = (
+            df.groupby([grouper, 'symptome'])
+            .agg(intensite=('intensite', 'mean'), jours=('intensite', 'size'))
+            .reset_index()
+        )
+        resampled['intensite'] = resampled['intensite'].round(1)
+        if len(resampled) <= max_points:
+            break
+    return resampled, freq
+
+
+TIMELINE_TITLES = {
+    'D': "Évolution des symptômes au fil du temps",
+    'W': "Évolution des symptômes (moyenne par semaine)",
+    'M': "Évolution des symptômes (moyenne par mois)",
+}
+TICK_FORMATS = {'D': "%d %b %Y", 'W': "%d %b %Y", 'M': "%B %Y"}
 
 
+@timed(kind='analysis')
+def analyze_symptomes_timeline(df, freq='D'):
+    import plotly.express as px
 
-def analyze_symptomes_timeline(df):
     # Create the scatter plot
     fig = px.scatter(df, x='date', y='intensite', color='symptome',
-                     hover_data=['aliments'],
-                     title="Évolution des symptômes au fil du temps")
+                     hover_data=['aliments'] if freq == 'D' else ['jours'],
+                     title=TIMELINE_TITLES[freq])
     
     # Update marker size
     fig.update_traces(marker=dict(size=10))
     
-    # Remove hours from the date format and set one tick per day
+    # Remove hours from the date format; let Plotly space a bounded number of ticks
     fig.update_xaxes(
-        tickformat="%d %B %Y",  # Format date as 'day month year'
-        dtick=86400000.0  # Set tick every day (1 day = 86400000 ms)
+        tickformat=TICK_FORMATS[freq],
+        nticks=12
     )
     
     # Update hover mode to show the closest data point
@@ -55,75 +122,245 @@ def analyze_symptomes_timeline(df):
     
     return fig
 
-def analyze_aliments(entries):
-    all_aliments = [aliment for entry in entries for repas in entry[1].values() for aliment in repas]
-    aliment_counts = Counter(all_aliments)
-    fig = px.bar(x=list(aliment_counts.keys()), y=list(aliment_counts.values()),
+def _most_frequent_foods(analysis, limit):
+    import numpy as np
+
+    order = np.argsort(-np.asarray(analysis.food_counts), kind='stable')
+    return order[:limit] if limit is not None else order
+
+@timed(kind='analysis')
+def analyze_aliments(analysis, limit=MAX_FOODS_SHOWN):
+    import plotly.express as px
+
+    shown = _most_frequent_foods(analysis, limit)
+    fig = px.bar(x=[analysis.foods[i] for i in shown], y=analysis.food_counts[shown],
                  title="Fréquence des aliments consommés")
     fig.update_xaxes(title="Aliments")
     fig.update_yaxes(title="Fréquence")
     return fig
 
-def analyze_symptomes(entries):
-    all_symptoms = [symptom for entry in entries for symptom in entry[2]['symptomes_specifiques']]
-    symptom_counts = Counter(all_symptoms)
-    fig = px.bar(x=list(symptom_counts.keys()), y=list(symptom_counts.values()),
+@timed(kind='analysis')
+def analyze_symptomes(analysis):
+    import plotly.express as px
+
+    fig = px.bar(x=analysis.symptoms, y=analysis.symptom_counts,
                  title="Fréquence des symptômes")
     fig.update_xaxes(title="Symptômes")
     fig.update_yaxes(title="Fréquence")
     return fig
 
-import pandas as pd
-import plotly.express as px
-import numpy as np
-from collections import Counter
-
-def calculate_correlation(entries):
-    aliments_symptoms = {}
-    for entry in entries:
-        aliments = [item for sublist in entry[1].values() for item in sublist]
-        symptoms = entry[2]['symptomes_specifiques']
-        for aliment in aliments:
-            if aliment not in aliments_symptoms:
-                aliments_symptoms[aliment] = Counter()
-            aliments_symptoms[aliment].update(symptoms)
-    
-    all_symptoms = list(set([symptom for counters in aliments_symptoms.values() for symptom in counters]))
-    correlation_data = pd.DataFrame({aliment: [counter.get(symptom, 0) for symptom in all_symptoms] 
-                                     for aliment, counter in aliments_symptoms.items()}, 
-                                    index=all_symptoms)
-    
-    return correlation_data.div(correlation_data.sum(axis=1), axis=0)
+@timed(kind='analysis')
+def calculate_correlation(analysis, limit=None):
+    import pandas as pd
+
+    values, symptoms = analysis.correlation_matrix()
+    shown = _most_frequent_foods(analysis, limit)
+    return pd.DataFrame(values[:, shown], index=symptoms, columns=[analysis.foods[i] for i in shown])
+
+@timed(kind='analysis')
+def analyze_associations(associations, limit=15, alpha=0.05):
+    import plotly.express as px
+
+    rows = associations.top(limit, alpha=alpha)
+    if not rows:
+        return None
+    labels = [f"{row['food']} → {row['symptom']} (J+{row['lag']})" for row in rows]
+    fig = px.bar(
+        x=[row['lift'] for row in rows][::-1], y=labels[::-1], orientation='h',
+        color=[row['conditional'] for row in rows][::-1],
+        hover_data={'q': [f"{row['q_value']:.2g}" for row in rows][::-1],
+                    'jours': [f"{row['support']}/{row['exposed']}" for row in rows][::-1]},
+        title="Associations aliment → symptôme avec délai",
+        labels={'x': "Lift", 'y': "", 'color': "P(symptôme | aliment)"},
+    )
+    fig.update_layout(height=max(300, 40 * len(rows)))
+    return fig
+
+
+def choisir_periode():
+    """Période analysée, en (début, fin) inclus ; None tant qu'elle est incomplète."""
+    today = datetime.now().date()
+    choix = st.radio("Période", PERIODES, horizontal=True, key='periode_type')
+    if choix == "Mois":
+        jour = st.date_input("Mois (n'importe quel jour du mois)", today, key='periode_mois')
+        return month_bounds(jour)
+    if choix == "Trimestre":
+        col_annee, col_trimestre = st.columns(2)
+        annee = col_annee.number_input("Année", 2000, today.year + 1, today.year, key='periode_annee')
+        trimestre = col_trimestre.selectbox("Trimestre", (1, 2, 3, 4), index=(today.month - 1) // 3,
+                                            format_func=lambda q: f"T{q}", key='periode_trimestre')
+        return quarter_bounds(int(annee), trimestre)
+    bornes = st.date_input("Du … au", (today - timedelta(days=29), today), key='periode_personnalisee')
+    if len(bornes) < 2:
+        st.info("Choisissez la date de fin de la période.")
+        return None
+    return bornes[0], bornes[1]
+
 
+def _no_progress(fraction, message=''):
+    pass
 
+
+@timed(kind='analysis')
+def build_period_figures(user_email, start, end, progress=_no_progress):
+    """JSON of the four period charts, or None when the period has no data.
+
+    ``progress(fraction, message)`` is called between steps.
+    """
+    import plotly.express as px
+    from analytics import AnalysisResult, load_stats_summary
+    from snapshot import load_columns
+
+    progress(0.0, "Lecture des entrées")
+    # Whole months come from the materialized monthly stats and only the
+    # timeline needs per-day rows; any other range is read once from the
+    # entries of the period
+    if is_whole_months(start, end):
+        summary = load_stats_summary(user_email, start, end)
+        timeline = AnalysisResult.from_columns(load_columns(user_email, start, end, symptomatic_only=True))
+    else:
+        summary = timeline = AnalysisResult.from_columns(load_columns(user_email, start, end))
+    if summary.is_empty() and not len(timeline):
+        return None
+
+    progress(0.4, "Préparation des graphiques")
+    df, freq = resample_timeline(prepare_data(timeline))
+    correlation_data = calculate_correlation(summary, MAX_FOODS_SHOWN)
+    figures = {
+        # 1. Graphique des symptômes par jour
+        'timeline': analyze_symptomes_timeline(df, freq),
+        # 2. Fréquence des aliments consommés
+        'aliments': analyze_aliments(summary),
+        # 3. Fréquence des symptômes
+        'symptomes': analyze_symptomes(summary),
+        # 4. Corrélation entre aliments et symptômes
+        'correlation': px.imshow(correlation_data,
+                                 title="Corrélation entre aliments et symptômes",
+                                 labels=dict(x="Symptômes", y="Aliments", color="Corrélation")),
+    }
+    progress(0.8, "Sérialisation")
+    return {name: fig.to_json() for name, fig in figures.items()}
+
+
+@timed(kind='analysis')
+def build_associations_figure(user_email, start, end, max_lag, progress=_no_progress):
+    from analytics import lagged_associations
+    from snapshot import load_columns
+
+    progress(0.0, "Calcul des associations")
+    fig = analyze_associations(lagged_associations(load_columns(user_email, start, end), max_lag=max_lag))
+    return None if fig is None else fig.to_json()
+
+
+def _afficher_figure(figure_json):
+    # Streamlit rebuilds the figure from the dict without Plotly Express
+    st.plotly_chart(json.loads(figure_json))
+
+
+def _period_figures_job(context, user_email, start, end):
+    return build_period_figures(user_email, date.fromisoformat(start), date.fromisoformat(end),
+                                progress=context.progress)
+
+
+def _associations_job(context, user_email, start, end, max_lag):
+    return build_associations_figure(user_email, date.fromisoformat(start), date.fromisoformat(end),
+                                     max_lag, progress=context.progress)
+
+
+jobs.register('period_figures', _period_figures_job)
+jobs.register('associations_figure', _associations_job)
+
+_MISSING = object()
+POLL_INTERVAL = 1.0
+
+
+def session_owner():
+    """Identifiant de la session Streamlit, propriétaire de ses calculs en arrière-plan."""
+    if 'job_owner' not in st.session_state:
+        st.session_state['job_owner'] = uuid.uuid4().hex
+    return st.session_state['job_owner']
+
+
+def _rapport(kind, user_email, version, params, demandes):
+    """Résultat frais d'un rapport, sinon la vue de son calcul en arrière-plan."""
+    cache_key = (kind, user_email, version, tuple(sorted(params.items())))
+    cached = figure_cache.get(cache_key, _MISSING)
+    if cached is not _MISSING:
+        return jobs.JobView(None, jobs.DONE, 1.0, result=cached)
+    view = jobs.get_runner().request(kind, user_email, version, params, owner=session_owner())
+    if view.done:
+        figure_cache.put(cache_key, user_email, view.result)
+    elif view.active:
+        demandes.add(view.job_id)
+    return view
+
+
+def _afficher_attente(view):
+    """Progression du calcul, avec les résultats précédents s'il y en a."""
+    if view.status == jobs.FAILED:
+        st.error("Le calcul de ce rapport a échoué.")
+        return False
+    st.progress(min(max(view.progress, 0.0), 1.0), text=view.message or "Calcul en cours…")
+    if view.stale:
+        st.caption("Résultats précédents affichés pendant la mise à jour.")
+    return view.stale
+
+
+def _section_rapports(user_email, start, end):
+    version = get_data_version(user_email)
+    bornes = {'start': start.isoformat(), 'end': end.isoformat()}
+    demandes = set()
+
+    periode = _rapport('period_figures', user_email, version, bornes, demandes)
+    if periode.done or _afficher_attente(periode):
+        if periode.result is None:
+            st.warning("Aucune donnée n'est disponible pour cette période.")
+        else:
+            for name in ('timeline', 'aliments', 'symptomes', 'correlation'):
+                _afficher_figure(periode.result[name])
+
+    # 5. Symptômes apparaissant 0 à K jours après un aliment
+    delai = st.slider("Délai maximal entre aliment et symptôme (jours)", 0, 7, 3)
+    associations = _rapport('associations_figure', user_email, version, {**bornes, 'max_lag': delai}, demandes)
+    if associations.done or _afficher_attente(associations):
+        if associations.result is None:
+            st.info("Aucune association significative entre aliments et symptômes.")
+        else:
+            _afficher_figure(associations.result)
+
+    # Les calculs demandés au passage précédent et abandonnés depuis
+    # (autre période, autre délai) sont annulés
+    runner = jobs.get_runner()
+    for job_id in st.session_state.get('jobs_demandes', set()) - demandes:
+        runner.release(job_id, session_owner())
+    st.session_state['jobs_demandes'] = demandes
+
+    en_cours = bool(demandes)
+    if en_cours != st.session_state.get('rapports_en_cours', False):
+        # Relance complète pour démarrer ou arrêter le rafraîchissement périodique
+        st.session_state['rapports_en_cours'] = en_cours
+        st.rerun()
+
+
+@timed(kind='render')
 def analyse_mensuelle(user_email):
     st.subheader("Analyse mensuelle")
-    entries = get_entries(user_email)
-    
-    if not entries:
-        st.warning("Aucune donnée n'est disponible pour l'analyse.")
+    periode = choisir_periode()
+    if periode is None:
         return
+    start, end = periode
 
-    df = prepare_data(entries)
-
-    # 1. Graphique des symptômes par jour
-    fig_symptoms = analyze_symptomes_timeline(df)
-    st.plotly_chart(fig_symptoms)
-
-    # 2. Fréquence des aliments consommés
-    fig_aliments = analyze_aliments(entries)
-    st.plotly_chart(fig_aliments)
+    # Les rapports sont calculés en arrière-plan ; tant qu'un calcul est en
+    # cours, seule cette section est rafraîchie à intervalle régulier
+    run_every = POLL_INTERVAL if st.session_state.get('rapports_en_cours') else None
+    st.fragment(run_every=run_every)(_section_rapports)(user_email, start, end)
 
-    # 3. Fréquence des symptômes
-    fig_symptom_freq = analyze_symptomes(entries)
-    st.plotly_chart(fig_symptom_freq)
 
-    # 4. Corrélation entre aliments et symptômes
-    correlation_data = calculate_correlation(entries)
-    fig_correlation = px.imshow(correlation_data, 
-                                title="Corrélation entre aliments et symptômes",
-                                labels=dict(x="Symptômes", y="Aliments", color="Corrélation"))
-    st.plotly_chart(fig_correlation)
+def liberer_rapports():
+    """Annule les calculs en arrière-plan de la session (déconnexion)."""
+    jobs.get_runner().release_owner(session_owner())
+    st.session_state['jobs_demandes'] = set()
+    st.session_state['rapports_en_cours'] = False
 
 if __name__ == "__main__":
     # Cette partie est utile pour tester le module indépendamment
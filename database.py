@@ -1,21 +1,98 @@
+import atexit
+import os
 import sqlite3
+import itertools
 import json
+import multiprocessing
+import threading
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
 from datetime import datetime
-from werkzeug.security import generate_password_hash, check_password_hash
 from utils import safe_json_loads
 from contextlib import contextmanager
+from db_pool import ConnectionPool, apply_storage_profile, resolve_storage_profile
+from query_cache import QueryCache
+from auth import hash_password, verify_password
+from instrumentation import timed, trace_statement, counting_row_factory, ENABLED as PROFILING
 
 DB_NAME = 'allergie_tracker.db'
 
+_pool = None
+_pool_options = {}
+_storage_profile = None
+_pool_lock = threading.Lock()
+
+# Read results shared by every session of this process; writes below
+# invalidate exactly the user/date (or the food catalog) they touch
+query_cache = QueryCache()
+ALIMENTS_SCOPE = 'aliments'
+_catalog_listeners = []
+
+def get_pool():
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ConnectionPool(DB_NAME, on_connect=_setup_connection, **_pool_options)
+    return _pool
+
+def _setup_connection(conn):
+    apply_storage_profile(conn, _storage_profile)
+    if PROFILING:
+        conn.set_trace_callback(trace_statement)
+        conn.row_factory = counting_row_factory
+
+def close_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.close()
+            _pool = None
+
+def configure_pool(db_name=None, storage_profile=None, **options):
+    """Point the module at another database file and/or resize the pool.
+
+    Accepts the keyword arguments of ``ConnectionPool`` (max_size, timeout,
+    health_check_interval) and a storage profile name ("durable",
+    "balanced", "fast") or pragma dict. The current pool is closed and
+    rebuilt lazily.
+    """
+    global DB_NAME, _pool_options, _storage_profile
+    close_pool()
+    if db_name is not None:
+        DB_NAME = db_name
+    _initialized.discard(DB_NAME)
+    if storage_profile is not None:
+        _storage_profile = resolve_storage_profile(storage_profile)
+    _pool_options = dict(_pool_options, **options)
+    query_cache.clear()
+
+atexit.register(close_pool)
+
 @contextmanager
 def get_db_connection():
-    conn = sqlite3.connect(DB_NAME)
-    conn.row_factory = sqlite3.Row
-    try:
+    with get_pool().connection() as conn:
         yield conn
-    finally:
-        conn.close()
 
+@contextmanager
+def read_transaction():
+    """A pooled connection whose reads all see one committed state.
+
+    Several SELECTs run in autocommit mode can each see a different commit
+    under WAL; inside this block they share one read transaction. Nested in
+    an open transaction, that transaction is used as is.
+    """
+    with get_db_connection() as conn:
+        if conn.in_transaction:
+            yield conn
+            return
+        conn.execute("BEGIN")
+        try:
+            yield conn
+        finally:
+            conn.rollback()
+
+@timed(kind='query', sql_entry_point=True)
 def execute_query(query, params=(), fetch=False):
     with get_db_connection() as conn:
         cursor = conn.cursor()
@@ -32,7 +109,24 @@ def create_table(table_name, schema):
     '''
     execute_query(query)
 
+_initialized = set()
+_init_lock = threading.Lock()
+
 def init_db():
+    """Create the schema and apply pending migrations.
+
+    Runs once per process and database file; afterwards it returns without
+    touching the database. Call it explicitly at startup.
+    """
+    with _init_lock:
+        if DB_NAME in _initialized:
+            return
+        if get_schema_version() < SCHEMA_VERSION:
+            _create_schema()
+            print("Database initialized successfully.")
+        _initialized.add(DB_NAME)
+
+def _create_schema():
     create_table('users', '''
         id INTEGER PRIMARY KEY AUTOINCREMENT,
         email TEXT UNIQUE NOT NULL,
@@ -49,84 +143,995 @@ def init_db():
         FOREIGN KEY (user_email) REFERENCES users (email)
     ''')
     create_table('aliments', '''
-        nom TEXT PRIMARY KEY
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        nom TEXT UNIQUE NOT NULL
+    ''')
+    migrate_db()
+
+def _dedupe_entries_and_index_dates(cursor):
+    # Older databases may hold several rows for the same day; keep the latest
+    cursor.execute('''
+        DELETE FROM entries WHERE id NOT IN (
+            SELECT MAX(id) FROM entries GROUP BY user_email, date
+        )
+    ''')
+    cursor.execute(
+        "CREATE UNIQUE INDEX IF NOT EXISTS idx_entries_user_date ON entries (user_email, date)"
+    )
+
+# The JSON columns of entries are authoritative: they keep the exact shape that
+# was written (meal order, empty meals, partial or empty symptom dicts), which
+# get_entries returns as is. entry_aliments/entry_symptomes are an index derived
+# from them in the same transaction, read by the aggregations and the analysis;
+# ``manage.py stats verify`` compares the two and ``stats rebuild`` rederives it.
+def _split_aliments(aliments):
+    if not isinstance(aliments, dict):
+        return []
+    return [
+        (repas, nom)
+        for repas, noms in aliments.items() if isinstance(noms, list)
+        for nom in noms
+    ]
+
+def _split_symptomes(symptomes_data):
+    if not isinstance(symptomes_data, dict):
+        return [], None
+    symptomes = symptomes_data.get('symptomes_specifiques') or []
+    return list(symptomes), symptomes_data.get('intensite_douleur')
+
+def _insert_entry_details(cursor, items):
+    """Insert the derived link rows for ``(entry_id, aliments, symptomes_data)`` items.
+
+    Food and symptom names are upserted into their catalogs first, in one
+    ``executemany`` each. Returns the number of food names new to the catalog.
+    """
+    food_rows, symptom_rows = [], []
+    for entry_id, aliments, symptomes_data in items:
+        food_rows.extend(
+            (entry_id, position, repas, nom)
+            for position, (repas, nom) in enumerate(_split_aliments(aliments))
+        )
+        symptomes, intensite = _split_symptomes(symptomes_data)
+        symptom_rows.extend(
+            (entry_id, position, nom, intensite) for position, nom in enumerate(symptomes)
+        )
+
+    added = 0
+    if food_rows:
+        cursor.executemany(
+            "INSERT OR IGNORE INTO aliments (nom) VALUES (?)",
+            [(nom,) for nom in dict.fromkeys(row[3] for row in food_rows)]
+        )
+        added = cursor.rowcount
+        cursor.executemany(
+            "INSERT INTO entry_aliments (entry_id, position, repas, aliment_id) "
+            "VALUES (?, ?, ?, (SELECT id FROM aliments WHERE nom = ?))",
+            food_rows
+        )
+    if symptom_rows:
+        cursor.executemany(
+            "INSERT OR IGNORE INTO symptomes (nom) VALUES (?)",
+            [(nom,) for nom in dict.fromkeys(row[2] for row in symptom_rows)]
+        )
+        cursor.executemany(
+            "INSERT INTO entry_symptomes (entry_id, position, symptome_id, intensite) "
+            "VALUES (?, ?, (SELECT id FROM symptomes WHERE nom = ?), ?)",
+            symptom_rows
+        )
+    return added
+
+def _write_entry_details(cursor, entry_id, aliments, symptomes_data, update_stats=True):
+    """Replace the normalized food/symptom rows of one entry.
+
+    Returns the number of food names that were new to the catalog.
+    """
+    if update_stats:
+        _apply_stats_delta(cursor, entry_id, -1)
+    cursor.execute("DELETE FROM entry_aliments WHERE entry_id = ?", (entry_id,))
+    cursor.execute("DELETE FROM entry_symptomes WHERE entry_id = ?", (entry_id,))
+    added = _insert_entry_details(cursor, [(entry_id, aliments, symptomes_data)])
+    if update_stats:
+        _apply_stats_delta(cursor, entry_id, 1)
+    return added
+
+def _delete_entry_details(cursor, entry_ids):
+    for entry_id in entry_ids:
+        _apply_stats_delta(cursor, entry_id, -1)
+    params = [(entry_id,) for entry_id in entry_ids]
+    cursor.executemany("DELETE FROM entry_aliments WHERE entry_id = ?", params)
+    cursor.executemany("DELETE FROM entry_symptomes WHERE entry_id = ?", params)
+
+def _normalize_foods_and_symptoms(cursor):
+    # aliments gets an integer key so link rows can reference it
+    cursor.execute('''
+        CREATE TABLE aliments_v2 (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            nom TEXT UNIQUE NOT NULL
+        )
+    ''')
+    cursor.execute("INSERT INTO aliments_v2 (nom) SELECT nom FROM aliments ORDER BY rowid")
+    cursor.execute("DROP TABLE aliments")
+    cursor.execute("ALTER TABLE aliments_v2 RENAME TO aliments")
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS symptomes (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            nom TEXT UNIQUE NOT NULL
+        )
+    ''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS entry_aliments (
+            entry_id INTEGER NOT NULL REFERENCES entries (id),
+            position INTEGER NOT NULL,
+            repas TEXT NOT NULL,
+            aliment_id INTEGER NOT NULL REFERENCES aliments (id),
+            PRIMARY KEY (entry_id, position)
+        ) WITHOUT ROWID
+    ''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS entry_symptomes (
+            entry_id INTEGER NOT NULL REFERENCES entries (id),
+            position INTEGER NOT NULL,
+            symptome_id INTEGER NOT NULL REFERENCES symptomes (id),
+            intensite INTEGER,
+            PRIMARY KEY (entry_id, position)
+        ) WITHOUT ROWID
+    ''')
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_entry_aliments_aliment ON entry_aliments (aliment_id)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_entry_symptomes_symptome ON entry_symptomes (symptome_id)")
+
+    # Convert existing JSON rows; unreadable ones are left for clean_database
+    reader = cursor.connection.cursor()
+    reader.execute("SELECT id, aliments, symptomes FROM entries ORDER BY id")
+    while True:
+        rows = reader.fetchmany(500)
+        if not rows:
+            break
+        for row in rows:
+            _write_entry_details(
+                cursor, row['id'], safe_json_loads(row['aliments']), safe_json_loads(row['symptomes']),
+                update_stats=False
+            )
+
+# Per-user, per-month aggregates kept up to date on every write so the
+# analysis reads O(foods x symptoms) rows instead of the whole history.
+# Each value is (key columns, aggregate query over the entries matching {where}).
+STATS_TABLES = {
+    'stats_aliments': ('aliment_id', '''
+        SELECT e.user_email, substr(e.date, 1, 7) AS month, ea.aliment_id, COUNT(*) AS n
+        FROM entries e JOIN entry_aliments ea ON ea.entry_id = e.id
+        WHERE {where} GROUP BY e.user_email, month, ea.aliment_id
+    '''),
+    'stats_symptomes': ('symptome_id', '''
+        SELECT e.user_email, substr(e.date, 1, 7) AS month, es.symptome_id, COUNT(*) AS n
+        FROM entries e JOIN entry_symptomes es ON es.entry_id = e.id
+        WHERE {where} GROUP BY e.user_email, month, es.symptome_id
+    '''),
+    'stats_aliment_symptomes': ('aliment_id, symptome_id', '''
+        SELECT e.user_email, substr(e.date, 1, 7) AS month, ea.aliment_id, es.symptome_id, COUNT(*) AS n
+        FROM entries e
+        JOIN entry_aliments ea ON ea.entry_id = e.id
+        JOIN entry_symptomes es ON es.entry_id = e.id
+        WHERE {where} GROUP BY e.user_email, month, ea.aliment_id, es.symptome_id
+    '''),
+}
+
+def _apply_stats_delta(cursor, entry_id, sign):
+    """Add (sign=1) or remove (sign=-1) one entry's contribution to the stats."""
+    _apply_stats_delta_where(cursor, 'e.id = ?', (entry_id,), sign)
+
+def _apply_stats_delta_where(cursor, where, params, sign):
+    for table, (keys, query) in STATS_TABLES.items():
+        cursor.execute(
+            f"INSERT INTO {table} (user_email, month, {keys}, n) "
+            f"SELECT user_email, month, {keys}, ? * n FROM ({query.format(where=where)}) WHERE true "
+            f"ON CONFLICT (user_email, month, {keys}) DO UPDATE SET n = n + excluded.n",
+            (sign, *params)
+        )
+        if sign < 0:
+            cursor.execute(
+                f"DELETE FROM {table} WHERE n <= 0 AND (user_email, month) IN "
+                f"(SELECT e.user_email, substr(e.date, 1, 7) FROM entries e WHERE {where})",
+                params
+            )
+
+def _rebuild_stats(cursor, user_email=None):
+    where, params = ('e.user_email = ?', (user_email,)) if user_email is not None else ('1', ())
+    for table, (keys, query) in STATS_TABLES.items():
+        if user_email is None:
+            cursor.execute(f"DELETE FROM {table}")
+        else:
+            cursor.execute(f"DELETE FROM {table} WHERE user_email = ?", params)
+        cursor.execute(
+            f"INSERT INTO {table} (user_email, month, {keys}, n) {query.format(where=where)}",
+            params
+        )
+
+def _create_stats_tables(cursor):
+    for table, (keys, _) in STATS_TABLES.items():
+        key_columns = ', '.join(f"{key} INTEGER NOT NULL" for key in keys.split(', '))
+        cursor.execute(f'''
+            CREATE TABLE IF NOT EXISTS {table} (
+                user_email TEXT NOT NULL,
+                month TEXT NOT NULL,
+                {key_columns},
+                n INTEGER NOT NULL,
+                PRIMARY KEY (user_email, month, {keys})
+            ) WITHOUT ROWID
+        ''')
+    _rebuild_stats(cursor)
+
+def _create_maintenance_state(cursor):
+    # One checkpoint row per resumable maintenance job
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS maintenance_state (
+            job TEXT PRIMARY KEY,
+            last_id INTEGER NOT NULL,
+            scanned INTEGER NOT NULL,
+            deleted INTEGER NOT NULL,
+            updated_at TEXT NOT NULL
+        )
+    ''')
+
+def _create_data_versions(cursor):
+    # Bumped in the same transaction as every write to a user's entries;
+    # a missing row means version 0
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS data_versions (
+            user_email TEXT PRIMARY KEY,
+            version INTEGER NOT NULL
+        )
     ''')
-    print("Database initialized successfully.")
 
+def _track_rewrites(cursor):
+    # Version at which existing entries last changed or disappeared; inserts
+    # leave it alone, so a reader holding data up to a version can tell
+    # whether only new days were added since
+    cursor.execute("ALTER TABLE data_versions ADD COLUMN rewritten INTEGER NOT NULL DEFAULT 0")
+
+def _bump_data_version(cursor, user_emails, rewrite=True):
+    """Bump the users' data version; ``rewrite=False`` when entries were only inserted."""
+    cursor.executemany(
+        "INSERT INTO data_versions (user_email, version, rewritten) VALUES (?, 1, ?) "
+        "ON CONFLICT (user_email) DO UPDATE SET version = version + 1, "
+        "rewritten = CASE WHEN excluded.rewritten THEN version + 1 ELSE rewritten END",
+        [(user_email, int(rewrite)) for user_email in user_emails]
+    )
+
+def get_data_version(user_email):
+    """Counter that changes whenever the user's entries change, in any process."""
+    rows = execute_query("SELECT version FROM data_versions WHERE user_email = ?", (user_email,), fetch=True)
+    return rows[0]['version'] if rows else 0
+
+def get_data_versions(user_email):
+    """``(version, rewritten)``: the data version, and the version at which
+    existing entries were last updated or deleted."""
+    rows = execute_query(
+        "SELECT version, rewritten FROM data_versions WHERE user_email = ?", (user_email,), fetch=True
+    )
+    return (rows[0]['version'], rows[0]['rewritten']) if rows else (0, 0)
+
+def _create_jobs_table(cursor):
+    # Background report jobs (see jobs.py), one row per key and data version
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS jobs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            job_key TEXT NOT NULL,
+            kind TEXT NOT NULL,
+            user_email TEXT NOT NULL,
+            data_version INTEGER NOT NULL,
+            status TEXT NOT NULL,
+            progress REAL NOT NULL DEFAULT 0,
+            message TEXT,
+            result TEXT,
+            error TEXT,
+            created_at TEXT NOT NULL,
+            started_at TEXT,
+            finished_at TEXT
+        )
+    ''')
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_jobs_key ON jobs (job_key, status, data_version)")
+
+# Schema migrations, applied in order. The index of a migration + 1 is the
+# schema version it produces, stored in SQLite's user_version header field.
+MIGRATIONS = [
+    _dedupe_entries_and_index_dates,
+    _normalize_foods_and_symptoms,
+    _create_stats_tables,
+    _create_maintenance_state,
+    _create_data_versions,
+    _create_jobs_table,
+    _track_rewrites,
+]
+SCHEMA_VERSION = len(MIGRATIONS)
+
+def get_schema_version():
+    with get_db_connection() as conn:
+        return conn.execute("PRAGMA user_version").fetchone()[0]
+
+def migrate_db():
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        while True:
+            # IMMEDIATE takes the write lock, so concurrent processes migrate once
+            cursor.execute("BEGIN IMMEDIATE")
+            version = cursor.execute("PRAGMA user_version").fetchone()[0]
+            if version >= len(MIGRATIONS):
+                conn.rollback()
+                return version
+            try:
+                MIGRATIONS[version](cursor)
+                cursor.execute(f"PRAGMA user_version = {version + 1}")
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+
+@timed(kind='auth')
 def register_user(email, password, first_name, last_name):
-    hashed_password = generate_password_hash(password)
+    # Skip the (slow) hash when the email is obviously taken
+    if execute_query('SELECT 1 FROM users WHERE email = ?', (email,), fetch=True):
+        return False
+    hashed_password = hash_password(password)
     try:
         execute_query(
             'INSERT INTO users (email, password, first_name, last_name) VALUES (?, ?, ?, ?)', 
             (email, hashed_password, first_name, last_name)
         )
-        return True
     except sqlite3.IntegrityError:
         return False  # Email already exists
+    return True
 
+@timed(kind='auth')
 def login_user(email, password):
-    user = execute_query('SELECT * FROM users WHERE email = ?', (email,), fetch=True)
-    if user and check_password_hash(user[0]['password'], password):
-        return True
-    return False
+    """Check credentials; hashing runs on the bounded auth executor.
 
-def get_aliments():
+    Raises auth.AuthBusyError when too many logins are already queued.
+    """
+    # Unknown emails are not cached: another process may register them at any time
+    user = execute_query('SELECT password FROM users WHERE email = ?', (email,), fetch=True)
+    if not user:
+        return False
+    return verify_password(user[0]['password'], password)
+
+def cache_stats():
+    return query_cache.stats()
+
+def add_catalog_listener(callback):
+    """Call ``callback()`` after new names are added to the aliments table."""
+    _catalog_listeners.append(callback)
+
+def _catalog_changed():
+    query_cache.invalidate(ALIMENTS_SCOPE)
+    for callback in _catalog_listeners:
+        callback()
+
+def _user_key(name, user_email, *args):
+    # The data version is part of the key, so writes from other processes
+    # (manage.py import or clean) miss the cache too, not only local ones
+    return (name, user_email, get_data_version(user_email), *args)
+
+def _entries_written(user_email, date, new_aliments=0):
+    query_cache.invalidate(user_email, date)
+    if new_aliments:
+        _catalog_changed()
+
+def _load_aliments():
     aliments = execute_query("SELECT nom FROM aliments", fetch=True)
     return [row['nom'] for row in aliments]
 
+@timed(kind='query')
+def get_aliments():
+    return query_cache.fetch(('get_aliments',), ALIMENTS_SCOPE, _load_aliments)
+
+@timed(kind='query')
 def add_aliment(nom):
-    execute_query("INSERT OR IGNORE INTO aliments (nom) VALUES (?)", (nom,))
+    with get_db_connection() as conn:
+        cursor = conn.execute("INSERT OR IGNORE INTO aliments (nom) VALUES (?)", (nom,))
+        conn.commit()
+    if cursor.rowcount:
+        _catalog_changed()
 
+@timed(kind='query')
 def add_entry(user_email, date, aliments, symptomes_data):
     aliments_json = json.dumps(aliments)
     symptomes_json = json.dumps(symptomes_data)
-    execute_query(
-        "INSERT INTO entries (user_email, date, aliments, symptomes) VALUES (?, ?, ?, ?)", 
-        (user_email, str(date), aliments_json, symptomes_json)
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(
+            "INSERT INTO entries (user_email, date, aliments, symptomes) VALUES (?, ?, ?, ?)", 
+            (user_email, str(date), aliments_json, symptomes_json)
+        )
+        added = _write_entry_details(cursor, cursor.lastrowid, aliments, symptomes_data)
+        _bump_data_version(cursor, [user_email], rewrite=False)
+        conn.commit()
+    _entries_written(user_email, date, added)
+
+def _row_to_entry(row):
+    return (
+        datetime.strptime(row['date'], '%Y-%m-%d').date(),
+        safe_json_loads(row['aliments']),
+        safe_json_loads(row['symptomes'])
     )
 
-def get_entries(user_email):
+def _load_aliment_history(user_email):
+    rows = execute_query(
+        "SELECT a.nom, SUM(st.n) AS n, MAX(st.month) AS last_month "
+        "FROM stats_aliments st JOIN aliments a ON a.id = st.aliment_id "
+        "WHERE st.user_email = ? GROUP BY st.aliment_id",
+        (user_email,),
+        fetch=True
+    )
+    return {row['nom']: (row['n'], row['last_month']) for row in rows}
+
+@timed(kind='query')
+def get_aliment_history(user_email):
+    """{food name: (times eaten, last month eaten as 'YYYY-MM')} for one user."""
+    return query_cache.fetch(
+        _user_key('get_aliment_history', user_email), user_email, lambda: _load_aliment_history(user_email)
+    )
+
+def _load_entries(user_email):
     entries = execute_query(
-        "SELECT date, aliments, symptomes FROM entries WHERE user_email = ?", 
+        "SELECT date, aliments, symptomes FROM entries WHERE user_email = ? ORDER BY date", 
         (user_email,), 
         fetch=True
     )
-    return [
-        (
-            datetime.strptime(row['date'], '%Y-%m-%d').date(),
-            safe_json_loads(row['aliments']),
-            safe_json_loads(row['symptomes'])
-        ) 
-        for row in entries
-    ]
+    return [_row_to_entry(row) for row in entries]
+
+@timed(kind='query')
+def get_entries(user_email):
+    return query_cache.fetch(
+        _user_key('get_entries', user_email), user_email, lambda: _load_entries(user_email), span=(None, None)
+    )
+
+def _load_entry(user_email, date):
+    rows = execute_query(
+        "SELECT date, aliments, symptomes FROM entries WHERE user_email = ? AND date = ?",
+        (user_email, date),
+        fetch=True
+    )
+    return _row_to_entry(rows[0]) if rows else None
+
+@timed(kind='query')
+def get_entry(user_email, date):
+    date = str(date)
+    return query_cache.fetch(
+        _user_key('get_entry', user_email, date), user_email, lambda: _load_entry(user_email, date),
+        span=(date, date)
+    )
+
+def _load_entries_between(user_email, start_date, end_date):
+    entries = execute_query(
+        "SELECT date, aliments, symptomes FROM entries "
+        "WHERE user_email = ? AND date BETWEEN ? AND ? ORDER BY date",
+        (user_email, start_date, end_date),
+        fetch=True
+    )
+    return [_row_to_entry(row) for row in entries]
+
+@timed(kind='query')
+def get_entries_between(user_email, start_date, end_date):
+    """Entries with start_date <= date <= end_date, oldest first."""
+    start_date, end_date = str(start_date), str(end_date)
+    return query_cache.fetch(
+        _user_key('get_entries_between', user_email, start_date, end_date),
+        user_email,
+        lambda: _load_entries_between(user_email, start_date, end_date),
+        span=(start_date, end_date)
+    )
+
+_prefetch_pool = None
+_prefetching = set()
+_prefetch_lock = threading.Lock()
+
+def prefetch_entries_between(user_email, ranges):
+    """Warm the query cache for ``(start_date, end_date)`` ranges in the background.
+
+    A later ``get_entries_between`` for one of those ranges is then a cache
+    hit. Ranges already cached or being fetched are not queued again.
+    """
+    global _prefetch_pool
+    if not query_cache.enabled:
+        return
+    with _prefetch_lock:
+        if _prefetch_pool is None:
+            _prefetch_pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix='prefetch')
+        for start_date, end_date in ranges:
+            key = _user_key('get_entries_between', user_email, str(start_date), str(end_date))
+            if key in _prefetching or key in query_cache:
+                continue
+            _prefetching.add(key)
+            _prefetch_pool.submit(_prefetch, key)
+
+def _prefetch(key):
+    _, user_email, _, start_date, end_date = key
+    try:
+        get_entries_between(user_email, start_date, end_date)
+    finally:
+        with _prefetch_lock:
+            _prefetching.discard(key)
 
-def clean_database():
+@timed(kind='query')
+def get_entries_page(user_email, after=None, limit=100):
+    """One keyset page of entries strictly after the ``after`` date.
+
+    Returns ``(entries, next_cursor)``; ``next_cursor`` is None on the last page.
+    """
+    entries = execute_query(
+        "SELECT date, aliments, symptomes FROM entries "
+        "WHERE user_email = ? AND date > ? ORDER BY date LIMIT ?",
+        (user_email, str(after) if after is not None else '', limit),
+        fetch=True
+    )
+    page = [_row_to_entry(row) for row in entries]
+    next_cursor = page[-1][0] if len(page) == limit else None
+    return page, next_cursor
+
+def iter_entries(user_email, page_size=500):
+    cursor = None
+    while True:
+        page, cursor = get_entries_page(user_email, after=cursor, limit=page_size)
+        yield from page
+        if cursor is None:
+            return
+
+def iter_all_entries(user_emails=None, page_size=1000):
+    """Every entry as (user_email, date, repas, symptomes_data), in id order.
+
+    Rows are fetched one keyset page at a time so memory stays flat; pass
+    ``user_emails`` to restrict the export to some users.
+    """
+    clause, params = "", ()
+    if user_emails:
+        user_emails = list(user_emails)
+        clause = f" AND user_email IN ({', '.join('?' * len(user_emails))})"
+        params = tuple(user_emails)
+    last_id = 0
+    while True:
+        rows = execute_query(
+            "SELECT id, user_email, date, aliments, symptomes FROM entries "
+            "WHERE id > ?" + clause + " ORDER BY id LIMIT ?",
+            (last_id, *params, page_size),
+            fetch=True
+        )
+        for row in rows:
+            yield row['user_email'], row['date'], safe_json_loads(row['aliments']), safe_json_loads(row['symptomes'])
+        if len(rows) < page_size:
+            return
+        last_id = rows[-1]['id']
+
+def iter_aliments(page_size=1000):
+    last_id = 0
+    while True:
+        rows = execute_query(
+            "SELECT id, nom FROM aliments WHERE id > ? ORDER BY id LIMIT ?", (last_id, page_size), fetch=True
+        )
+        for row in rows:
+            yield row['nom']
+        if len(rows) < page_size:
+            return
+        last_id = rows[-1]['id']
+
+@timed(kind='query')
+def add_aliments(noms, chunk_size=1000):
+    """Bulk ``add_aliment``, one transaction per chunk. Returns how many were new."""
+    added = 0
+    iterator = iter(noms)
+    while True:
+        chunk = list(itertools.islice(iterator, chunk_size))
+        if not chunk:
+            break
+        with get_db_connection() as conn:
+            before = conn.total_changes
+            conn.executemany("INSERT OR IGNORE INTO aliments (nom) VALUES (?)", [(nom,) for nom in chunk])
+            added += conn.total_changes - before
+            conn.commit()
+    if added:
+        _catalog_changed()
+    return added
+
+CLEAN_JOB = 'clean_database'
+CLEAN_CHUNK_SIZE = 1000
+
+def _invalid_entry_ids(rows):
+    """Ids of the (id, aliments, symptomes) rows whose JSON cannot be parsed.
+
+    Runs in the clean workers: plain tuples in, ids out, no connection.
+    """
+    invalid = []
+    for entry_id, aliments, symptomes in rows:
+        try:
+            json.loads(aliments)
+            json.loads(symptomes)
+        except (json.JSONDecodeError, TypeError):
+            invalid.append(entry_id)
+    return invalid
+
+def _completed(value):
+    future = Future()
+    future.set_result(value)
+    return future
+
+@timed(kind='query')
+def clean_database(chunk_size=CLEAN_CHUNK_SIZE, workers=None, restart=False, progress=None):
+    """Delete entries whose JSON cannot be parsed, one committed chunk at a time.
+
+    Rows are read in id order by keyset and validated in a process pool
+    (``workers=0`` validates inline) while the next chunks are being read.
+    Each chunk's deletions and the checkpoint in ``maintenance_state`` are
+    committed together, so an interrupted run resumes after the last chunk
+    unless ``restart`` is set. ``progress`` is called with the running
+    counts after every chunk, which are also returned.
+    """
+    workers = (os.cpu_count() or 1) if workers is None else workers
     with get_db_connection() as conn:
         cursor = conn.cursor()
-        cursor.execute("SELECT rowid, * FROM entries")
-        rows = cursor.fetchall()
-        for row in rows:
-            rowid, _, _, date, aliments, symptomes = row
-            try:
-                json.loads(aliments)
-                json.loads(symptomes)
-            except json.JSONDecodeError:
-                cursor.execute("DELETE FROM entries WHERE rowid = ?", (rowid,))
+        checkpoint = None
+        if restart:
+            cursor.execute("DELETE FROM maintenance_state WHERE job = ?", (CLEAN_JOB,))
+            conn.commit()
+        else:
+            checkpoint = cursor.execute(
+                "SELECT last_id, scanned, deleted FROM maintenance_state WHERE job = ?", (CLEAN_JOB,)
+            ).fetchone()
+        last_id, scanned, deleted = tuple(checkpoint) if checkpoint else (0, 0, 0)
+        counts = {'scanned': scanned, 'deleted': deleted, 'last_id': last_id, 'resumed': checkpoint is not None}
+        total = cursor.execute("SELECT COUNT(*) FROM entries WHERE id > ?", (last_id,)).fetchone()[0]
+        counts['total'] = scanned + total
+
+        # Spawned, not forked: the parent holds pooled connections and the
+        # job runner's and prefetch threads, which a fork would copy mid-use
+        pool = ProcessPoolExecutor(
+            max_workers=workers, mp_context=multiprocessing.get_context('spawn')
+        ) if workers > 0 else None
+        try:
+            pending = deque()
+            read_id = last_id
+            exhausted = False
+            while True:
+                # Keep every worker busy with the chunks that follow the one being committed
+                while not exhausted and len(pending) < max(workers, 1) + 1:
+                    rows = cursor.execute(
+                        "SELECT id, user_email, aliments, symptomes FROM entries WHERE id > ? ORDER BY id LIMIT ?",
+                        (read_id, chunk_size)
+                    ).fetchall()
+                    if not rows:
+                        exhausted = True
+                        break
+                    read_id = rows[-1]['id']
+                    owners = {row['id']: row['user_email'] for row in rows}
+                    rows = [(row['id'], row['aliments'], row['symptomes']) for row in rows]
+                    result = pool.submit(_invalid_entry_ids, rows) if pool else _completed(_invalid_entry_ids(rows))
+                    pending.append((read_id, owners, result))
+                if not pending:
+                    break
+                chunk_last_id, owners, result = pending.popleft()
+                invalid = result.result()
+                if invalid:
+                    _delete_entry_details(cursor, invalid)
+                    cursor.executemany("DELETE FROM entries WHERE id = ?", [(entry_id,) for entry_id in invalid])
+                    _bump_data_version(cursor, {owners[entry_id] for entry_id in invalid})
+                counts['scanned'] += len(owners)
+                counts['deleted'] += len(invalid)
+                counts['last_id'] = chunk_last_id
+                cursor.execute(
+                    "INSERT OR REPLACE INTO maintenance_state (job, last_id, scanned, deleted, updated_at) "
+                    "VALUES (?, ?, ?, ?, ?)",
+                    (CLEAN_JOB, chunk_last_id, counts['scanned'], counts['deleted'], datetime.now().isoformat())
+                )
+                conn.commit()
+                if invalid:
+                    query_cache.clear()
+                if progress is not None:
+                    progress(dict(counts))
+        finally:
+            if pool is not None:
+                pool.shutdown(cancel_futures=True)
+        cursor.execute("DELETE FROM maintenance_state WHERE job = ?", (CLEAN_JOB,))
         conn.commit()
-        
+    return counts
+
+@timed(kind='query')
 def update_entry(user_email, date, aliments, symptomes_data):
     aliments_json = json.dumps(aliments)
     symptomes_json = json.dumps(symptomes_data)
-    execute_query(
-        "UPDATE entries SET aliments = ?, symptomes = ? WHERE user_email = ? AND date = ?", 
-        (aliments_json, symptomes_json, user_email, str(date))
-    )
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(
+            "UPDATE entries SET aliments = ?, symptomes = ? WHERE user_email = ? AND date = ?", 
+            (aliments_json, symptomes_json, user_email, str(date))
+        )
+        row = cursor.execute(
+            "SELECT id FROM entries WHERE user_email = ? AND date = ?", (user_email, str(date))
+        ).fetchone()
+        added = 0
+        if row is not None:
+            added = _write_entry_details(cursor, row['id'], aliments, symptomes_data)
+            _bump_data_version(cursor, [user_email])
+        conn.commit()
+    _entries_written(user_email, date, added)
 
+@timed(kind='query')
 def delete_entry(user_email, date):
-    execute_query(
-        "DELETE FROM entries WHERE user_email = ? AND date = ?", 
-        (user_email, str(date))
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        ids = [row['id'] for row in cursor.execute(
+            "SELECT id FROM entries WHERE user_email = ? AND date = ?", (user_email, str(date))
+        )]
+        _delete_entry_details(cursor, ids)
+        cursor.execute(
+            "DELETE FROM entries WHERE user_email = ? AND date = ?", 
+            (user_email, str(date))
+        )
+        if ids:
+            _bump_data_version(cursor, [user_email])
+        conn.commit()
+    _entries_written(user_email, date)
+
+@timed(kind='query')
+def save_day(user_email, date, repas, symptomes_data):
+    """Create or update one day's entry and register its new food names.
+
+    Everything happens in a single transaction; food names go through one
+    ``executemany`` upsert. Returns True when a new entry was created.
+    """
+    aliments_json = json.dumps(repas)
+    symptomes_json = json.dumps(symptomes_data)
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        row = cursor.execute(
+            "SELECT id FROM entries WHERE user_email = ? AND date = ?", (user_email, str(date))
+        ).fetchone()
+        if row is None:
+            cursor.execute(
+                "INSERT INTO entries (user_email, date, aliments, symptomes) VALUES (?, ?, ?, ?)",
+                (user_email, str(date), aliments_json, symptomes_json)
+            )
+            entry_id = cursor.lastrowid
+        else:
+            entry_id = row['id']
+            cursor.execute(
+                "UPDATE entries SET aliments = ?, symptomes = ? WHERE id = ?",
+                (aliments_json, symptomes_json, entry_id)
+            )
+        added = _write_entry_details(cursor, entry_id, repas, symptomes_data)
+        _bump_data_version(cursor, [user_email], rewrite=row is not None)
+        conn.commit()
+    _entries_written(user_email, date, added)
+    return row is None
+
+_BULK_IDS = 'e.id IN (SELECT id FROM temp.bulk_entry_ids)'
+
+def _bulk_key_ids(cursor):
+    """``{(user_email, date): id}`` of the entries matching temp.bulk_keys, in one join."""
+    rows = cursor.execute(
+        "SELECT k.user_email, k.date, e.id FROM temp.bulk_keys k "
+        "JOIN entries e ON e.user_email = k.user_email AND e.date = k.date"
+    ).fetchall()
+    return {(row[0], row[1]): row[2] for row in rows}
+
+def _save_days_chunk(cursor, days, replace):
+    """Write one chunk of ``{(user_email, date): (repas, symptomes_data)}``."""
+    # The chunk's keys go to a temp table so existing and new ids each take one query
+    cursor.execute(
+        "CREATE TEMP TABLE IF NOT EXISTS bulk_keys (user_email TEXT, date TEXT, PRIMARY KEY (user_email, date))"
+    )
+    cursor.execute("DELETE FROM temp.bulk_keys")
+    cursor.executemany("INSERT INTO temp.bulk_keys (user_email, date) VALUES (?, ?)", list(days))
+    ids = _bulk_key_ids(cursor)
+    new_keys = [key for key in days if key not in ids]
+    updated_keys = [key for key in days if key in ids] if replace else []
+
+    cursor.executemany(
+        "INSERT INTO entries (user_email, date, aliments, symptomes) VALUES (?, ?, ?, ?)",
+        [(*key, json.dumps(days[key][0]), json.dumps(days[key][1])) for key in new_keys]
+    )
+    if new_keys:
+        ids = _bulk_key_ids(cursor)
+    cursor.executemany(
+        "UPDATE entries SET aliments = ?, symptomes = ? WHERE id = ?",
+        [(json.dumps(days[key][0]), json.dumps(days[key][1]), ids[key]) for key in updated_keys]
     )
 
-# Call init_db() when this module is imported
-init_db()
\ No newline at end of file
+    # Stats are applied for the whole chunk at once through a temp id table
+    cursor.execute("CREATE TEMP TABLE IF NOT EXISTS bulk_entry_ids (id INTEGER PRIMARY KEY)")
+    cursor.execute("DELETE FROM temp.bulk_entry_ids")
+    if updated_keys:
+        cursor.executemany("INSERT INTO temp.bulk_entry_ids (id) VALUES (?)", [(ids[key],) for key in updated_keys])
+        _apply_stats_delta_where(cursor, _BULK_IDS, (), -1)
+        params = [(ids[key],) for key in updated_keys]
+        cursor.executemany("DELETE FROM entry_aliments WHERE entry_id = ?", params)
+        cursor.executemany("DELETE FROM entry_symptomes WHERE entry_id = ?", params)
+        cursor.execute("DELETE FROM temp.bulk_entry_ids")
+
+    written = new_keys + updated_keys
+    added = _insert_entry_details(cursor, [(ids[key], *days[key]) for key in written])
+    cursor.executemany("INSERT INTO temp.bulk_entry_ids (id) VALUES (?)", [(ids[key],) for key in written])
+    _apply_stats_delta_where(cursor, _BULK_IDS, (), 1)
+    rewritten = {key[0] for key in updated_keys}
+    _bump_data_version(cursor, rewritten)
+    _bump_data_version(cursor, {key[0] for key in new_keys} - rewritten, rewrite=False)
+    return len(new_keys), len(updated_keys), len(days) - len(written), added
+
+@timed(kind='query')
+def save_days(days, chunk_size=500, replace=True):
+    """Bulk ``save_day`` for an iterable of (user_email, date, repas, symptomes_data).
+
+    Rows are consumed lazily and written ``chunk_size`` at a time, one
+    transaction per chunk. Days that already exist are overwritten, or left
+    untouched when ``replace`` is False. Returns counts of inserted, updated
+    and skipped days.
+    """
+    counts = {'inserted': 0, 'updated': 0, 'skipped': 0}
+    iterator = iter(days)
+    while True:
+        chunk = {}
+        for user_email, date, repas, symptomes_data in iterator:
+            key = (user_email, str(date))
+            if key in chunk:
+                counts['skipped'] += 1
+            chunk[key] = (repas, symptomes_data)
+            if len(chunk) >= chunk_size:
+                break
+        if not chunk:
+            return counts
+        with get_db_connection() as conn:
+            inserted, updated, skipped, added = _save_days_chunk(conn.cursor(), chunk, replace)
+            conn.commit()
+        counts['inserted'] += inserted
+        counts['updated'] += updated
+        counts['skipped'] += skipped
+        for user_email in {key[0] for key in chunk}:
+            query_cache.invalidate(user_email)
+        if added:
+            _catalog_changed()
+
+def _date_filter(start_date, end_date):
+    clause, params = "", []
+    if start_date is not None:
+        clause += " AND e.date >= ?"
+        params.append(str(start_date))
+    if end_date is not None:
+        clause += " AND e.date <= ?"
+        params.append(str(end_date))
+    return clause, params
+
+@timed(kind='query')
+def get_aliment_counts(user_email, start_date=None, end_date=None):
+    """(nom, count) per food, counting every occurrence in every meal."""
+    clause, params = _date_filter(start_date, end_date)
+    rows = execute_query(
+        "SELECT a.nom, COUNT(*) AS n FROM entries e "
+        "JOIN entry_aliments ea ON ea.entry_id = e.id "
+        "JOIN aliments a ON a.id = ea.aliment_id "
+        "WHERE e.user_email = ?" + clause + " GROUP BY ea.aliment_id",
+        (user_email, *params),
+        fetch=True
+    )
+    return [(row['nom'], row['n']) for row in rows]
+
+@timed(kind='query')
+def get_symptome_counts(user_email, start_date=None, end_date=None):
+    clause, params = _date_filter(start_date, end_date)
+    rows = execute_query(
+        "SELECT s.nom, COUNT(*) AS n FROM entries e "
+        "JOIN entry_symptomes es ON es.entry_id = e.id "
+        "JOIN symptomes s ON s.id = es.symptome_id "
+        "WHERE e.user_email = ?" + clause + " GROUP BY es.symptome_id",
+        (user_email, *params),
+        fetch=True
+    )
+    return [(row['nom'], row['n']) for row in rows]
+
+@timed(kind='query')
+def get_aliment_symptome_counts(user_email, start_date=None, end_date=None):
+    """(aliment, symptome, count) for foods and symptoms logged on the same day."""
+    clause, params = _date_filter(start_date, end_date)
+    rows = execute_query(
+        "SELECT a.nom AS aliment, s.nom AS symptome, COUNT(*) AS n FROM entries e "
+        "JOIN entry_aliments ea ON ea.entry_id = e.id "
+        "JOIN entry_symptomes es ON es.entry_id = e.id "
+        "JOIN aliments a ON a.id = ea.aliment_id "
+        "JOIN symptomes s ON s.id = es.symptome_id "
+        "WHERE e.user_email = ?" + clause + " GROUP BY ea.aliment_id, es.symptome_id",
+        (user_email, *params),
+        fetch=True
+    )
+    return [(row['aliment'], row['symptome'], row['n']) for row in rows]
+
+@timed(kind='query')
+def rebuild_stats(user_email=None):
+    """Recompute the materialized stats from the entries (all users by default)."""
+    with get_db_connection() as conn:
+        _rebuild_stats(conn.cursor(), user_email)
+        conn.commit()
+
+@timed(kind='query')
+def verify_stats(user_email=None):
+    """Compare the materialized stats with a fresh aggregation.
+
+    Returns ``{table: number of differing rows}`` for the tables that drifted.
+    """
+    where, params = ('e.user_email = ?', (user_email,)) if user_email is not None else ('1', ())
+    stored_filter = 'WHERE user_email = ?' if user_email is not None else ''
+    drift = {}
+    with get_db_connection() as conn:
+        for table, (keys, query) in STATS_TABLES.items():
+            fresh = query.format(where=where)
+            stored = f"SELECT user_email, month, {keys}, n FROM {table} {stored_filter}"
+            count = conn.execute(
+                f"SELECT (SELECT COUNT(*) FROM ({fresh} EXCEPT {stored})) + "
+                f"(SELECT COUNT(*) FROM ({stored} EXCEPT {fresh}))",
+                params * 4
+            ).fetchone()[0]
+            if count:
+                drift[table] = count
+    return drift
+
+def _stored_links(conn, entry_ids):
+    marks = ', '.join('?' * len(entry_ids))
+    foods, symptoms = {}, {}
+    for row in conn.execute(
+        "SELECT ea.entry_id, ea.repas, a.nom FROM entry_aliments ea JOIN aliments a ON a.id = ea.aliment_id "
+        f"WHERE ea.entry_id IN ({marks}) ORDER BY ea.entry_id, ea.position", entry_ids
+    ):
+        foods.setdefault(row[0], []).append((row[1], row[2]))
+    for row in conn.execute(
+        "SELECT es.entry_id, s.nom, es.intensite FROM entry_symptomes es JOIN symptomes s ON s.id = es.symptome_id "
+        f"WHERE es.entry_id IN ({marks}) ORDER BY es.entry_id, es.position", entry_ids
+    ):
+        symptoms.setdefault(row[0], []).append((row[1], row[2]))
+    return foods, symptoms
+
+@timed(kind='query')
+def verify_links(user_email=None, batch_size=500):
+    """Ids of the entries whose link rows do not match their JSON columns.
+
+    The JSON columns are the source of truth; ``entry_aliments`` and
+    ``entry_symptomes`` are written alongside them and feed the statistics
+    and the analysis.
+    """
+    where, params = ('WHERE user_email = ?', (user_email,)) if user_email is not None else ('', ())
+    drifted = []
+    with read_transaction() as conn:
+        reader = conn.execute(f"SELECT id, aliments, symptomes FROM entries {where} ORDER BY id", params)
+        while True:
+            rows = reader.fetchmany(batch_size)
+            if not rows:
+                return drifted
+            foods, symptoms = _stored_links(conn, [row['id'] for row in rows])
+            for row in rows:
+                noms, intensite = _split_symptomes(safe_json_loads(row['symptomes']))
+                if (foods.get(row['id'], []) != _split_aliments(safe_json_loads(row['aliments']))
+                        or symptoms.get(row['id'], []) != [(nom, intensite) for nom in noms]):
+                    drifted.append(row['id'])
+
+@timed(kind='query')
+def repair_links(user_email=None):
+    """Rewrite the link rows (and stats) of entries that drifted from their JSON.
+
+    Returns the number of entries repaired.
+    """
+    entry_ids = verify_links(user_email)
+    if not entry_ids:
+        return 0
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        users, added = set(), 0
+        for entry_id in entry_ids:
+            row = cursor.execute(
+                "SELECT user_email, aliments, symptomes FROM entries WHERE id = ?", (entry_id,)
+            ).fetchone()
+            if row is None:
+                continue
+            added += _write_entry_details(
+                cursor, entry_id, safe_json_loads(row['aliments']), safe_json_loads(row['symptomes'])
+            )
+            users.add(row['user_email'])
+        _bump_data_version(cursor, users)
+        conn.commit()
+    for user in users:
+        query_cache.invalidate(user)
+    if added:
+        _catalog_changed()
+    return len(entry_ids)
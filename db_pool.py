@@ -0,0 +1,210 @@
+import os
+import queue
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+DEFAULT_POOL_SIZE = int(os.environ.get('FOODDIARY_POOL_SIZE', 8))
+DEFAULT_POOL_TIMEOUT = float(os.environ.get('FOODDIARY_POOL_TIMEOUT', 30))
+# Idle connections older than this are pinged before being handed out again
+HEALTH_CHECK_INTERVAL = 30.0
+
+# Pragmas applied to every new connection. WAL lets readers run alongside a
+# writer; "synchronous" decides how often commits wait for an fsync.
+STORAGE_PROFILES = {
+    'durable': {
+        'journal_mode': 'WAL',
+        'synchronous': 'FULL',
+        'cache_size': -8000,          # KiB when negative
+        'mmap_size': 64 * 1024 * 1024,
+        'temp_store': 'MEMORY',
+        'busy_timeout': 10000,        # ms
+    },
+    'balanced': {
+        'journal_mode': 'WAL',
+        'synchronous': 'NORMAL',
+        'cache_size': -16000,
+        'mmap_size': 128 * 1024 * 1024,
+        'temp_store': 'MEMORY',
+        'busy_timeout': 5000,
+    },
+    'fast': {
+        'journal_mode': 'WAL',
+        'synchronous': 'OFF',
+        'cache_size': -64000,
+        'mmap_size': 256 * 1024 * 1024,
+        'temp_store': 'MEMORY',
+        'busy_timeout': 5000,
+    },
+}
+DEFAULT_STORAGE_PROFILE = os.environ.get('FOODDIARY_STORAGE_PROFILE', 'balanced')
+
+_PRAGMA_CHOICES = {
+    'journal_mode': {'DELETE', 'TRUNCATE', 'PERSIST', 'MEMORY', 'WAL', 'OFF'},
+    'synchronous': {'OFF', 'NORMAL', 'FULL', 'EXTRA'},
+    'temp_store': {'DEFAULT', 'FILE', 'MEMORY'},
+}
+_INT_PRAGMAS = {'cache_size', 'mmap_size', 'busy_timeout'}
+
+
+def resolve_storage_profile(profile):
+    """Return the pragma dict for a profile name, or validate a custom dict."""
+    if profile is None:
+        profile = DEFAULT_STORAGE_PROFILE
+    if isinstance(profile, str):
+        try:
+            return dict(STORAGE_PROFILES[profile])
+        except KeyError:
+            raise ValueError(f"unknown storage profile {profile!r}; "
+                             f"expected one of {sorted(STORAGE_PROFILES)}") from None
+    pragmas = dict(profile)
+    for name, value in pragmas.items():
+        if name in _PRAGMA_CHOICES:
+            if str(value).upper() not in _PRAGMA_CHOICES[name]:
+                raise ValueError(f"invalid value {value!r} for pragma {name}")
+        elif name not in _INT_PRAGMAS:
+            raise ValueError(f"unsupported pragma {name!r}")
+    return pragmas
+
+
+def apply_storage_profile(conn, profile=None):
+    pragmas = resolve_storage_profile(profile)
+    # busy_timeout first so switching the journal mode waits for other writers
+    if 'busy_timeout' in pragmas:
+        conn.execute(f"PRAGMA busy_timeout = {int(pragmas['busy_timeout'])}")
+    for name, value in pragmas.items():
+        if name == 'busy_timeout':
+            continue
+        if name in _INT_PRAGMAS:
+            conn.execute(f"PRAGMA {name} = {int(value)}")
+        else:
+            conn.execute(f"PRAGMA {name} = {str(value).upper()}")
+    return pragmas
+
+
+class PoolClosedError(RuntimeError):
+    pass
+
+
+class PoolTimeoutError(TimeoutError):
+    pass
+
+
+class ConnectionPool:
+    """Bounded pool of long-lived SQLite connections.
+
+    A thread keeps the same connection for as long as it holds it, so nested
+    ``connection()`` blocks (e.g. a helper called from inside a transaction)
+    share one connection instead of checking out a second one.
+    """
+
+    def __init__(self, database, max_size=DEFAULT_POOL_SIZE, timeout=DEFAULT_POOL_TIMEOUT,
+                 health_check_interval=HEALTH_CHECK_INTERVAL, on_connect=None):
+        if max_size < 1:
+            raise ValueError("max_size must be at least 1")
+        self.database = database
+        self.max_size = max_size
+        self.timeout = timeout
+        self.health_check_interval = health_check_interval
+        self.on_connect = on_connect
+        self._slots = threading.BoundedSemaphore(max_size)
+        self._idle = queue.LifoQueue()
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._closed = False
+        self.created = 0
+
+    def _create(self):
+        conn = sqlite3.connect(self.database, timeout=self.timeout, check_same_thread=False)
+        conn.row_factory = sqlite3.Row
+        if self.on_connect is not None:
+            self.on_connect(conn)
+        with self._lock:
+            self.created += 1
+        return conn
+
+    @staticmethod
+    def _is_healthy(conn):
+        try:
+            conn.execute('SELECT 1').fetchone()
+            return True
+        except sqlite3.Error:
+            return False
+
+    @staticmethod
+    def _discard(conn):
+        try:
+            conn.close()
+        except sqlite3.Error:
+            pass
+
+    def _acquire(self):
+        if self._closed:
+            raise PoolClosedError("connection pool is closed")
+        if not self._slots.acquire(timeout=self.timeout):
+            raise PoolTimeoutError(f"no connection available after {self.timeout}s")
+        try:
+            while True:
+                try:
+                    conn, last_used = self._idle.get_nowait()
+                except queue.Empty:
+                    return self._create()
+                if time.monotonic() - last_used < self.health_check_interval or self._is_healthy(conn):
+                    return conn
+                self._discard(conn)
+        except BaseException:
+            self._slots.release()
+            raise
+
+    def _release(self, conn):
+        try:
+            if conn.in_transaction:
+                conn.rollback()
+            healthy = True
+        except sqlite3.Error:
+            healthy = False
+        if self._closed or not healthy:
+            self._discard(conn)
+        else:
+            self._idle.put((conn, time.monotonic()))
+        self._slots.release()
+
+    @contextmanager
+    def connection(self):
+        local = self._local
+        conn = getattr(local, 'conn', None)
+        if conn is not None:
+            local.depth += 1
+            try:
+                yield conn
+            finally:
+                local.depth -= 1
+            return
+
+        conn = self._acquire()
+        local.conn = conn
+        local.depth = 1
+        try:
+            yield conn
+        finally:
+            local.conn = None
+            local.depth = 0
+            # Uncommitted work is rolled back so the next borrower starts clean
+            self._release(conn)
+
+    def close(self):
+        self._closed = True
+        while True:
+            try:
+                conn, _ = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            self._discard(conn)
+
+    @property
+    def closed(self):
+        return self._closed
+
+    def idle_count(self):
+        return self._idle.qsize()
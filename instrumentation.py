@@ -0,0 +1,174 @@
+import functools
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+# Read once at import: when disabled, ``timed`` returns the function itself and
+# nothing below runs, so instrumentation costs nothing in production.
+ENABLED = os.environ.get('FOODDIARY_PROFILE', '').lower() in ('1', 'true', 'yes')
+SLOW_QUERY_MS = float(os.environ.get('FOODDIARY_SLOW_MS', 100))
+EXPORT_PATH = os.environ.get('FOODDIARY_PROFILE_EXPORT', 'fooddiary_profile.json')
+ROLLING_WINDOW = 1000
+HISTOGRAM_BOUNDS_MS = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000)
+
+slow_log = logging.getLogger('fooddiary.slow')
+
+_local = threading.local()
+_samples = {}
+_samples_lock = threading.Lock()
+
+
+class RerunStats:
+    """What one Streamlit rerun spent: SQL statements, rows, JSON decoding, calls."""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.wall_ms = 0.0
+        self.queries = 0
+        self.rows = 0
+        self.json_calls = 0
+        self.json_ms = 0.0
+        self.calls = {}  # name -> [count, total_ms]
+
+    def as_dict(self):
+        # Inside the block wall_ms is not final yet: report the time so far
+        wall_ms = self.wall_ms or (time.perf_counter() - self.started) * 1000
+        return {
+            'wall_ms': round(wall_ms, 3),
+            'queries': self.queries,
+            'rows': self.rows,
+            'json_calls': self.json_calls,
+            'json_ms': round(self.json_ms, 3),
+            'calls': {name: {'count': c, 'total_ms': round(t, 3)} for name, (c, t) in self.calls.items()},
+        }
+
+
+def current_rerun():
+    return getattr(_local, 'rerun', None)
+
+
+@contextmanager
+def rerun():
+    """Collect statistics for everything the current thread does in the block."""
+    stats = RerunStats()
+    previous, _local.rerun = current_rerun(), stats
+    try:
+        yield stats
+    finally:
+        stats.wall_ms = (time.perf_counter() - stats.started) * 1000
+        _local.rerun = previous
+        if ENABLED:
+            _record('rerun', stats.wall_ms)
+
+
+def _record(name, elapsed_ms):
+    with _samples_lock:
+        samples = _samples.get(name)
+        if samples is None:
+            samples = _samples[name] = deque(maxlen=ROLLING_WINDOW)
+        samples.append(elapsed_ms)
+
+
+def timed(name=None, kind='call', sql_entry_point=False):
+    """Decorator recording wall time and call count.
+
+    ``kind='query'`` calls slower than SLOW_QUERY_MS go to the slow log; for
+    the low-level ``sql_entry_point`` the log also carries its first
+    positional argument (the SQL text, never its parameters).
+    """
+    def decorate(fn):
+        if not ENABLED:
+            return fn
+        label = name or f"{fn.__module__}.{fn.__qualname__}"
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                result = fn(*args, **kwargs)
+            finally:
+                elapsed_ms = (time.perf_counter() - start) * 1000
+                _record(label, elapsed_ms)
+                stats = current_rerun()
+                if stats is not None:
+                    call = stats.calls.setdefault(label, [0, 0.0])
+                    call[0] += 1
+                    call[1] += elapsed_ms
+                if kind == 'query' and elapsed_ms >= SLOW_QUERY_MS:
+                    sql = ' '.join(str(args[0]).split()) if sql_entry_point and args else ''
+                    slow_log.warning("slow query %s took %.1f ms %s", label, elapsed_ms, sql)
+            return result
+        return wrapper
+    return decorate
+
+
+def timed_json(fn):
+    """Decorator for JSON decoding helpers: adds time to the rerun's json_ms."""
+    if not ENABLED:
+        return fn
+
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            stats = current_rerun()
+            if stats is not None:
+                stats.json_calls += 1
+                stats.json_ms += (time.perf_counter() - start) * 1000
+    return wrapper
+
+
+def trace_statement(statement):
+    """sqlite3 trace callback counting executed SQL statements."""
+    stats = current_rerun()
+    if stats is not None:
+        stats.queries += 1
+
+
+def counting_row_factory(cursor, row):
+    """sqlite3 row factory counting fetched rows, whatever code path fetched them."""
+    stats = current_rerun()
+    if stats is not None:
+        stats.rows += 1
+    return sqlite3.Row(cursor, row)
+
+
+def histogram(name):
+    with _samples_lock:
+        samples = list(_samples.get(name, ()))
+    counts = [0] * (len(HISTOGRAM_BOUNDS_MS) + 1)
+    for value in samples:
+        for index, bound in enumerate(HISTOGRAM_BOUNDS_MS):
+            if value <= bound:
+                counts[index] += 1
+                break
+        else:
+            counts[-1] += 1
+    ordered = sorted(samples)
+    return {
+        'count': len(samples),
+        'p50_ms': round(ordered[len(ordered) // 2], 3) if ordered else None,
+        'p95_ms': round(ordered[min(int(len(ordered) * 0.95), len(ordered) - 1)], 3) if ordered else None,
+        'bounds_ms': list(HISTOGRAM_BOUNDS_MS) + ['inf'],
+        'counts': counts,
+    }
+
+
+def histograms():
+    with _samples_lock:
+        names = sorted(_samples)
+    return {name: histogram(name) for name in names}
+
+
+def export_histograms(path=EXPORT_PATH):
+    """Write the rolling histograms to ``path`` as JSON."""
+    with open(path, 'w') as f:
+        json.dump({'exported_at': time.time(), 'histograms': histograms()}, f, indent=2)
+    return path
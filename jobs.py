@@ -0,0 +1,298 @@
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+import database
+
+JOB_WORKERS = int(os.environ.get('FOODDIARY_JOB_WORKERS', 2))
+# Finished rows (results included) are deleted this long after they finish
+JOB_RETENTION_DAYS = float(os.environ.get('FOODDIARY_JOB_RETENTION_DAYS', 7))
+# A job still pending or running after this long belongs to a dead process
+STALE_JOB_HOURS = 1.0
+PRUNE_INTERVAL = 3600.0
+
+PENDING, RUNNING, DONE, FAILED, CANCELLED = 'pending', 'running', 'done', 'failed', 'cancelled'
+ACTIVE = (PENDING, RUNNING)
+
+_registry = {}
+
+
+class JobCancelled(Exception):
+    """Raised inside a job at its next progress report once it was cancelled."""
+
+
+def register(kind, fn):
+    """Make ``fn(context, user_email, **params)`` runnable as job ``kind``."""
+    _registry[kind] = fn
+
+
+def job_key(kind, user_email, params):
+    return json.dumps([kind, user_email, params], sort_keys=True, default=str)
+
+
+class JobContext:
+    """Handed to a running job to report progress and notice cancellation."""
+
+    def __init__(self, runner, job_id, cancel_event):
+        self._runner = runner
+        self.job_id = job_id
+        self._cancel = cancel_event
+
+    @property
+    def cancelled(self):
+        return self._cancel.is_set()
+
+    def progress(self, fraction, message=''):
+        if self._cancel.is_set():
+            raise JobCancelled()
+        self._runner._update(self.job_id, progress=fraction, message=message)
+
+
+class JobView:
+    """Where a requested report stands, as shown by the UI.
+
+    ``result`` is the fresh result once ``status`` is DONE; while the job is
+    still active it is the latest result of an older data version, if any,
+    and ``stale`` is set.
+    """
+
+    def __init__(self, job_id, status, progress=0.0, message='', result=None, stale=False, error=None):
+        self.job_id = job_id
+        self.status = status
+        self.progress = progress
+        self.message = message
+        self.result = result
+        self.stale = stale
+        self.error = error
+
+    @property
+    def done(self):
+        return self.status == DONE and not self.stale
+
+    @property
+    def active(self):
+        return self.status in ACTIVE
+
+
+class _ActiveJob:
+    def __init__(self, job_id, key, kind, user_email, version, params):
+        self.job_id = job_id
+        self.key = key
+        self.kind = kind
+        self.user_email = user_email
+        self.version = version
+        self.params = params
+        self.cancel_event = threading.Event()
+        self.owners = set()
+        self.future = None
+
+
+class JobRunner:
+    """Runs registered report jobs on a local thread pool.
+
+    Every job is a row of the ``jobs`` table holding its status, progress
+    and JSON result for one (kind, user, params) key at one data version.
+    Identical requests while a job is pending or running share it; each
+    requester is an owner, and a job that loses its last owner is
+    cancelled. Deduplication is per process, which is one Streamlit server.
+    Old rows are pruned when the runner starts and then hourly (see ``prune``).
+    """
+
+    def __init__(self, workers=JOB_WORKERS):
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='job')
+        self._lock = threading.Lock()
+        self._active = {}  # (key, version) -> _ActiveJob
+        self._by_id = {}  # job id -> _ActiveJob
+        self._pruned_at = 0.0
+        self.prune()
+
+    def request(self, kind, user_email, version, params, owner=None):
+        """Fresh result of a report if computed, else start (or join) its job.
+
+        ``params`` must be JSON-serializable; they are passed to the job
+        function as keyword arguments.
+        """
+        key = job_key(kind, user_email, params)
+        # A failure is not retried until the data changes
+        row = _fetch_one(
+            "SELECT id, status, result, error FROM jobs WHERE job_key = ? AND data_version = ? "
+            "AND status IN (?, ?) ORDER BY id DESC LIMIT 1",
+            (key, version, DONE, FAILED)
+        )
+        if row is not None and row['status'] == DONE:
+            return JobView(row['id'], DONE, 1.0, result=json.loads(row['result']))
+        if row is not None:
+            return JobView(row['id'], FAILED, error=row['error'])
+
+        with self._lock:
+            job = self._active.get((key, version))
+            # A cancelled job is only waiting to stop: its result will never come
+            if job is None or job.cancel_event.is_set():
+                job = self._submit(key, kind, user_email, version, params)
+            if owner is not None:
+                job.owners.add(owner)
+        status = self.status(job.job_id)
+        stale = _fetch_one(
+            "SELECT result FROM jobs WHERE job_key = ? AND status = ? AND data_version < ? "
+            "ORDER BY data_version DESC, id DESC LIMIT 1",
+            (key, DONE, version)
+        )
+        if status.status == DONE:
+            return status
+        status.stale = stale is not None
+        status.result = json.loads(stale['result']) if stale is not None else None
+        return status
+
+    def _submit(self, key, kind, user_email, version, params):
+        if kind not in _registry:
+            raise KeyError(f"unknown job kind {kind!r}")
+        now = datetime.now().isoformat()
+        with database.get_db_connection() as conn:
+            cursor = conn.execute(
+                "INSERT INTO jobs (job_key, kind, user_email, data_version, status, progress, created_at) "
+                "VALUES (?, ?, ?, ?, ?, 0, ?)",
+                (key, kind, user_email, version, PENDING, now)
+            )
+            conn.commit()
+        job = _ActiveJob(cursor.lastrowid, key, kind, user_email, version, params)
+        self._active[(key, version)] = job
+        self._by_id[job.job_id] = job
+        job.future = self._pool.submit(self._run, key, version, job)
+        return job
+
+    def _run(self, key, version, job):
+        try:
+            if job.cancel_event.is_set():
+                raise JobCancelled()
+            self._update(job.job_id, status=RUNNING, started_at=datetime.now().isoformat())
+            context = JobContext(self, job.job_id, job.cancel_event)
+            result = _registry[job.kind](context, job.user_email, **job.params)
+            if job.cancel_event.is_set():
+                raise JobCancelled()
+            with database.get_db_connection() as conn:
+                conn.execute(
+                    "UPDATE jobs SET status = ?, progress = 1, result = ?, finished_at = ? WHERE id = ?",
+                    (DONE, json.dumps(result), datetime.now().isoformat(), job.job_id)
+                )
+                # Only the newest finished row of a key is worth keeping
+                conn.execute(
+                    "DELETE FROM jobs WHERE job_key = ? AND id != ? AND status NOT IN (?, ?)",
+                    (key, job.job_id, *ACTIVE)
+                )
+                conn.commit()
+        except JobCancelled:
+            self._update(job.job_id, status=CANCELLED, finished_at=datetime.now().isoformat())
+        except Exception as e:
+            self._update(job.job_id, status=FAILED, error=repr(e), finished_at=datetime.now().isoformat())
+        finally:
+            with self._lock:
+                self._forget(job)
+            if time.monotonic() - self._pruned_at > PRUNE_INTERVAL:
+                self.prune()
+
+    def _forget(self, job):
+        # The key may already belong to a newer job started after a cancel
+        if self._active.get((job.key, job.version)) is job:
+            del self._active[(job.key, job.version)]
+        self._by_id.pop(job.job_id, None)
+
+    def prune(self, now=None):
+        """Apply the retention policy to the ``jobs`` table.
+
+        Rows finished more than JOB_RETENTION_DAYS ago are deleted, and rows
+        left pending or running for STALE_JOB_HOURS by a process that died
+        are marked cancelled, so they expire in turn. Returns the number of
+        rows deleted.
+        """
+        now = now or datetime.now()
+        self._pruned_at = time.monotonic()
+        with database.get_db_connection() as conn:
+            conn.execute(
+                "UPDATE jobs SET status = ?, error = ?, finished_at = ? "
+                "WHERE status IN (?, ?) AND created_at < ?",
+                (CANCELLED, 'interrupted', now.isoformat(), *ACTIVE,
+                 (now - timedelta(hours=STALE_JOB_HOURS)).isoformat())
+            )
+            deleted = conn.execute(
+                "DELETE FROM jobs WHERE status NOT IN (?, ?) AND finished_at < ?",
+                (*ACTIVE, (now - timedelta(days=JOB_RETENTION_DAYS)).isoformat())
+            ).rowcount
+            conn.commit()
+        return deleted
+
+    def _update(self, job_id, **fields):
+        columns = ', '.join(f"{name} = ?" for name in fields)
+        database.execute_query(f"UPDATE jobs SET {columns} WHERE id = ?", (*fields.values(), job_id))
+
+    def status(self, job_id):
+        row = _fetch_one(
+            "SELECT id, status, progress, message, result, error FROM jobs WHERE id = ?", (job_id,)
+        )
+        if row is None:
+            return None
+        result = json.loads(row['result']) if row['status'] == DONE else None
+        return JobView(row['id'], row['status'], row['progress'], row['message'] or '', result,
+                       error=row['error'])
+
+    def cancel(self, job_id):
+        with self._lock:
+            job = self._by_id.get(job_id)
+            if job is None:
+                return False
+            job.cancel_event.set()
+            # A job still waiting in the pool never starts; a running one
+            # stops at its next progress report
+            never_started = job.future.cancel()
+            if never_started:
+                self._forget(job)
+        if never_started:
+            self._update(job_id, status=CANCELLED, finished_at=datetime.now().isoformat())
+        return True
+
+    def release(self, job_id, owner):
+        """Drop ``owner``'s interest in a job, cancelling it if nobody else waits."""
+        with self._lock:
+            job = self._by_id.get(job_id)
+            if job is None:
+                return
+            job.owners.discard(owner)
+            orphaned = not job.owners
+        if orphaned:
+            self.cancel(job_id)
+
+    def release_owner(self, owner):
+        with self._lock:
+            job_ids = [job.job_id for job in self._by_id.values() if owner in job.owners]
+        for job_id in job_ids:
+            self.release(job_id, owner)
+
+    def active_count(self):
+        with self._lock:
+            return len(self._active)
+
+    def shutdown(self, wait=False):
+        with self._lock:
+            for job in self._by_id.values():
+                job.cancel_event.set()
+        self._pool.shutdown(wait=wait, cancel_futures=True)
+
+
+def _fetch_one(query, params):
+    rows = database.execute_query(query, params, fetch=True)
+    return rows[0] if rows else None
+
+
+_runner = None
+_runner_lock = threading.Lock()
+
+
+def get_runner():
+    global _runner
+    if _runner is None:
+        with _runner_lock:
+            if _runner is None:
+                _runner = JobRunner()
+    return _runner
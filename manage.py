@@ -0,0 +1,220 @@
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+
+import cohort
+import conformance
+import database
+import snapshot
+import storage
+import transfer
+
+
+def cmd_migrate(args):
+    print(f"Schema version {database.get_schema_version()}")
+
+
+def cmd_clean(args):
+    def report(counts):
+        print(f"\r{counts['scanned']}/{counts['total']} scanned, {counts['deleted']} deleted",
+              end='', file=sys.stderr, flush=True)
+
+    counts = database.clean_database(
+        chunk_size=args.chunk_size, workers=args.workers, restart=args.restart,
+        progress=None if args.quiet else report
+    )
+    if not args.quiet and counts['scanned']:
+        print(file=sys.stderr)
+    resumed = " (resumed)" if counts['resumed'] else ""
+    print(f"{counts['deleted']} invalid entries removed out of {counts['scanned']} scanned{resumed}.")
+
+
+def cmd_stats(args):
+    if args.action == 'rebuild':
+        repaired = database.repair_links(args.user)
+        if repaired:
+            print(f"{repaired} entries had food/symptom rows out of step with their JSON; rewritten.")
+        database.rebuild_stats(args.user)
+        print("Statistics rebuilt.")
+        return 0
+    drifted = database.verify_links(args.user)
+    drift = database.verify_stats(args.user)
+    if not drifted and not drift:
+        print("Statistics are up to date.")
+        return 0
+    if drifted:
+        print(f"entry_aliments/entry_symptomes: {len(drifted)} entries differ from their JSON "
+              f"(first ids: {', '.join(map(str, drifted[:10]))})")
+    for table, count in drift.items():
+        print(f"{table}: {count} rows differ")
+    return 1
+
+
+def cmd_export(args):
+    if args.kind == 'entries':
+        count = transfer.export_entries(args.path, args.format, args.user, args.gzip or None)
+    else:
+        count = transfer.export_aliments(args.path, args.format, args.gzip or None)
+    print(f"{count} {args.kind} exported.", file=sys.stderr)
+
+
+def cmd_import(args):
+    try:
+        if args.kind == 'entries':
+            counts = transfer.import_entries(args.path, args.format, args.replace, args.chunk_size, args.gzip or None)
+            print(f"{counts['inserted']} inserted, {counts['updated']} updated, {counts['skipped']} skipped.")
+        else:
+            added = transfer.import_aliments(args.path, args.format, args.chunk_size, args.gzip or None)
+            print(f"{added} aliments added.")
+    except transfer.TransferError as e:
+        print(f"Import stopped: {e}", file=sys.stderr)
+        return 1
+
+
+def cmd_conformance(args):
+    def report(name, error):
+        print(f"{'ok  ' if error is None else 'FAIL'} {name}" + ('' if error is None else f": {error}"))
+
+    backend = args.backend or storage.BACKEND
+    scratch = None
+    if backend == 'sqlite':
+        if not args.db:
+            # Never run the checks against the application database by accident
+            scratch = tempfile.mkdtemp(prefix='conformance-')
+            database.configure_pool(os.path.join(scratch, 'conformance.db'))
+        repository = storage.create_repository('sqlite')
+    else:
+        repository = storage.create_repository(backend, **({'dsn': args.dsn} if args.dsn else {}))
+    try:
+        repository.init_schema()
+        failures = conformance.run_conformance(repository, report)
+    finally:
+        repository.close()
+        if scratch:
+            shutil.rmtree(scratch)
+    print(f"{len(conformance.CHECKS) - len(failures)}/{len(conformance.CHECKS)} checks passed on {backend}.")
+    return 1 if failures else 0
+
+
+def cmd_cohort(args):
+    if args.action == 'benchmark':
+        print("workers  seconds  speedup")
+        for workers, seconds, speedup in cohort.benchmark(args.workers or [1, 2, 4], args.max_lag, args.repeat):
+            print(f"{workers:>7}  {seconds:7.2f}  {speedup:6.2f}x")
+        return 0
+
+    def report(done, total):
+        print(f"\r{done}/{total} shards", end='', file=sys.stderr, flush=True)
+
+    workers = args.workers[0] if args.workers else None
+    result = cohort.cohort_report(
+        args.output, args.max_lag, args.min_support, args.min_users, args.alpha, workers,
+        progress=None if args.quiet else report
+    )
+    if not args.quiet:
+        print(file=sys.stderr)
+    rows = [row for row in result['associations'] if args.symptom in (None, row['symptom'])]
+    for row in rows[:args.limit]:
+        print(f"{row['food']} -> {row['symptom']} (J+{row['lag']}): lift {row['lift']:.2f}, "
+              f"q {row['q_value']:.2g}, {row['users']} users")
+    run = result['run']
+    print(f"{len(result['associations'])} associations over {result['users']} users and {result['entries']} entries "
+          f"in {run['seconds']:.1f}s ({run['shards']} shards, {run['workers']} workers) -> {args.output}")
+
+
+def cmd_snapshot(args):
+    users = args.user or snapshot.snapshot_users()
+    if args.action == 'build':
+        results = {}
+        for user_email in users:
+            outcome = snapshot.compact(user_email, rebuild=args.rebuild)
+            results[outcome] = results.get(outcome, 0) + 1
+        print(', '.join(f"{count} {outcome}" for outcome, count in sorted(results.items())) or "No users.")
+        return 0
+    failed = 0
+    for user_email in users:
+        problems = snapshot.verify(user_email)
+        if problems:
+            failed += 1
+            print(f"{user_email}: {'; '.join(problems)}")
+    print(f"{len(users) - failed}/{len(users)} snapshots are current and intact.")
+    return 1 if failed else 0
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Maintenance commands for the food diary database")
+    parser.add_argument('--db', help=f"database file (default: {database.DB_NAME})")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    subparsers.add_parser('migrate', help="create tables and apply pending migrations").set_defaults(func=cmd_migrate)
+
+    clean = subparsers.add_parser('clean', help="delete entries whose JSON cannot be parsed")
+    clean.add_argument('--chunk-size', type=int, default=database.CLEAN_CHUNK_SIZE, help="entries per committed chunk")
+    clean.add_argument('--workers', type=int, help="validation processes (default: CPU count, 0 validates inline)")
+    clean.add_argument('--restart', action='store_true', help="ignore the checkpoint of an interrupted run")
+    clean.add_argument('--quiet', action='store_true', help="do not report progress")
+    clean.set_defaults(func=cmd_clean)
+
+    stats = subparsers.add_parser('stats', help="rebuild or verify the materialized statistics and food/symptom rows")
+    stats.add_argument('action', choices=['rebuild', 'verify'])
+    stats.add_argument('--user', help="only this user's statistics")
+    stats.set_defaults(func=cmd_stats)
+
+    export = subparsers.add_parser('export', help="stream entries or the aliments catalog to a file")
+    export.add_argument('kind', choices=['entries', 'aliments'])
+    export.add_argument('path', help="output file, '-' for stdout")
+    export.add_argument('--user', action='append', help="only this user's entries (repeatable)")
+    export.set_defaults(func=cmd_export)
+
+    load = subparsers.add_parser('import', help="load entries or aliments from an exported file")
+    load.add_argument('kind', choices=['entries', 'aliments'])
+    load.add_argument('path', help="input file, '-' for stdin")
+    load.add_argument('--replace', action='store_true', help="overwrite days that already exist")
+    load.add_argument('--chunk-size', type=int, default=transfer.IMPORT_CHUNK_SIZE, help="records per transaction")
+    load.set_defaults(func=cmd_import)
+
+    check = subparsers.add_parser('conformance', help="check a storage backend against the repository contract")
+    check.add_argument('--backend', choices=list(storage.BACKENDS), help=f"default: {storage.BACKEND} (FOODDIARY_BACKEND)")
+    check.add_argument('--dsn', help="PostgreSQL connection string (default: FOODDIARY_POSTGRES_DSN)")
+    check.set_defaults(func=cmd_conformance)
+
+    cohorts = subparsers.add_parser('cohort', help="food -> symptom associations across all users")
+    cohorts.add_argument('action', choices=['report', 'benchmark'])
+    cohorts.add_argument('--workers', type=int, nargs='+',
+                        help="worker processes (default: CPU count, 0 counts inline); benchmark takes several")
+    cohorts.add_argument('--max-lag', type=int, default=3, help="days between a food and a symptom")
+    cohorts.add_argument('--min-support', type=int, default=20, help="days a food must be eaten to be tested")
+    cohorts.add_argument('--min-users', type=int, default=cohort.MIN_USERS, help="users a food must be eaten by")
+    cohorts.add_argument('--alpha', type=float, default=0.05, help="false discovery rate")
+    cohorts.add_argument('--symptom', help="only print associations with this symptom")
+    cohorts.add_argument('--limit', type=int, default=20, help="associations printed")
+    cohorts.add_argument('--repeat', type=int, default=3, help="benchmark runs per worker count (best is kept)")
+    cohorts.add_argument('--output', default='cohort_report.json', help="results file")
+    cohorts.add_argument('--quiet', action='store_true', help="do not report progress")
+    cohorts.set_defaults(func=cmd_cohort)
+
+    snapshots = subparsers.add_parser('snapshot', help="build or verify the memory-mapped analysis snapshots")
+    snapshots.add_argument('action', choices=['build', 'verify'])
+    snapshots.add_argument('--user', action='append', help="only this user (repeatable)")
+    snapshots.add_argument('--rebuild', action='store_true', help="rewrite snapshots instead of appending new days")
+    snapshots.set_defaults(func=cmd_snapshot)
+
+    for command in (export, load):
+        command.add_argument('--format', choices=transfer.FORMATS, help="default: from the file extension, else jsonl")
+        command.add_argument('--gzip', action='store_true', help="compress even without a .gz extension")
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    if args.db:
+        database.configure_pool(args.db)
+    if args.func is not cmd_conformance:
+        database.init_db()
+    return args.func(args) or 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
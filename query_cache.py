@@ -0,0 +1,150 @@
+import os
+import pickle
+import threading
+import time
+from collections import OrderedDict
+
+DEFAULT_MAX_BYTES = int(os.environ.get('FOODDIARY_CACHE_BYTES', 32 * 1024 * 1024))
+DEFAULT_TTL = float(os.environ.get('FOODDIARY_CACHE_TTL', 300))
+
+
+class QueryCache:
+    """Per-process LRU for read query results, bounded by TTL and total bytes.
+
+    Values are stored pickled, so every hit hands out a fresh copy that the
+    caller may mutate freely, and the byte budget is exact.
+
+    Each entry belongs to a scope (a user, or the shared food catalog) and may
+    cover a date span; ``invalidate`` drops only the entries of a scope whose
+    span contains the written date. A per-scope generation counter keeps a
+    reader that raced with a writer from storing what it read before the
+    write was committed; ``clear`` bumps a global epoch for the same purpose.
+    """
+
+    def __init__(self, max_bytes=DEFAULT_MAX_BYTES, ttl=DEFAULT_TTL):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._entries = OrderedDict()  # key -> (payload, expires, scope, span)
+        self._scopes = {}              # scope -> set of keys
+        self._generations = {}
+        self._epoch = 0
+        self._lock = threading.Lock()
+        self._bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    @property
+    def enabled(self):
+        return self.max_bytes > 0 and self.ttl > 0
+
+    def fetch(self, key, scope, loader, span=None):
+        if not self.enabled:
+            return loader()
+        with self._lock:
+            item = self._entries.get(key)
+            if item is not None and item[1] > time.monotonic():
+                self._entries.move_to_end(key)
+                self.hits += 1
+                payload = item[0]
+            else:
+                if item is not None:
+                    self._drop(key)
+                self.misses += 1
+                payload = None
+            generation = self._epoch, self._generations.get(scope, 0)
+        if payload is not None:
+            return pickle.loads(payload)
+
+        value = loader()
+        payload = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+        if len(payload) <= self.max_bytes:
+            with self._lock:
+                if (self._epoch, self._generations.get(scope, 0)) == generation:
+                    self._store(key, payload, scope, span)
+        return value
+
+    def __contains__(self, key):
+        with self._lock:
+            item = self._entries.get(key)
+            return item is not None and item[1] > time.monotonic()
+
+    def get(self, key, default=None):
+        """Cached value of ``key`` without loading it on a miss."""
+        if not self.enabled:
+            return default
+        with self._lock:
+            item = self._entries.get(key)
+            if item is None or item[1] <= time.monotonic():
+                self.misses += 1
+                return default
+            self._entries.move_to_end(key)
+            self.hits += 1
+            payload = item[0]
+        return pickle.loads(payload)
+
+    def put(self, key, scope, value, span=None):
+        if not self.enabled:
+            return
+        payload = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+        if len(payload) <= self.max_bytes:
+            with self._lock:
+                self._store(key, payload, scope, span)
+
+    def _store(self, key, payload, scope, span):
+        if key in self._entries:
+            self._drop(key)
+        self._entries[key] = (payload, time.monotonic() + self.ttl, scope, span)
+        self._scopes.setdefault(scope, set()).add(key)
+        self._bytes += len(payload)
+        while self._bytes > self.max_bytes:
+            self._drop(next(iter(self._entries)))
+            self.evictions += 1
+
+    def _drop(self, key):
+        payload, _, scope, _ = self._entries.pop(key)
+        self._bytes -= len(payload)
+        keys = self._scopes.get(scope)
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self._scopes[scope]
+
+    def invalidate(self, scope, date=None):
+        """Drop a scope's entries; with ``date``, only spans containing it."""
+        date = None if date is None else str(date)
+        with self._lock:
+            self._generations[scope] = self._generations.get(scope, 0) + 1
+            for key in list(self._scopes.get(scope, ())):
+                span = self._entries[key][3]
+                if date is None or span is None or _covers(span, date):
+                    self._drop(key)
+                    self.invalidations += 1
+
+    def clear(self):
+        with self._lock:
+            # Every scope, cached or not: a loader may be running for any of them
+            self._epoch += 1
+            self._entries.clear()
+            self._scopes.clear()
+            self._bytes = 0
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+                'evictions': self.evictions,
+                'invalidations': self.invalidations,
+                'entries': len(self._entries),
+                'bytes': self._bytes,
+                'max_bytes': self.max_bytes,
+            }
+
+
+def _covers(span, date):
+    start, end = span
+    return (start is None or start <= date) and (end is None or date <= end)
@@ -0,0 +1,377 @@
+import hashlib
+import json
+import os
+import threading
+import zlib
+from contextlib import contextmanager
+from datetime import datetime
+
+try:
+    import fcntl
+except ImportError:  # Windows: compaction is then only serialized within a process
+    fcntl = None
+
+import numpy as np
+
+import database
+import jobs
+from analytics import CODE_DTYPE, INTENSITY_DTYPE, MEAL_DTYPE, EntryColumns, _intern
+from analytics import load_columns as load_live_columns
+from database import get_db_connection
+from instrumentation import timed
+
+SNAPSHOT_FORMAT = 1
+# Default: a "<database file>.snapshots" directory next to the database
+SNAPSHOT_DIR = os.environ.get('FOODDIARY_SNAPSHOT_DIR')
+ENABLED = os.environ.get('FOODDIARY_SNAPSHOTS', '1').lower() not in ('0', 'false', 'no')
+
+# EntryColumns arrays kept in a snapshot, one raw little-endian file each
+ARRAYS = {
+    'entry_dates': np.dtype('<M8[D]'),
+    'entry_intensity': np.dtype(INTENSITY_DTYPE).newbyteorder('<'),
+    'food_offsets': np.dtype('<i8'),
+    'food_codes': np.dtype(CODE_DTYPE).newbyteorder('<'),
+    'food_meals': np.dtype(MEAL_DTYPE).newbyteorder('<'),
+    'symptom_offsets': np.dtype('<i8'),
+    'symptom_codes': np.dtype(CODE_DTYPE).newbyteorder('<'),
+    'symptom_intensity': np.dtype(INTENSITY_DTYPE).newbyteorder('<'),
+}
+OFFSETS = ('food_offsets', 'symptom_offsets')
+# Interning dictionaries stored in meta.json, and the code arrays they decode
+DICTIONARIES = {'foods': 'food_codes', 'meals': 'food_meals', 'symptoms': 'symptom_codes'}
+
+_compaction_lock = threading.Lock()
+
+
+class SnapshotError(RuntimeError):
+    """A snapshot file is missing, truncated or fails its checksum."""
+
+
+def snapshot_dir():
+    return SNAPSHOT_DIR or database.DB_NAME + '.snapshots'
+
+
+def _user_dir(user_email):
+    return os.path.join(snapshot_dir(), hashlib.sha1(user_email.encode('utf-8')).hexdigest()[:20])
+
+
+@contextmanager
+def _compaction_guard(user_email):
+    """Serialize compactions of one user across threads and processes.
+
+    The thread lock covers this process; an flock on the user's lock file
+    covers ``manage.py snapshot build`` and other server processes.
+    """
+    with _compaction_lock:
+        if fcntl is None:
+            yield
+            return
+        directory = _user_dir(user_email)
+        os.makedirs(directory, exist_ok=True)
+        with open(os.path.join(directory, 'lock'), 'a') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def _array_path(directory, name, generation):
+    return os.path.join(directory, f"{name}.{generation}.bin")
+
+
+def read_meta(user_email):
+    """The snapshot's meta.json if it exists and this code can read it, else None."""
+    try:
+        with open(os.path.join(_user_dir(user_email), 'meta.json'), encoding='utf-8') as f:
+            meta = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if (meta.get('format') != SNAPSHOT_FORMAT or meta.get('schema_version') != database.SCHEMA_VERSION
+            or meta.get('user_email') != user_email):
+        return None
+    return meta
+
+
+def _write_meta(directory, meta):
+    path = os.path.join(directory, 'meta.json')
+    with open(path + '.tmp', 'w', encoding='utf-8') as f:
+        json.dump(meta, f, ensure_ascii=False)
+    os.replace(path + '.tmp', path)
+
+
+def _crc(array):
+    return zlib.crc32(np.ascontiguousarray(array).view(np.uint8))
+
+
+class Snapshot:
+    """A user's EntryColumns memory-mapped from a snapshot, plus its meta data.
+
+    ``data_version`` is the user's data version the snapshot was built at;
+    ``last_entry_id`` the highest entry id it holds.
+    """
+
+    def __init__(self, meta, columns):
+        self.meta = meta
+        self.columns = columns
+
+    @property
+    def data_version(self):
+        return self.meta['data_version']
+
+    def is_current(self):
+        return self.data_version == database.get_data_version(self.meta['user_email'])
+
+    def select(self, start_date=None, end_date=None, symptomatic_only=False):
+        """EntryColumns of a date range, as ``analytics.load_columns`` returns them.
+
+        The whole history is returned as the mapped arrays themselves; a
+        range slices them and renumbers the codes it uses.
+        """
+        columns = self.columns
+        n = len(columns)
+        dates = columns.entry_dates
+        lo = 0 if start_date is None else int(np.searchsorted(dates, np.datetime64(start_date, 'D'), 'left'))
+        hi = n if end_date is None else int(np.searchsorted(dates, np.datetime64(end_date, 'D'), 'right'))
+        if symptomatic_only:
+            index = lo + np.flatnonzero(np.diff(columns.symptom_offsets[lo:hi + 1]) > 0)
+            return _take(columns, index)
+        if lo == 0 and hi == n:
+            return columns
+        return _take(columns, slice(lo, hi))
+
+
+def _rows(offsets, index):
+    """New offsets and the row selection for entries ``index`` (a slice or an index array)."""
+    if isinstance(index, slice):
+        selected = offsets[index.start:index.stop + 1]
+        return selected - selected[0], slice(int(selected[0]), int(selected[-1]))
+    starts, counts = offsets[index], offsets[index + 1] - offsets[index]
+    new_offsets = np.zeros(len(index) + 1, dtype=np.int64)
+    np.cumsum(counts, out=new_offsets[1:])
+    rows = np.repeat(starts - new_offsets[:-1], counts) + np.arange(int(new_offsets[-1]))
+    return new_offsets, rows
+
+
+def _recode(codes, names, dtype):
+    # Number the codes still used by first appearance, like a fresh load
+    new_codes, used = _intern(codes)
+    return new_codes.astype(dtype), [names[i] for i in used.tolist()]
+
+
+def _take(columns, index):
+    food_offsets, food_rows = _rows(columns.food_offsets, index)
+    symptom_offsets, symptom_rows = _rows(columns.symptom_offsets, index)
+    food_codes, foods = _recode(columns.food_codes[food_rows], columns.foods, CODE_DTYPE)
+    food_meals, meals = _recode(columns.food_meals[food_rows], columns.meals, MEAL_DTYPE)
+    symptom_codes, symptoms = _recode(columns.symptom_codes[symptom_rows], columns.symptoms, CODE_DTYPE)
+    return EntryColumns(
+        columns.entry_dates[index], columns.entry_intensity[index],
+        meals, foods, food_offsets, food_codes, food_meals,
+        symptoms, symptom_offsets, symptom_codes, columns.symptom_intensity[symptom_rows],
+    )
+
+
+def _map(path, dtype, length):
+    if not length:
+        return np.zeros(0, dtype=dtype)
+    try:
+        size = os.path.getsize(path)
+    except OSError:
+        raise SnapshotError(f"missing snapshot file {path}") from None
+    if size < length * dtype.itemsize:
+        raise SnapshotError(f"truncated snapshot file {path}")
+    return np.memmap(path, dtype=dtype, mode='r', shape=(length,))
+
+
+@timed(kind='query')
+def open_snapshot(user_email, verify=False):
+    """The user's Snapshot, or None if there is none this code can read.
+
+    Arrays are memory-mapped read-only, nothing is parsed. ``verify``
+    checks every array against its checksum, which reads the files.
+    """
+    meta = read_meta(user_email)
+    if meta is None:
+        return None
+    directory = _user_dir(user_email)
+    arrays = {}
+    for name, dtype in ARRAYS.items():
+        info = meta['arrays'][name]
+        arrays[name] = _map(_array_path(directory, name, meta['generation']), dtype, info['length'])
+        if verify and _crc(arrays[name]) != info['crc32']:
+            raise SnapshotError(f"checksum mismatch in {name} of {user_email}'s snapshot")
+    columns = EntryColumns(
+        arrays['entry_dates'], arrays['entry_intensity'],
+        meta['meals'], meta['foods'], arrays['food_offsets'], arrays['food_codes'], arrays['food_meals'],
+        meta['symptoms'], arrays['symptom_offsets'], arrays['symptom_codes'], arrays['symptom_intensity'],
+    )
+    return Snapshot(meta, columns)
+
+
+def _last_entry_id(user_email):
+    rows = database.execute_query(
+        "SELECT MAX(id) AS last_id FROM entries WHERE user_email = ?", (user_email,), fetch=True
+    )
+    return rows[0]['last_id'] or 0
+
+
+def _last_date(columns):
+    return str(columns.entry_dates[-1]) if len(columns) else None
+
+
+def _write_full(user_email, columns, data_version, last_entry_id, previous):
+    directory = _user_dir(user_email)
+    os.makedirs(directory, exist_ok=True)
+    generation = previous['generation'] + 1 if previous else 1
+    arrays = {}
+    for name, dtype in ARRAYS.items():
+        data = np.ascontiguousarray(getattr(columns, name), dtype=dtype)
+        with open(_array_path(directory, name, generation), 'wb') as f:
+            data.tofile(f)
+        arrays[name] = {'length': len(data), 'crc32': _crc(data)}
+    now = datetime.now().isoformat(timespec='seconds')
+    _write_meta(directory, {
+        'format': SNAPSHOT_FORMAT,
+        'schema_version': database.SCHEMA_VERSION,
+        'user_email': user_email,
+        'generation': generation,
+        'data_version': data_version,
+        'last_entry_id': last_entry_id,
+        'last_date': _last_date(columns),
+        'created_at': now,
+        'updated_at': now,
+        'meals': list(columns.meals),
+        'foods': list(columns.foods),
+        'symptoms': list(columns.symptoms),
+        'arrays': arrays,
+    })
+    # Readers still mapping the old generation keep their open files
+    if previous:
+        for name in ARRAYS:
+            try:
+                os.remove(_array_path(directory, name, previous['generation']))
+            except OSError:
+                pass
+
+
+def _append(user_email, meta, delta, data_version, last_entry_id):
+    """Append days later than the snapshot's last one to its files in place.
+
+    Readers map only the lengths of the meta.json they read, so they never
+    see a half-written append; meta.json is replaced last.
+    """
+    directory = _user_dir(user_email)
+    arrays = meta['arrays']
+    tail = {
+        'entry_dates': delta.entry_dates,
+        'entry_intensity': delta.entry_intensity,
+        'symptom_intensity': delta.symptom_intensity,
+    }
+    for name in OFFSETS:
+        # Offsets continue from the rows already stored
+        tail[name] = getattr(delta, name)[1:] + arrays[name.replace('offsets', 'codes')]['length']
+    for key, codes_name in DICTIONARIES.items():
+        names = meta[key]
+        index = {nom: code for code, nom in enumerate(names)}
+        for nom in getattr(delta, key):
+            if nom not in index:
+                index[nom] = len(names)
+                names.append(nom)
+        mapping = np.array([index[nom] for nom in getattr(delta, key)], dtype=np.int64)
+        tail[codes_name] = mapping[getattr(delta, codes_name)] if len(mapping) else getattr(delta, codes_name)
+
+    for name, dtype in ARRAYS.items():
+        data = np.ascontiguousarray(tail[name], dtype=dtype)
+        info = arrays[name]
+        with open(_array_path(directory, name, meta['generation']), 'r+b') as f:
+            # Drop whatever an interrupted append left past the recorded end
+            f.truncate(info['length'] * dtype.itemsize)
+            f.seek(0, os.SEEK_END)
+            data.tofile(f)
+        info['length'] += len(data)
+        info['crc32'] = zlib.crc32(data.view(np.uint8), info['crc32'])
+    meta.update(
+        data_version=data_version, last_entry_id=last_entry_id, last_date=_last_date(delta),
+        updated_at=datetime.now().isoformat(timespec='seconds'),
+    )
+    _write_meta(directory, meta)
+
+
+@timed(kind='query')
+def compact(user_email, rebuild=False):
+    """Bring the user's snapshot up to date with the database.
+
+    When only new days were added since the snapshot, and all of them come
+    after its last day, they are appended to the files in place; any other
+    change, or ``rebuild``, rewrites the snapshot from the normalized
+    tables. Returns 'fresh', 'appended' or 'rebuilt'.
+    """
+    with _compaction_guard(user_email):
+        # Read the versions before the rows: rows committed in between are
+        # newer than the version recorded, which only causes extra work later
+        data_version, rewritten = database.get_data_versions(user_email)
+        last_entry_id = _last_entry_id(user_email)
+        meta = None if rebuild else read_meta(user_email)
+        if meta is not None and meta['data_version'] == data_version:
+            return 'fresh'
+        if meta is not None and rewritten <= meta['data_version']:
+            delta = load_live_columns(user_email, after_id=meta['last_entry_id'], until_id=last_entry_id)
+            if not len(delta):
+                meta.update(data_version=data_version, updated_at=datetime.now().isoformat(timespec='seconds'))
+                _write_meta(_user_dir(user_email), meta)
+                return 'fresh'
+            if meta['last_date'] is None or str(delta.entry_dates[0]) > meta['last_date']:
+                _append(user_email, meta, delta, data_version, last_entry_id)
+                return 'appended'
+        columns = load_live_columns(user_email, until_id=last_entry_id)
+        _write_full(user_email, columns, data_version, last_entry_id, read_meta(user_email))
+        return 'rebuilt'
+
+
+def verify(user_email):
+    """Problems found with the user's snapshot: unreadable, corrupt or stale."""
+    try:
+        snapshot = open_snapshot(user_email, verify=True)
+    except SnapshotError as e:
+        return [str(e)]
+    if snapshot is None:
+        return ["no snapshot"]
+    live = database.get_data_version(user_email)
+    if snapshot.data_version != live:
+        return [f"stale: built at data version {snapshot.data_version}, database is at {live}"]
+    return []
+
+
+def snapshot_users():
+    with get_db_connection() as conn:
+        return [row[0] for row in conn.execute("SELECT DISTINCT user_email FROM entries ORDER BY user_email")]
+
+
+def _compaction_job(context, user_email):
+    return compact(user_email)
+
+
+jobs.register('snapshot', _compaction_job)
+
+
+def schedule_compaction(user_email):
+    """Compact the user's snapshot on the background job runner (once per data version)."""
+    jobs.get_runner().request('snapshot', user_email, database.get_data_version(user_email), {})
+
+
+def load_columns(user_email, start_date=None, end_date=None, symptomatic_only=False):
+    """``analytics.load_columns``, served from the user's snapshot when it is current.
+
+    Otherwise the rows are read from the database as usual and a compaction
+    is scheduled in the background for the next request.
+    """
+    if ENABLED:
+        try:
+            snapshot = open_snapshot(user_email)
+        except SnapshotError:
+            snapshot = None
+        if snapshot is not None and snapshot.is_current():
+            return snapshot.select(start_date, end_date, symptomatic_only)
+        schedule_compaction(user_email)
+    return load_live_columns(user_email, start_date, end_date, symptomatic_only)
@@ -0,0 +1,446 @@
+import abc
+import itertools
+import os
+import sqlite3
+import threading
+from contextlib import contextmanager
+from datetime import date as date_type
+
+import database
+from auth import hash_password, verify_password
+from db_pool import PoolTimeoutError
+from instrumentation import timed
+
+BACKEND = os.environ.get('FOODDIARY_BACKEND', 'sqlite')
+POSTGRES_DSN = os.environ.get('FOODDIARY_POSTGRES_DSN', 'dbname=fooddiary')
+POSTGRES_POOL_SIZE = int(os.environ.get('FOODDIARY_POSTGRES_POOL_SIZE', 10))
+POSTGRES_POOL_TIMEOUT = float(os.environ.get('FOODDIARY_POSTGRES_POOL_TIMEOUT', 30))
+
+
+class DuplicateEntryError(ValueError):
+    """``add_entry`` for a day the user already has an entry for."""
+
+
+class Repository(abc.ABC):
+    """Persistence the application needs, independent of the database server.
+
+    Entries are ``(date, repas, symptomes_data)`` tuples where ``date`` is a
+    ``datetime.date``; arguments accept dates or ISO strings. Every
+    implementation must pass ``conformance.run_conformance``.
+    """
+
+    # The analysis pages, food suggestions and report jobs read the SQLite
+    # normalized and stats tables directly
+    supports_analytics = False
+
+    def init_schema(self):
+        """Create missing tables; safe to call on every start."""
+
+    def close(self):
+        pass
+
+    @abc.abstractmethod
+    def register_user(self, email, password, first_name, last_name):
+        """True if the account was created, False if the email is taken."""
+
+    @abc.abstractmethod
+    def login_user(self, email, password):
+        """True if the credentials match."""
+
+    @abc.abstractmethod
+    def get_entries(self, user_email):
+        """All of a user's entries, oldest first."""
+
+    @abc.abstractmethod
+    def get_entry(self, user_email, date):
+        """The entry of one day, or None."""
+
+    @abc.abstractmethod
+    def get_entries_between(self, user_email, start_date, end_date):
+        """Entries with start_date <= date <= end_date, oldest first."""
+
+    def prefetch_entries_between(self, user_email, ranges):
+        """Hint that these ``(start_date, end_date)`` ranges will be read soon."""
+
+    @abc.abstractmethod
+    def add_entry(self, user_email, date, aliments, symptomes_data):
+        """Create a day; raises DuplicateEntryError if it exists."""
+
+    @abc.abstractmethod
+    def update_entry(self, user_email, date, aliments, symptomes_data):
+        """Overwrite an existing day; does nothing if there is none."""
+
+    @abc.abstractmethod
+    def delete_entry(self, user_email, date):
+        pass
+
+    @abc.abstractmethod
+    def save_day(self, user_email, date, repas, symptomes_data):
+        """Create or overwrite a day; True if it was created."""
+
+    @abc.abstractmethod
+    def get_aliments(self):
+        """Every name of the shared food catalog."""
+
+    @abc.abstractmethod
+    def add_aliment(self, nom):
+        pass
+
+    @abc.abstractmethod
+    def save_days(self, days, chunk_size=500, replace=True):
+        """Bulk ``save_day`` over (user_email, date, repas, symptomes_data) rows.
+
+        Existing days are overwritten, or skipped unless ``replace``. Returns
+        ``{'inserted', 'updated', 'skipped'}`` counts.
+        """
+
+    @abc.abstractmethod
+    def add_aliments(self, noms, chunk_size=1000):
+        """Bulk ``add_aliment``; returns how many names were new."""
+
+    @abc.abstractmethod
+    def iter_all_entries(self, user_emails=None, page_size=1000):
+        """Stream (user_email, 'YYYY-MM-DD', repas, symptomes_data) in insertion order."""
+
+
+class SQLiteRepository(Repository):
+    """The module-level functions of ``database`` on its SQLite pool."""
+
+    supports_analytics = True
+
+    def __init__(self, db_name=None, **pool_options):
+        if db_name is not None or pool_options:
+            database.configure_pool(db_name, **pool_options)
+
+    def init_schema(self):
+        database.init_db()
+
+    def close(self):
+        database.close_pool()
+
+    def register_user(self, email, password, first_name, last_name):
+        return database.register_user(email, password, first_name, last_name)
+
+    def login_user(self, email, password):
+        return database.login_user(email, password)
+
+    def get_entries(self, user_email):
+        return database.get_entries(user_email)
+
+    def get_entry(self, user_email, date):
+        return database.get_entry(user_email, date)
+
+    def get_entries_between(self, user_email, start_date, end_date):
+        return database.get_entries_between(user_email, start_date, end_date)
+
+    def prefetch_entries_between(self, user_email, ranges):
+        database.prefetch_entries_between(user_email, ranges)
+
+    def add_entry(self, user_email, date, aliments, symptomes_data):
+        try:
+            database.add_entry(user_email, date, aliments, symptomes_data)
+        except sqlite3.IntegrityError:
+            raise DuplicateEntryError(f"{user_email} already has an entry for {date}") from None
+
+    def update_entry(self, user_email, date, aliments, symptomes_data):
+        database.update_entry(user_email, date, aliments, symptomes_data)
+
+    def delete_entry(self, user_email, date):
+        database.delete_entry(user_email, date)
+
+    def save_day(self, user_email, date, repas, symptomes_data):
+        return database.save_day(user_email, date, repas, symptomes_data)
+
+    def get_aliments(self):
+        return database.get_aliments()
+
+    def add_aliment(self, nom):
+        database.add_aliment(nom)
+
+    def save_days(self, days, chunk_size=500, replace=True):
+        return database.save_days(days, chunk_size, replace)
+
+    def add_aliments(self, noms, chunk_size=1000):
+        return database.add_aliments(noms, chunk_size)
+
+    def iter_all_entries(self, user_emails=None, page_size=1000):
+        return database.iter_all_entries(user_emails, page_size)
+
+
+POSTGRES_SCHEMA = '''
+    CREATE TABLE IF NOT EXISTS users (
+        id BIGSERIAL PRIMARY KEY,
+        email TEXT UNIQUE NOT NULL,
+        password TEXT NOT NULL,
+        first_name TEXT NOT NULL,
+        last_name TEXT NOT NULL
+    );
+    CREATE TABLE IF NOT EXISTS entries (
+        id BIGSERIAL PRIMARY KEY,
+        user_email TEXT NOT NULL,
+        date DATE NOT NULL,
+        aliments JSONB NOT NULL,
+        symptomes JSONB NOT NULL,
+        UNIQUE (user_email, date)
+    );
+    CREATE TABLE IF NOT EXISTS aliments (
+        id BIGSERIAL PRIMARY KEY,
+        nom TEXT UNIQUE NOT NULL
+    );
+'''
+
+
+def _as_date(value):
+    return value if isinstance(value, date_type) else date_type.fromisoformat(str(value))
+
+
+def _food_names(*repas_list):
+    names = {}
+    for repas in repas_list:
+        for _, nom in database._split_aliments(repas):
+            names[nom] = None
+    return list(names)
+
+
+class PostgresRepository(Repository):
+    """PostgreSQL storage over a bounded, thread-safe psycopg2 connection pool.
+
+    Needs the optional ``psycopg2`` package. Several frontends can share
+    one server; day-level writes are single upserts on (user_email, date).
+    """
+
+    def __init__(self, dsn=POSTGRES_DSN, max_size=POSTGRES_POOL_SIZE, timeout=POSTGRES_POOL_TIMEOUT):
+        try:
+            import psycopg2
+            from psycopg2 import extras, pool
+        except ImportError:
+            raise RuntimeError("the PostgreSQL backend needs psycopg2 (pip install psycopg2-binary)") from None
+        self._errors = psycopg2.errors
+        self._extras = extras
+        self._pool = pool.ThreadedConnectionPool(1, max_size, dsn)
+        # psycopg2's pool fails instead of waiting when exhausted
+        self._slots = threading.BoundedSemaphore(max_size)
+        self.timeout = timeout
+
+    @contextmanager
+    def _cursor(self, commit=True, name=None):
+        if not self._slots.acquire(timeout=self.timeout):
+            raise PoolTimeoutError(f"no PostgreSQL connection available after {self.timeout}s")
+        try:
+            conn = self._pool.getconn()
+            try:
+                with conn.cursor(name=name) as cursor:
+                    yield cursor
+                if commit:
+                    conn.commit()
+                else:
+                    conn.rollback()
+            except BaseException:
+                conn.rollback()
+                raise
+            finally:
+                self._pool.putconn(conn)
+        finally:
+            self._slots.release()
+
+    def init_schema(self):
+        with self._cursor() as cursor:
+            cursor.execute(POSTGRES_SCHEMA)
+
+    def close(self):
+        self._pool.closeall()
+
+    @timed(kind='auth')
+    def register_user(self, email, password, first_name, last_name):
+        with self._cursor(commit=False) as cursor:
+            cursor.execute("SELECT 1 FROM users WHERE email = %s", (email,))
+            if cursor.fetchone():
+                return False
+        hashed_password = hash_password(password)
+        with self._cursor() as cursor:
+            cursor.execute(
+                "INSERT INTO users (email, password, first_name, last_name) VALUES (%s, %s, %s, %s) "
+                "ON CONFLICT (email) DO NOTHING",
+                (email, hashed_password, first_name, last_name)
+            )
+            return cursor.rowcount == 1
+
+    @timed(kind='auth')
+    def login_user(self, email, password):
+        with self._cursor(commit=False) as cursor:
+            cursor.execute("SELECT password FROM users WHERE email = %s", (email,))
+            row = cursor.fetchone()
+        if row is None:
+            return False
+        return verify_password(row[0], password)
+
+    def _select_entries(self, clause, params):
+        with self._cursor(commit=False) as cursor:
+            cursor.execute(
+                "SELECT date, aliments, symptomes FROM entries WHERE user_email = %s" + clause + " ORDER BY date",
+                params
+            )
+            return [tuple(row) for row in cursor.fetchall()]
+
+    @timed(kind='query')
+    def get_entries(self, user_email):
+        return self._select_entries("", (user_email,))
+
+    @timed(kind='query')
+    def get_entry(self, user_email, date):
+        entries = self._select_entries(" AND date = %s", (user_email, _as_date(date)))
+        return entries[0] if entries else None
+
+    @timed(kind='query')
+    def get_entries_between(self, user_email, start_date, end_date):
+        return self._select_entries(
+            " AND date BETWEEN %s AND %s", (user_email, _as_date(start_date), _as_date(end_date))
+        )
+
+    def _register_foods(self, cursor, names):
+        if names:
+            self._extras.execute_values(
+                cursor, "INSERT INTO aliments (nom) VALUES %s ON CONFLICT (nom) DO NOTHING",
+                [(nom,) for nom in names]
+            )
+
+    @timed(kind='query')
+    def add_entry(self, user_email, date, aliments, symptomes_data):
+        Json = self._extras.Json
+        try:
+            with self._cursor() as cursor:
+                cursor.execute(
+                    "INSERT INTO entries (user_email, date, aliments, symptomes) VALUES (%s, %s, %s, %s)",
+                    (user_email, _as_date(date), Json(aliments), Json(symptomes_data))
+                )
+                self._register_foods(cursor, _food_names(aliments))
+        except self._errors.UniqueViolation:
+            raise DuplicateEntryError(f"{user_email} already has an entry for {date}") from None
+
+    @timed(kind='query')
+    def update_entry(self, user_email, date, aliments, symptomes_data):
+        Json = self._extras.Json
+        with self._cursor() as cursor:
+            cursor.execute(
+                "UPDATE entries SET aliments = %s, symptomes = %s WHERE user_email = %s AND date = %s",
+                (Json(aliments), Json(symptomes_data), user_email, _as_date(date))
+            )
+            if cursor.rowcount:
+                self._register_foods(cursor, _food_names(aliments))
+
+    @timed(kind='query')
+    def delete_entry(self, user_email, date):
+        with self._cursor() as cursor:
+            cursor.execute("DELETE FROM entries WHERE user_email = %s AND date = %s", (user_email, _as_date(date)))
+
+    @timed(kind='query')
+    def save_day(self, user_email, date, repas, symptomes_data):
+        Json = self._extras.Json
+        with self._cursor() as cursor:
+            # xmax is 0 only on a freshly inserted row version
+            cursor.execute(
+                "INSERT INTO entries (user_email, date, aliments, symptomes) VALUES (%s, %s, %s, %s) "
+                "ON CONFLICT (user_email, date) DO UPDATE "
+                "SET aliments = excluded.aliments, symptomes = excluded.symptomes "
+                "RETURNING xmax = 0",
+                (user_email, _as_date(date), Json(repas), Json(symptomes_data))
+            )
+            created = cursor.fetchone()[0]
+            self._register_foods(cursor, _food_names(repas))
+        return created
+
+    @timed(kind='query')
+    def get_aliments(self):
+        with self._cursor(commit=False) as cursor:
+            cursor.execute("SELECT nom FROM aliments ORDER BY id")
+            return [row[0] for row in cursor.fetchall()]
+
+    @timed(kind='query')
+    def add_aliment(self, nom):
+        with self._cursor() as cursor:
+            self._register_foods(cursor, [nom])
+
+    @timed(kind='query')
+    def save_days(self, days, chunk_size=500, replace=True):
+        Json = self._extras.Json
+        conflict = ("DO UPDATE SET aliments = excluded.aliments, symptomes = excluded.symptomes"
+                    if replace else "DO NOTHING")
+        counts = {'inserted': 0, 'updated': 0, 'skipped': 0}
+        iterator = iter(days)
+        while True:
+            chunk = {}
+            for user_email, date, repas, symptomes_data in iterator:
+                key = (user_email, _as_date(date))
+                if key in chunk:
+                    counts['skipped'] += 1
+                chunk[key] = (repas, symptomes_data)
+                if len(chunk) >= chunk_size:
+                    break
+            if not chunk:
+                return counts
+            with self._cursor() as cursor:
+                created = self._extras.execute_values(
+                    cursor,
+                    "INSERT INTO entries (user_email, date, aliments, symptomes) VALUES %s "
+                    f"ON CONFLICT (user_email, date) {conflict} RETURNING xmax = 0",
+                    [(*key, Json(repas), Json(symptomes)) for key, (repas, symptomes) in chunk.items()],
+                    page_size=len(chunk), fetch=True
+                )
+                self._register_foods(cursor, _food_names(*(repas for repas, _ in chunk.values())))
+            inserted = sum(1 for (is_new,) in created if is_new)
+            counts['inserted'] += inserted
+            counts['updated'] += len(created) - inserted
+            counts['skipped'] += len(chunk) - len(created)
+
+    @timed(kind='query')
+    def add_aliments(self, noms, chunk_size=1000):
+        added = 0
+        iterator = iter(noms)
+        while True:
+            chunk = list(dict.fromkeys(itertools.islice(iterator, chunk_size)))
+            if not chunk:
+                return added
+            with self._cursor() as cursor:
+                added += len(self._extras.execute_values(
+                    cursor, "INSERT INTO aliments (nom) VALUES %s ON CONFLICT (nom) DO NOTHING RETURNING id",
+                    [(nom,) for nom in chunk], page_size=len(chunk), fetch=True
+                ))
+
+    def iter_all_entries(self, user_emails=None, page_size=1000):
+        clause, params = "", ()
+        if user_emails:
+            clause, params = " WHERE user_email = ANY(%s)", (list(user_emails),)
+        # A server-side cursor streams the rows page_size at a time
+        with self._cursor(commit=False, name='iter_all_entries') as cursor:
+            cursor.itersize = page_size
+            cursor.execute(
+                "SELECT user_email, date, aliments, symptomes FROM entries" + clause + " ORDER BY id", params
+            )
+            for user_email, day, aliments, symptomes in cursor:
+                yield user_email, day.isoformat(), aliments, symptomes
+
+
+BACKENDS = {
+    'sqlite': SQLiteRepository,
+    'postgres': PostgresRepository,
+}
+
+_repository = None
+_repository_lock = threading.Lock()
+
+
+def create_repository(backend=None, **options):
+    backend = backend or BACKEND
+    if backend not in BACKENDS:
+        raise ValueError(f"unknown storage backend {backend!r} (expected one of {', '.join(BACKENDS)})")
+    return BACKENDS[backend](**options)
+
+
+def get_repository():
+    """The process-wide repository selected by FOODDIARY_BACKEND."""
+    global _repository
+    if _repository is None:
+        with _repository_lock:
+            if _repository is None:
+                _repository = create_repository()
+    return _repository
@@ -0,0 +1,146 @@
+import csv
+import gzip
+import io
+import json
+import sys
+from contextlib import contextmanager
+from datetime import date
+
+import database
+
+FORMATS = ('jsonl', 'csv')
+ENTRY_FIELDS = ('user_email', 'date', 'repas', 'symptomes')
+ALIMENT_FIELDS = ('nom',)
+IMPORT_CHUNK_SIZE = 5000
+
+
+class TransferError(ValueError):
+    """A record of an import file cannot be read."""
+
+
+def detect_format(path, format=None):
+    """``format`` if given, else guessed from the extension (".jsonl", ".csv", optionally ".gz")."""
+    if format:
+        return format
+    name = path[:-3] if path.endswith('.gz') else path
+    for candidate in FORMATS:
+        if name.endswith('.' + candidate):
+            return candidate
+    return 'jsonl'
+
+
+@contextmanager
+def open_text(path, mode, compress=None):
+    """Text stream on ``path`` ('-' for stdin/stdout), gzipped when ``compress``
+    is set or the name ends with ".gz"."""
+    if compress is None:
+        compress = path.endswith('.gz')
+    if path == '-':
+        binary = sys.stdin.buffer if mode == 'r' else sys.stdout.buffer
+        raw = gzip.GzipFile(fileobj=binary, mode=mode + 'b') if compress else binary
+        stream = io.TextIOWrapper(raw, encoding='utf-8', newline='')
+        try:
+            yield stream
+        finally:
+            stream.flush()
+            stream.detach()
+            if compress:
+                raw.close()
+        return
+    if compress:
+        stream = gzip.open(path, mode + 't', encoding='utf-8', newline='')
+    else:
+        stream = open(path, mode, encoding='utf-8', newline='')
+    with stream:
+        yield stream
+
+
+def write_records(stream, records, fields, format):
+    count = 0
+    if format == 'csv':
+        writer = csv.writer(stream)
+        writer.writerow(fields)
+        for record in records:
+            writer.writerow([
+                value if isinstance(value, str) else json.dumps(value, ensure_ascii=False)
+                for value in record
+            ])
+            count += 1
+    else:
+        for record in records:
+            stream.write(json.dumps(dict(zip(fields, record)), ensure_ascii=False))
+            stream.write('\n')
+            count += 1
+    return count
+
+
+def read_records(stream, fields, format):
+    """Yield (line number, {field: raw value}) without loading the file."""
+    if format == 'csv':
+        reader = csv.DictReader(stream)
+        missing = set(fields) - set(reader.fieldnames or ())
+        if missing:
+            raise TransferError(f"missing CSV columns: {', '.join(sorted(missing))}")
+        for record in reader:
+            yield reader.line_num, record
+        return
+    for number, line in enumerate(stream, 1):
+        if not line.strip():
+            continue
+        try:
+            record = json.loads(line)
+        except json.JSONDecodeError as e:
+            raise TransferError(f"line {number}: {e}") from None
+        if not isinstance(record, dict):
+            raise TransferError(f"line {number}: expected an object")
+        yield number, record
+
+
+def _entry_from_record(number, record):
+    try:
+        user_email = record['user_email']
+        day = date.fromisoformat(record['date'])
+        repas, symptomes = record['repas'], record['symptomes']
+        # CSV cells carry the nested values as JSON text
+        if isinstance(repas, str):
+            repas = json.loads(repas)
+        if isinstance(symptomes, str):
+            symptomes = json.loads(symptomes)
+    except (KeyError, TypeError, ValueError) as e:
+        raise TransferError(f"line {number}: invalid entry ({e})") from None
+    if not user_email or not isinstance(repas, dict) or not isinstance(symptomes, dict):
+        raise TransferError(f"line {number}: invalid entry")
+    return user_email, day.isoformat(), repas, symptomes
+
+
+def export_entries(path, format=None, user_emails=None, compress=None):
+    """Stream entries to ``path``; returns the number written."""
+    format = detect_format(path, format)
+    with open_text(path, 'w', compress) as stream:
+        return write_records(stream, database.iter_all_entries(user_emails), ENTRY_FIELDS, format)
+
+
+def export_aliments(path, format=None, compress=None):
+    format = detect_format(path, format)
+    with open_text(path, 'w', compress) as stream:
+        return write_records(stream, ((nom,) for nom in database.iter_aliments()), ALIMENT_FIELDS, format)
+
+
+def import_entries(path, format=None, replace=False, chunk_size=IMPORT_CHUNK_SIZE, compress=None):
+    """Load entries from ``path`` through ``save_days``.
+
+    Days already present for a user are skipped unless ``replace`` is set.
+    Returns the inserted/updated/skipped counts.
+    """
+    format = detect_format(path, format)
+    with open_text(path, 'r', compress) as stream:
+        days = (_entry_from_record(number, record) for number, record in read_records(stream, ENTRY_FIELDS, format))
+        return database.save_days(days, chunk_size=chunk_size, replace=replace)
+
+
+def import_aliments(path, format=None, chunk_size=IMPORT_CHUNK_SIZE, compress=None):
+    """Add the catalog names in ``path``; returns how many were new."""
+    format = detect_format(path, format)
+    with open_text(path, 'r', compress) as stream:
+        noms = (str(record.get('nom') or '').strip() for _, record in read_records(stream, ALIMENT_FIELDS, format))
+        return database.add_aliments((nom for nom in noms if nom), chunk_size=chunk_size)
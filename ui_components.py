@@ -1,18 +1,31 @@
 import streamlit as st
-from streamlit_tags import st_tags
 from datetime import datetime, timedelta
-import pandas as pd
-from database import get_aliments, add_aliment, add_entry, get_entries, update_entry, delete_entry
+from autocomplete import DEFAULT_LIMIT, fold, suggest_foods
+from storage import get_repository
+from instrumentation import timed
 
+@timed(kind='render')
 def saisie_quotidienne(user_email):
+    # streamlit_tags charge NumPy ; inutile tant que l'utilisateur n'est pas connecté
+    from streamlit_tags import st_tags
+
     st.subheader("Saisie quotidienne")
     date = st.date_input("Date")
     
+    repository = get_repository()
     # Fetch existing entry for the selected date
-    entries = get_entries(user_email)
-    existing_entry = next((entry for entry in entries if entry[0] == date), None)
+    existing_entry = repository.get_entry(user_email, date)
 
-    aliments_existants = get_aliments()
+    # Aliments suggérés : historique de l'utilisateur d'abord, liste bornée.
+    # st_tags ne filtre que les suggestions reçues : le champ de recherche
+    # permet d'atteindre les aliments hors de cette liste.
+    recherche = st.text_input("Rechercher un aliment", key="recherche_aliment").strip()
+    if repository.supports_analytics:
+        aliments_existants = suggest_foods(user_email, recherche)
+    else:
+        aliments_existants = [
+            nom for nom in repository.get_aliments() if fold(nom).startswith(fold(recherche))
+        ][:DEFAULT_LIMIT]
     repas = {"Petit Déjeuner": [], "Déjeuner": [], "Goûter": [], "Dîner": []}
     symptomes_data = {"symptomes_specifiques": [], "intensite_douleur": 0, "autres_symptomes": ""}
 
@@ -34,9 +47,6 @@ def saisie_quotidienne(user_email):
             key=f"tags_{repas_nom}"
         )
         repas[repas_nom] = aliments_saisis
-        
-        for aliment in aliments_saisis:
-            add_aliment(aliment)
 
     # Symptoms input
     symptomes_data = saisie_symptomes(symptomes_data)
@@ -45,16 +55,15 @@ def saisie_quotidienne(user_email):
 
     with col1:
         if st.button("Enregistrer" if not existing_entry else "Mettre à jour"):
-            if existing_entry:
-                update_entry(user_email, date, repas, symptomes_data)
-                st.success("Entrée mise à jour avec succès!")
-            else:
-                add_entry(user_email, date, repas, symptomes_data)
+            # Les nouveaux aliments et l'entrée sont enregistrés en une transaction
+            if repository.save_day(user_email, date, repas, symptomes_data):
                 st.success("Entrée enregistrée avec succès!")
+            else:
+                st.success("Entrée mise à jour avec succès!")
 
     with col2:
         if existing_entry and st.button("Réinitialiser"):
-            delete_entry(user_email, date)
+            repository.delete_entry(user_email, date)
             st.success("Entrée réinitialisée. Veuillez rafraîchir la page.")
             st.rerun()
 
@@ -70,6 +79,7 @@ def saisie_quotidienne(user_email):
         st.session_state['form_cleared'] = False
 
 
+@timed(kind='render')
 def saisie_symptomes(existing_data):
     st.subheader("Symptômes/Douleurs")
     
@@ -109,66 +119,175 @@ def saisie_symptomes(existing_data):
 
 
 import streamlit as st
-import pandas as pd
 from datetime import datetime, timedelta
-from database import get_entries
+from storage import get_repository
+from instrumentation import timed
 
-def afficher_historique_calendrier(user_email):
-    st.subheader("Historique hebdomadaire")
-    
-    entries = get_entries(user_email)
-    df = pd.DataFrame(entries, columns=['date', 'aliments', 'symptomes'])
-    df['date'] = pd.to_datetime(df['date'])
-
-    # Sélection de la semaine
-    today = datetime.now().date()
-    start_of_week = today - timedelta(days=today.weekday())
-    selected_week = st.date_input("Sélectionnez une semaine", start_of_week)
-    start_date = pd.to_datetime(selected_week - timedelta(days=selected_week.weekday()))
-    end_date = start_date + timedelta(days=6)
-
-    # Filtrer les données pour la semaine sélectionnée
-    week_data = df[(df['date'] >= start_date) & (df['date'] <= end_date)]
-
-    # Afficher le calendrier
-    for day in pd.date_range(start_date, end_date):
+MODES_CALENDRIER = ("Semaine", "4 semaines", "Mois")
+JOURS_COURTS = ("Lun", "Mar", "Mer", "Jeu", "Ven", "Sam", "Dim")
+
+
+def _debut_semaine(day):
+    return day - timedelta(days=day.weekday())
+
+
+def _debut_mois(day, decalage=0):
+    month = day.month - 1 + decalage
+    return day.replace(year=day.year + month // 12, month=month % 12 + 1, day=1)
+
+
+def plage_calendrier(mode, day):
+    """(début, fin) inclus des jours affichés autour de ``day`` : semaines
+    complètes, du lundi au dimanche."""
+    if mode == "Semaine":
+        start = _debut_semaine(day)
+        return start, start + timedelta(days=6)
+    if mode == "4 semaines":
+        start = _debut_semaine(day)
+        return start, start + timedelta(days=27)
+    first = _debut_mois(day)
+    last = _debut_mois(day, 1) - timedelta(days=1)
+    return _debut_semaine(first), _debut_semaine(last) + timedelta(days=6)
+
+
+def decaler(mode, day, pas):
+    """Jour de référence de la page voisine (``pas`` = -1 ou 1)."""
+    if mode == "Semaine":
+        return day + timedelta(days=7 * pas)
+    if mode == "4 semaines":
+        return day + timedelta(days=28 * pas)
+    return _debut_mois(day, pas)
+
+
+def _changer_page(mode, pas):
+    st.session_state['calendrier_date'] = decaler(mode, st.session_state['calendrier_date'], pas)
+
+
+def _aujourd_hui():
+    st.session_state['calendrier_date'] = datetime.now().date()
+
+
+def _intensite(jours, index):
+    import numpy as np
+
+    intensite = jours.entry_intensity[index]
+    return 'N/A' if np.isnan(intensite) else f"{intensite:g}"
+
+
+def _afficher_jour_detaille(jours, index):
+    st.markdown("### Repas")
+    for repas, aliments in jours.meals_of(index).items():
+        st.markdown(f"**{repas}:** {', '.join(aliments)}")
+
+    st.markdown("### Symptômes")
+    symptomes = jours.symptoms_of(index)
+    if symptomes:
+        st.markdown(", ".join(symptomes))
+
+    st.markdown(f"**Intensité:** {_intensite(jours, index)}")
+
+    # Ajouter une ligne de séparation
+    st.markdown("---")
+
+
+def _afficher_semaine(jours, index_par_jour, start):
+    for offset in range(7):
+        day = start + timedelta(days=offset)
         with st.expander(day.strftime("%A %d/%m"), expanded=True):
-            day_data = week_data[week_data['date'].dt.date == day.date()]
-            if not day_data.empty:
-                for _, row in day_data.iterrows():
-                    st.markdown("### Repas")
-                    for repas, aliments in row['aliments'].items():
-                        if aliments:
-                            st.markdown(f"**{repas}:** {', '.join(aliments)}")
-                    
-                    st.markdown("### Symptômes")
-                    symptomes = row['symptomes'].get('symptomes_specifiques', [])
-                    if symptomes:
-                        st.markdown(", ".join(symptomes))
-                    
-                    intensite = row['symptomes'].get('intensite_douleur', 'N/A')
-                    st.markdown(f"**Intensité:** {intensite}")
-                    
-                    # Ajouter une ligne de séparation
-                    st.markdown("---")
+            index = index_par_jour.get(day)
+            if index is not None:
+                _afficher_jour_detaille(jours, index)
             else:
                 st.info("Pas de données pour ce jour")
+
+
+def _afficher_grille(jours, index_par_jour, start, end, mois=None):
+    """Une ligne de 7 cases par semaine ; le détail d'un jour est dans sa bulle."""
+    for col, nom in zip(st.columns(7), JOURS_COURTS):
+        col.markdown(f"**{nom}**")
+    day = start
+    while day <= end:
+        for col in st.columns(7):
+            with col.container(border=True):
+                hors_mois = mois is not None and day.month != mois
+                st.markdown(f"*{day.day}*" if hors_mois else f"**{day.day}**")
+                index = index_par_jour.get(day)
+                if index is None:
+                    st.caption("—")
+                else:
+                    symptomes = jours.symptoms_of(index)
+                    st.caption(", ".join(symptomes) if symptomes else "Aucun symptôme")
+                    with st.popover("Détails"):
+                        st.markdown(f"**{day.strftime('%A %d/%m/%Y')}**")
+                        _afficher_jour_detaille(jours, index)
+            day += timedelta(days=1)
+
+
+@timed(kind='render')
+def afficher_historique_calendrier(user_email):
+    from analytics import columns_from_entries
+
+    st.subheader("Historique")
+
+    mode = st.radio("Affichage", MODES_CALENDRIER, horizontal=True, key='calendrier_mode')
+    if 'calendrier_date' not in st.session_state:
+        st.session_state['calendrier_date'] = datetime.now().date()
+    col_prec, col_date, col_auj, col_suiv = st.columns([1, 3, 1, 1])
+    col_prec.button("◀", key='calendrier_prec', on_click=_changer_page, args=(mode, -1), help="Page précédente")
+    col_date.date_input("Aller au", key='calendrier_date', label_visibility='collapsed')
+    col_auj.button("Aujourd'hui", key='calendrier_auj', on_click=_aujourd_hui)
+    col_suiv.button("▶", key='calendrier_suiv', on_click=_changer_page, args=(mode, 1), help="Page suivante")
+
+    day = st.session_state['calendrier_date']
+    start_date, end_date = plage_calendrier(mode, day)
+
+    # Ne charger que les jours affichés, indexés par date
+    repository = get_repository()
+    jours = columns_from_entries(repository.get_entries_between(user_email, start_date, end_date))
+    index_par_jour = jours.day_index()
+
+    if mode == "Semaine":
+        _afficher_semaine(jours, index_par_jour, start_date)
+    else:
+        st.markdown(f"**{start_date.strftime('%d/%m/%Y')} – {end_date.strftime('%d/%m/%Y')}**")
+        _afficher_grille(jours, index_par_jour, start_date, end_date,
+                         mois=day.month if mode == "Mois" else None)
+
+    # Les pages voisines se chargent en arrière-plan pendant la lecture
+    repository.prefetch_entries_between(user_email, [
+        plage_calendrier(mode, decaler(mode, day, -1)),
+        plage_calendrier(mode, decaler(mode, day, 1)),
+    ])
                 
                 
 import streamlit as st
-from streamlit_tags import st_tags
 from datetime import datetime
-from database import get_aliments, add_aliment, add_entry, get_entries, update_entry, delete_entry
+from autocomplete import DEFAULT_LIMIT, fold, suggest_foods
+from storage import get_repository
+from instrumentation import timed
 
+@timed(kind='render')
 def saisie_quotidienne(user_email):
+    # streamlit_tags charge NumPy ; inutile tant que l'utilisateur n'est pas connecté
+    from streamlit_tags import st_tags
+
     st.subheader("Saisie quotidienne")
     date = st.date_input("Date")
     
+    repository = get_repository()
     # Fetch existing entry for the selected date
-    entries = get_entries(user_email)
-    existing_entry = next((entry for entry in entries if entry[0] == date), None)
+    existing_entry = repository.get_entry(user_email, date)
 
-    aliments_existants = get_aliments()
+    # Aliments suggérés : historique de l'utilisateur d'abord, liste bornée.
+    # st_tags ne filtre que les suggestions reçues : le champ de recherche
+    # permet d'atteindre les aliments hors de cette liste.
+    recherche = st.text_input("Rechercher un aliment", key="recherche_aliment").strip()
+    if repository.supports_analytics:
+        aliments_existants = suggest_foods(user_email, recherche)
+    else:
+        aliments_existants = [
+            nom for nom in repository.get_aliments() if fold(nom).startswith(fold(recherche))
+        ][:DEFAULT_LIMIT]
     repas = {"Petit Déjeuner": [], "Déjeuner": [], "Goûter": [], "Dîner": []}
     symptomes_data = {"symptomes_specifiques": [], "intensite_douleur": 0, "autres_symptomes": ""}
 
@@ -189,9 +308,6 @@ def saisie_quotidienne(user_email):
             key=f"tags_{repas_nom}"
         )
         repas[repas_nom] = aliments_saisis
-        
-        for aliment in aliments_saisis:
-            add_aliment(aliment)
 
     symptomes_data = saisie_symptomes(symptomes_data)
 
@@ -199,16 +315,15 @@ def saisie_quotidienne(user_email):
 
     with col1:
         if st.button("Enregistrer" if not existing_entry else "Mettre à jour"):
-            if existing_entry:
-                update_entry(user_email, date, repas, symptomes_data)
-                st.success("Entrée mise à jour avec succès!")
-            else:
-                add_entry(user_email, date, repas, symptomes_data)
+            # Les nouveaux aliments et l'entrée sont enregistrés en une transaction
+            if repository.save_day(user_email, date, repas, symptomes_data):
                 st.success("Entrée enregistrée avec succès!")
+            else:
+                st.success("Entrée mise à jour avec succès!")
 
     with col2:
         if existing_entry and st.button("Réinitialiser"):
-            delete_entry(user_email, date)
+            repository.delete_entry(user_email, date)
             st.success("Entrée réinitialisée. Veuillez rafraîchir la page.")
             st.rerun()
 
@@ -223,6 +338,7 @@ def saisie_quotidienne(user_email):
                 del st.session_state[key]
         st.session_state['form_cleared'] = False
 
+@timed(kind='render')
 def saisie_symptomes(existing_data):
     st.subheader("Symptômes/Douleurs")
     
@@ -253,3 +369,32 @@ def saisie_symptomes(existing_data):
         "intensite_douleur": intensite_douleur,
         "autres_symptomes": autres_symptomes
     }
+
+
+def afficher_debug_panel(stats):
+    """Barre latérale de diagnostic (FOODDIARY_PROFILE=1) pour le rerun en cours."""
+    import pandas as pd
+    import instrumentation
+    from database import cache_stats
+    from data_analysis import figure_cache
+
+    with st.sidebar.expander("Performance", expanded=False):
+        current = stats.as_dict()
+        col1, col2 = st.columns(2)
+        col1.metric("Requêtes SQL", current['queries'])
+        col2.metric("Lignes", current['rows'])
+        col1.metric("Temps (ms)", f"{current['wall_ms']:.1f}")
+        col2.metric("JSON (ms)", f"{current['json_ms']:.1f}")
+        calls = sorted(current['calls'].items(), key=lambda item: -item[1]['total_ms'])
+        st.dataframe(
+            pd.DataFrame(
+                [(name, c['count'], c['total_ms']) for name, c in calls],
+                columns=['fonction', 'appels', 'ms']
+            ),
+            hide_index=True
+        )
+        st.json({'requêtes': cache_stats(), 'figures': figure_cache.stats()}, expanded=False)
+        if st.button("Exporter les histogrammes"):
+            path = instrumentation.export_histograms()
+            st.success(f"Histogrammes exportés dans {path}")
+
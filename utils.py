@@ -1,5 +1,7 @@
 import json
+from instrumentation import timed_json
 
+@timed_json
 def safe_json_loads(s):
     try:
         return json.loads(s)